@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, LogMensagemIA
+from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, LogMensagemIA, ReservaTemporaria, ListaEspera, TarefaWhatsApp, ModeloMensagem, MensagemRecebidaWhatsApp, MensagemConversa
 
 @admin.register(Agendamento)
 class AgendamentoAdmin(admin.ModelAdmin):
@@ -37,6 +37,40 @@ class ExcecaoHorarioAdmin(admin.ModelAdmin):
     def get_conta(self, obj):
         return obj.profissional.conta
 
+@admin.register(ReservaTemporaria)
+class ReservaTemporariaAdmin(admin.ModelAdmin):
+    list_display = ('profissional', 'paciente', 'data_hora_inicio', 'expira_em')
+    list_filter = ('profissional__conta',)
+
+@admin.register(ListaEspera)
+class ListaEsperaAdmin(admin.ModelAdmin):
+    list_display = ('paciente', 'conta', 'profissional', 'dia_semana', 'periodo', 'ativo', 'notificado_em', 'criado_em')
+    list_filter = ('conta', 'ativo', 'dia_semana', 'periodo')
+
+@admin.register(ModeloMensagem)
+class ModeloMensagemAdmin(admin.ModelAdmin):
+    list_display = ('conta', 'chave', 'reescrever_com_ia', 'atualizado_em')
+    list_filter = ('chave', 'reescrever_com_ia')
+
+@admin.register(TarefaWhatsApp)
+class TarefaWhatsAppAdmin(admin.ModelAdmin):
+    list_display = ('telefone', 'destinatario', 'status', 'prioridade', 'resultado', 'tentativas', 'agrupada_em', 'criado_em', 'concluido_em')
+    list_filter = ('status', 'prioridade')
+    search_fields = ('telefone', 'corpo')
+
+@admin.register(MensagemConversa)
+class MensagemConversaAdmin(admin.ModelAdmin):
+    list_display = ('paciente', 'autor', 'texto', 'criado_em')
+    list_filter = ('autor', 'paciente__conta')
+    search_fields = ('paciente__nome_completo', 'texto')
+    raw_id_fields = ('paciente',)
+
+@admin.register(MensagemRecebidaWhatsApp)
+class MensagemRecebidaWhatsAppAdmin(admin.ModelAdmin):
+    list_display = ('message_sid', 'status', 'tarefa', 'criado_em')
+    search_fields = ('message_sid',)
+    readonly_fields = ('message_sid', 'status', 'tarefa', 'criado_em')
+
 @admin.register(LogMensagemIA)
 class LogMensagemIAAdmin(admin.ModelAdmin):
     list_display = ('get_profissional', 'get_conta', 'data_envio')
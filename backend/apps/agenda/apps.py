@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AgendaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.agenda'
+
+    def ready(self):
+        # Importa os sinais que mantêm o cache de disponibilidade e o índice do FAQ atualizados
+        import apps.agenda.signals
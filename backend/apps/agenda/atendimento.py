@@ -0,0 +1,375 @@
+"""
+Atendimento das mensagens recebidas pelo WhatsApp.
+
+Todo o fluxo é assíncrono: consultas pelo ORM assíncrono do Django, chamadas à Gemini
+pelo cliente `aio` e envio pela Twilio com o cliente HTTP assíncrono. Assim um único
+processo (o webhook sob ASGI ou o worker da fila) mantém várias conversas em andamento
+ao mesmo tempo. As operações que dependem de transação (reserva de horários, busca na
+agenda) continuam síncronas e são chamadas com sync_to_async.
+
+Quando a mensagem menciona dia, período ou hora, a busca de horários começa no pool de
+threads junto com a análise da mensagem; se a intenção for de agendamento com as mesmas
+preferências, o resultado já está pronto. Os tempos de cada etapa são impressos no log.
+
+Os handlers retornam um dicionário com o "status" do atendimento.
+"""
+import asyncio
+import re
+import time as cronometro
+import traceback
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from apps.users.models import Paciente, Conta
+from .ia_manager import GeminiAIManager
+from .contexto_conta import obter_contexto_conta
+from .models import Agendamento, FeedbackNPS
+from .disponibilidade import buscar_horarios_conta
+from .reservas import reservar_horario, segurar_horarios, TEMPO_RESERVA_TEMPORARIA
+from .lista_espera import inscrever_na_lista_espera, avisar_lista_espera, ofertas_lista_espera, descartar_ofertas_lista_espera
+from .escolha_horario import formatar_horarios_numerados
+from .formatacao_datas import data_e_hora_por_extenso
+from .interpretador_horarios import interpretar_preferencias
+from .historico_conversa import registrar_conversa
+from .whatsapp import responder_paciente_via_whatsapp_async
+
+CAMPOS_PREFERENCIAS = ('dia_semana', 'periodo', 'hora', 'data')
+
+
+class TemposAtendimento:
+    """
+    Início e fim de cada etapa do atendimento, em ms desde a chegada da mensagem.
+    Etapas que correm em paralelo aparecem com intervalos sobrepostos.
+    """
+
+    def __init__(self):
+        self.inicio = cronometro.perf_counter()
+        self.etapas = []
+
+    def agora(self):
+        return (cronometro.perf_counter() - self.inicio) * 1000
+
+    @asynccontextmanager
+    async def medir(self, etapa):
+        comeco = self.agora()
+        try:
+            yield
+        finally:
+            self.etapas.append((etapa, comeco, self.agora()))
+
+    def resumo(self):
+        etapas = [f"{etapa} {comeco:.0f}-{fim:.0f} ms" for etapa, comeco, fim in sorted(self.etapas, key=lambda e: e[1])]
+        return " | ".join(etapas + [f"total {self.agora():.0f} ms"])
+
+
+def _buscar_horarios_em_paralelo(conta, **parametros):
+    """ Roda numa thread do pool, fora da thread das demais operações síncronas; fecha a conexão ao terminar. """
+    try:
+        return buscar_horarios_conta(conta, **parametros)
+    finally:
+        close_old_connections()
+
+
+@dataclass
+class BuscaEspeculativa:
+    """ Busca de horários iniciada antes de a intenção ser conhecida. """
+    preferencias: dict
+    tarefa: asyncio.Task
+
+    async def aproveitar(self, preferencias):
+        """ Horários encontrados, se a busca foi feita com as mesmas preferências; senão None. """
+        if any(self.preferencias.get(campo) != preferencias.get(campo) for campo in CAMPOS_PREFERENCIAS):
+            return None
+        try:
+            return await self.tarefa
+        except Exception as e:
+            print(f"--> Busca especulativa falhou ({e}); refazendo a busca.")
+            return None
+
+    def descartar(self):
+        if not self.tarefa.done():
+            self.tarefa.cancel()
+        elif not self.tarefa.cancelled():
+            self.tarefa.exception()  # Evita o aviso de exceção não recuperada
+
+
+def _parametros_busca(perfil, paciente):
+    # Busca entre todos os profissionais da conta, oferecendo cada horário uma única vez
+    return {
+        'servico': perfil.servico_padrao, 'intervalo': perfil.intervalo_entre_sessoes,
+        'um_por_horario': True, 'paciente_id': paciente.id,
+    }
+
+
+class AtendimentoWhatsApp:
+
+    async def processar_mensagem(self, remetente_num, destinatario_num, corpo_mensagem_original):
+        """
+        Processa uma mensagem recebida: identifica conta e paciente, chama a IA e responde pelo WhatsApp.
+        Usado pelo webhook ou pelo worker da fila (ver processar_fila_whatsapp).
+        """
+        try:
+            conta = await Conta.objects.select_related('proprietario').aget(whatsapp_number=destinatario_num)
+
+            paciente, is_new_contact = await Paciente.objects.aget_or_create(
+                conta=conta,
+                contato_telefone__contains=remetente_num,
+                defaults={'cadastrado_por': conta.proprietario, 'nome_completo': 'Novo Contato'}
+            )
+            # Reaproveita a conta já carregada (com o proprietário) em vez de buscá-la de novo.
+            paciente.conta = conta
+
+            # A mensagem e as respostas enviadas entram no histórico da conversa ao final do atendimento.
+            async with registrar_conversa(paciente.id, corpo_mensagem_original):
+                return await self._atender(paciente, conta, corpo_mensagem_original)
+
+        except Conta.DoesNotExist:
+            print(f"--> Erro Crítico: Nenhum profissional/conta associado ao número de destino {destinatario_num}")
+            return {"status": "conta_nao_encontrada"}
+        except Exception as e:
+            traceback.print_exc()
+            return {"status": "erro_geral", "mensagem": str(e)}
+
+    async def _atender(self, paciente, conta, corpo_mensagem_original):
+        """ Encaminha a mensagem conforme o estado da conversa do paciente. """
+        ai_manager = GeminiAIManager(profissional=conta.proprietario)
+
+        if paciente.conversation_state and paciente.conversation_state.startswith('AWAITING_NPS_'):
+            return await self.handle_nps_response(paciente, corpo_mensagem_original)
+
+        # Uma proposta da lista de espera em aberto tem precedência: o "SIM" responde a ela, e não ao lembrete.
+        ofertas = await sync_to_async(ofertas_lista_espera)(paciente)
+        agendamento_pendente = await Agendamento.objects.filter(
+            paciente=paciente, status__in=['Agendado'],
+            data_hora_inicio__gte=timezone.now()
+        ).order_by('data_hora_inicio').afirst()
+        if agendamento_pendente and not ofertas and corpo_mensagem_original.upper() in ['SIM', 'NÃO', 'REAGENDAR']:
+            agendamento_pendente.paciente = paciente
+            return await self.handle_lembrete_response(agendamento_pendente, corpo_mensagem_original.upper(), ai_manager)
+
+        if paciente.onboarding_step:
+            return await self.handle_onboarding(paciente, corpo_mensagem_original, ai_manager)
+
+        tempos = TemposAtendimento()
+        busca = await self._iniciar_busca_especulativa(conta, paciente, corpo_mensagem_original, tempos)
+        try:
+            horarios_oferecidos = ofertas or await cache.aget(f"horarios_oferecidos_{paciente.id}") or []
+            async with tempos.medir('análise'):
+                analise = await ai_manager.analisar_mensagem(corpo_mensagem_original, conta, horarios_oferecidos, paciente.id)
+            print(f"--> Intenção Identificada ({analise.origem}): {analise.intencao}")
+
+            return await self.handle_paciente_existente(
+                paciente, corpo_mensagem_original, analise.intencao, ai_manager, analise, busca, tempos
+            )
+        finally:
+            if busca:
+                busca.descartar()
+            print(f"--> Tempos: {tempos.resumo()}")
+
+    async def _iniciar_busca_especulativa(self, conta, paciente, corpo_mensagem, tempos):
+        """
+        Começa a busca de horários com as preferências que aparecem na mensagem, sem esperar a análise.
+        Só é iniciada quando a mensagem menciona dia, período ou hora e a assinatura está ativa.
+        """
+        preferencias = interpretar_preferencias(corpo_mensagem, estrito=False)
+        if not preferencias:
+            return None
+        contexto = await obter_contexto_conta(conta.id)
+        if contexto['situacao_assinatura'] != 'ativa':
+            return None
+
+        parametros = _parametros_busca(contexto['perfil'], paciente)
+
+        async def buscar():
+            async with tempos.medir('busca de horários (especulativa)'):
+                return await sync_to_async(_buscar_horarios_em_paralelo, thread_sensitive=False)(
+                    conta, preferencias=preferencias, **parametros
+                )
+        return BuscaEspeculativa(preferencias, asyncio.create_task(buscar()))
+
+    async def handle_nps_response(self, paciente, corpo_mensagem):
+        try:
+            nota = int(re.search(r'\d+', corpo_mensagem).group())
+            if 0 <= nota <= 10:
+                agendamento_id = paciente.conversation_state.split('_')[-1]
+                agendamento = await Agendamento.objects.aget(id=agendamento_id)
+                await FeedbackNPS.objects.acreate(paciente=paciente, profissional_id=agendamento.profissional_id, agendamento=agendamento, nota=nota)
+                paciente.conversation_state = None
+                await paciente.asave()
+                resposta_ia = "Muito obrigado pelo seu feedback!"
+                await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+                return {"status": "nps_recorded"}
+        except (ValueError, AttributeError, Agendamento.DoesNotExist):
+            resposta_ia = "Não entendi sua resposta. Por favor, responda apenas com um número de 0 a 10."
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "nps_invalid_response"}
+        return {"status": "nps_error"}
+
+    async def handle_lembrete_response(self, agendamento, resposta, ai_manager):
+        if resposta == 'SIM':
+            agendamento.status = 'Confirmado'
+            await agendamento.asave()
+            await responder_paciente_via_whatsapp_async(agendamento.paciente.contato_telefone, "Obrigado por confirmar! Sua consulta está garantida.")
+            return {"status": "confirmado"}
+        if resposta in ['NÃO', 'REAGENDAR']:
+            agendamento.status = 'Cancelado'
+            await agendamento.asave()
+            await sync_to_async(avisar_lista_espera)(agendamento)
+            return await self.handle_paciente_existente(agendamento.paciente, "gostaria de agendar", "AGENDAR", ai_manager)
+        return {"status": "lembrete_error"}
+
+    async def handle_onboarding(self, paciente, corpo_mensagem, ai_manager):
+        if paciente.onboarding_step == 'AWAITING_NAME':
+            # MELHORIA: Remove "Meu nome é" se o paciente incluir na resposta
+            nome_limpo = re.sub(r'^(meu nome é|me chamo)\s*', '', corpo_mensagem, flags=re.IGNORECASE).strip()
+            paciente.nome_completo = nome_limpo
+            paciente.onboarding_step = 'AWAITING_DETAILS'
+            await paciente.asave()
+            resposta_ia = await ai_manager.gerar_pergunta_onboarding(paciente.nome_completo.split(' ')[0])
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "onboarding_asked_details"}
+
+        elif paciente.onboarding_step == 'AWAITING_DETAILS':
+            dados = ai_manager.extrair_dados_onboarding(corpo_mensagem)
+            if dados.get('cpf'):
+                paciente.cpf = dados['cpf']
+            if dados.get('data_nascimento'):
+                try:
+                    data_nasc = datetime.strptime(dados['data_nascimento'], '%d/%m/%Y').strftime('%Y-%m-%d')
+                    paciente.data_nascimento = data_nasc
+                except ValueError:
+                    pass
+            paciente.onboarding_step = None
+            await paciente.asave()
+            resposta_ia = "Obrigado! Suas informações foram salvas com sucesso. Se precisar de mais alguma coisa, é só chamar!"
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "onboarding_complete"}
+        return {"status": "onboarding_unknown_step"}
+
+    async def handle_paciente_existente(self, paciente, corpo_mensagem_original, intent, ai_manager, analise=None,
+                                        busca_especulativa=None, tempos=None):
+        """
+        `analise` é o resultado de GeminiAIManager.analisar_mensagem; quando presente, o horário escolhido
+        e as preferências já extraídos são usados sem novas chamadas à Gemini. `busca_especulativa` traz
+        a busca de horários iniciada junto com a análise, aproveitada quando as preferências coincidem.
+        """
+        print(f"--> Ação: Lidando com paciente: {paciente.nome_completo or 'Novo Contato'} | Intenção: {intent}")
+        conta = paciente.conta
+        tempos = tempos or TemposAtendimento()
+
+        # Assinatura e perfil vêm do retrato da conta no cache, sem consultar o banco a cada mensagem.
+        contexto = await obter_contexto_conta(conta.id)
+        if contexto['situacao_assinatura'] != 'ativa':
+            return {"status": contexto['situacao_assinatura']}
+
+        perfil = contexto['perfil']
+        cache_key = f"horarios_oferecidos_{paciente.id}"
+        # Preferências (PreferenciaHorario) da busca que gerou os horários oferecidos, usadas nas alternativas.
+        cache_key_preferencias = f"preferencias_horario_{paciente.id}"
+
+        if intent == "ESCOLHEU_HORARIO":
+            horario_escolhido = analise.horario_escolhido if analise else None
+
+            if horario_escolhido:
+                # Os horários oferecidos vêm do cache; a reserva confere o conflito no banco com a agenda bloqueada.
+                preferencias = await cache.aget(cache_key_preferencias)
+                reserva = await sync_to_async(reservar_horario)(
+                    paciente, horario_escolhido['profissional_id'], horario_escolhido['inicio'], horario_escolhido['fim'],
+                    servico=perfil.servico_padrao, intervalo=perfil.intervalo_entre_sessoes, preferencias=preferencias
+                )
+                if not reserva.sucesso:
+                    print(f"--> Conflito na reserva: {reserva.motivo_conflito}")
+                    await sync_to_async(descartar_ofertas_lista_espera)(paciente)
+                    await cache.aset_many({cache_key: reserva.alternativas, cache_key_preferencias: preferencias}, TEMPO_RESERVA_TEMPORARIA)
+                    if reserva.alternativas:
+                        texto_horarios = formatar_horarios_numerados([h['inicio'] for h in reserva.alternativas])
+                        resposta_ia = f"Puxa, esse horário acabou de ser preenchido. Tenho estas outras opções:\n{texto_horarios}\nQual fica melhor para você? É só responder com o número."
+                    else:
+                        resposta_ia = "Puxa, esse horário acabou de ser preenchido e não encontrei outros horários livres nos próximos dias. Gostaria de tentar outro dia ou período?"
+                    await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+                    return {"status": "horario_indisponivel"}
+
+                if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
+                    paciente.onboarding_step = 'AWAITING_NAME'
+                    await paciente.asave()
+                    resposta_ia = await ai_manager.gerar_pergunta_nome_completo()
+                else:
+                    data_local_formatada = data_e_hora_por_extenso(horario_escolhido['inicio'])
+                    resposta_ia = f"Perfeito, {paciente.nome_completo.split(' ')[0]}! Seu agendamento para {data_local_formatada} está confirmado. Até lá!"
+
+                await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+                await cache.adelete_many([cache_key, cache_key_preferencias])
+                return {"status": "agendamento_criado"}
+            else:
+                # MELHORIA: Se não escolheu um horário válido, trata como uma nova preferência
+                intent = "AGENDAR_COM_PREFERENCIA"
+
+        if intent == "AGENDAR_COM_PREFERENCIA":
+            if analise and analise.preferencias is not None:
+                preferencias = analise.preferencias
+            else:
+                preferencias = await ai_manager.extrair_preferencias(corpo_mensagem_original)
+            horarios = await busca_especulativa.aproveitar(preferencias) if busca_especulativa else None
+            if horarios is None:
+                async with tempos.medir('busca de horários'):
+                    horarios = await sync_to_async(buscar_horarios_conta)(
+                        conta, preferencias=preferencias, **_parametros_busca(perfil, paciente)
+                    )
+            # Segura os horários oferecidos para que não sejam oferecidos em outras conversas enquanto o paciente decide
+            await sync_to_async(segurar_horarios)(paciente, horarios)
+            if not horarios:
+                await sync_to_async(inscrever_na_lista_espera)(paciente, preferencias)
+            await sync_to_async(descartar_ofertas_lista_espera)(paciente)
+            await cache.aset_many({cache_key: horarios, cache_key_preferencias: preferencias}, TEMPO_RESERVA_TEMPORARIA)
+            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "você"
+            async with tempos.medir('resposta'):
+                resposta_ia = await ai_manager.gerar_resposta_com_horarios(nome_para_resposta, [h['inicio'] for h in horarios])
+                await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "horarios_enviados"}
+
+        elif intent == "AGENDAR":
+            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "você"
+            resposta_ia = await ai_manager.gerar_pergunta_preferencia(nome_para_resposta)
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "aguardando_preferencia"}
+
+        elif intent == "SAUDACAO":
+            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "tudo bem?"
+            resposta_ia = f"Olá, {nome_para_resposta}! Sou a assistente virtual do(a) {conta.nome_conta}. Como posso te ajudar hoje?"
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "saudacao_respondida"}
+
+        elif intent == "VERIFICAR_PENDENCIAS":
+            if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
+                resposta_ia = "Para verificar informações financeiras, primeiro preciso que você se identifique. Por favor, me informe seu nome completo."
+                paciente.onboarding_step = 'AWAITING_NAME'
+                await paciente.asave()
+            else:
+                resposta_ia = await ai_manager.buscar_e_responder_pendencias(paciente)
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "pendencias_verificadas"}
+
+        elif intent in ['solicitar_receita', 'solicitar_atestado', 'solicitar_recibo']:
+            if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
+                resposta_ia = "Para solicitar documentos, primeiro preciso que você se identifique. Por favor, me informe seu nome completo."
+                paciente.onboarding_step = 'AWAITING_NAME'
+                await paciente.asave()
+            else:
+                resposta_ia = await ai_manager.registrar_solicitacao_paciente(intent, conta, paciente)
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "solicitacao_registrada"}
+
+        elif intent == "DESCONHECIDO":
+            resposta_ia = await ai_manager.gerar_mensagem_encaminhamento()
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "encaminhado_humano"}
+
+        else: # FAQ
+            resposta_ia = await ai_manager.buscar_e_gerar_resposta_faq(intent, conta)
+            await responder_paciente_via_whatsapp_async(paciente.contato_telefone, resposta_ia)
+            return {"status": "faq_respondido"}
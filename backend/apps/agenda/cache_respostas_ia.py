@@ -0,0 +1,82 @@
+"""
+Cache das respostas geradas pela Gemini para prompts que se repetem.
+
+As respostas do FAQ e as mensagens fixas reescritas pela IA (ver modelos_mensagem)
+dependem só do texto do prompt. Elas ficam guardadas na
+memória do processo, com validade por tipo de chamada e limite de tamanho (os itens
+usados há mais tempo saem primeiro).
+
+A chave é o hash do modelo, do prompt normalizado e da versão da conta. A versão fica no
+cache compartilhado (ver versoes_cache) e é incrementada pelos sinais de ItemFAQ e
+PerfilClinica depois que a transação é confirmada; como cada consulta lê a versão atual,
+as respostas antigas da conta deixam de ser usadas no servidor web e no worker da fila ao
+mesmo tempo.
+"""
+import hashlib
+import re
+import time
+from collections import Counter, OrderedDict
+from django.db import transaction
+
+from .versoes_cache import ler_versao, incrementar_versao
+
+# Validade (segundos) das respostas de cada tipo de chamada.
+TEMPOS_CACHE = {
+    'faq': 24 * 60 * 60,
+    'pergunta_nome_completo': 7 * 24 * 60 * 60,
+    'pergunta_preferencia': 24 * 60 * 60,
+    'pergunta_onboarding': 24 * 60 * 60,
+    'solicitacao_registrada': 24 * 60 * 60,
+    'encaminhamento_humano': 24 * 60 * 60,
+}
+
+# Quantas respostas ficam guardadas por processo.
+TAMANHO_MAXIMO = 2000
+
+
+class CacheRespostasIA:
+    """ Dicionário com validade por item e descarte do item usado há mais tempo (LRU). """
+
+    def __init__(self, tamanho_maximo=TAMANHO_MAXIMO):
+        self.tamanho_maximo = tamanho_maximo
+        self.itens = OrderedDict()  # chave -> (expira_em, texto)
+        self.estatisticas = Counter()
+
+    def obter(self, chave):
+        item = self.itens.get(chave)
+        if item is None or item[0] <= time.monotonic():
+            self.itens.pop(chave, None)
+            self.estatisticas['falhas'] += 1
+            return None
+        self.itens.move_to_end(chave)
+        self.estatisticas['acertos'] += 1
+        return item[1]
+
+    def guardar(self, chave, texto, validade):
+        self.itens[chave] = (time.monotonic() + validade, texto)
+        self.itens.move_to_end(chave)
+        while len(self.itens) > self.tamanho_maximo:
+            self.itens.popitem(last=False)
+
+    def limpar(self):
+        self.itens.clear()
+        self.estatisticas.clear()
+
+
+respostas_ia = CacheRespostasIA()
+
+
+def _chave_versao(conta_id):
+    return f"respostas_ia_versao_{conta_id}"
+
+
+async def chave_resposta(modelo, prompt, conta_id):
+    """ Hash do modelo, do prompt (com os espaços normalizados) e da versão atual da conta. """
+    versao = await ler_versao(_chave_versao(conta_id))
+    prompt_normalizado = re.sub(r'\s+', ' ', prompt).strip()
+    return hashlib.sha256(f"{modelo}\x00{conta_id}:{versao}\x00{prompt_normalizado}".encode('utf-8')).hexdigest()
+
+
+def invalidar_respostas_conta(conta_id):
+    """ Chamado pelos sinais quando o FAQ ou o perfil da clínica mudam. """
+    transaction.on_commit(lambda: incrementar_versao(_chave_versao(conta_id)))
@@ -0,0 +1,138 @@
+"""
+Geração do feed iCalendar (ICS) da agenda de um profissional.
+
+As linhas são produzidas sob demanda a partir de iteradores do banco, para que o
+feed possa ser enviado com StreamingHttpResponse sem montar tudo em memória.
+"""
+import hashlib
+from datetime import timedelta, timezone
+from django.db.models import Count, Max
+from django.utils import timezone as django_timezone
+
+from apps.users.models import Profissional
+from .models import Agendamento, ExcecaoHorario
+from .disponibilidade import STATUS_QUE_LIBERAM_HORARIO
+
+# Quantos dias para trás o feed mostra.
+DIAS_HISTORICO = 90
+
+STATUS_ICS = {
+    'Agendado': 'TENTATIVE',
+    'Confirmado': 'CONFIRMED',
+    'Realizado': 'CONFIRMED',
+    'Não Compareceu': 'CONFIRMED',
+    'Reagendar': 'TENTATIVE',
+}
+
+
+def _escapar(texto):
+    return (texto or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _dobrar(linha):
+    """ Quebra linhas com mais de 75 octetos, como exige a RFC 5545. """
+    dados = linha.encode('utf-8')
+    if len(dados) <= 75:
+        return linha + '\r\n'
+    partes = []
+    atual = ''
+    for caractere in linha:
+        if len((atual + caractere).encode('utf-8')) > 75:
+            partes.append(atual)
+            atual = ' '
+        atual += caractere
+    partes.append(atual)
+    return '\r\n'.join(partes) + '\r\n'
+
+
+def _data_hora_utc(momento):
+    return momento.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _agendamentos(profissional):
+    inicio = django_timezone.now() - timedelta(days=DIAS_HISTORICO)
+    return Agendamento.objects.filter(
+        profissional=profissional, data_hora_fim__gte=inicio
+    ).exclude(status__in=STATUS_QUE_LIBERAM_HORARIO)
+
+
+def _excecoes(profissional):
+    inicio = django_timezone.localdate() - timedelta(days=DIAS_HISTORICO)
+    return ExcecaoHorario.objects.filter(profissional=profissional, data__gte=inicio)
+
+
+def marcar_agenda_alterada(*profissional_ids):
+    """
+    Registra no profissional que um evento saiu do feed sem deixar rastro em `atualizado_em`
+    (exclusão ou troca de profissional). Usa update() para não disparar os sinais de Profissional.
+    """
+    Profissional.objects.filter(pk__in=[pk for pk in profissional_ids if pk]).update(agenda_atualizada_em=django_timezone.now())
+
+
+def versao_calendario(profissional):
+    """
+    Retorna (etag, ultima_modificacao) do feed com duas consultas agregadas, sem ler os eventos.
+
+    Os agendamentos cancelados entram na conta (o cancelamento muda `atualizado_em`, mesmo que o
+    evento saia do feed), as exceções contribuem com a própria data de alteração e as exclusões
+    com `Profissional.agenda_atualizada_em`. As contagens também entram na ETag.
+    """
+    inicio = django_timezone.now() - timedelta(days=DIAS_HISTORICO)
+    agendamentos = Agendamento.objects.filter(profissional=profissional, data_hora_fim__gte=inicio).aggregate(
+        ultima=Max('atualizado_em'), total=Count('id')
+    )
+    excecoes = _excecoes(profissional).aggregate(ultima=Max('atualizado_em'), total=Count('id'))
+    alteracoes = [agendamentos['ultima'], excecoes['ultima'], profissional.agenda_atualizada_em]
+    ultima_modificacao = max((momento for momento in alteracoes if momento), default=None)
+    assinatura = "|".join(str(parte) for parte in alteracoes + [agendamentos['total'], excecoes['total']])
+    etag = hashlib.md5(assinatura.encode('utf-8')).hexdigest()
+    return etag, ultima_modificacao
+
+
+def gerar_linhas_ics(profissional):
+    """ Gera o feed ICS linha a linha. """
+    yield _dobrar('BEGIN:VCALENDAR')
+    yield _dobrar('VERSION:2.0')
+    yield _dobrar('PRODID:-//ATMA App//Agenda//PT-BR')
+    yield _dobrar('CALSCALE:GREGORIAN')
+    yield _dobrar('METHOD:PUBLISH')
+    yield _dobrar(f'X-WR-CALNAME:{_escapar("Agenda - " + profissional.nome_completo)}')
+    yield _dobrar('X-WR-TIMEZONE:America/Sao_Paulo')
+
+    agendamentos = _agendamentos(profissional).order_by('data_hora_inicio').values_list(
+        'id', 'titulo', 'status', 'data_hora_inicio', 'data_hora_fim', 'atualizado_em',
+        'notas_agendamento', 'paciente__nome_completo', 'servico__nome_servico'
+    )
+    for id_, titulo, status, inicio, fim, atualizado_em, notas, paciente_nome, servico_nome in agendamentos.iterator(chunk_size=500):
+        descricao = f"Paciente: {paciente_nome}"
+        if servico_nome:
+            descricao += f"\nServiço: {servico_nome}"
+        if notas:
+            descricao += f"\n{notas}"
+        yield _dobrar('BEGIN:VEVENT')
+        yield _dobrar(f'UID:agendamento-{id_}@atma-app')
+        yield _dobrar(f'DTSTAMP:{_data_hora_utc(atualizado_em)}')
+        yield _dobrar(f'LAST-MODIFIED:{_data_hora_utc(atualizado_em)}')
+        yield _dobrar(f'DTSTART:{_data_hora_utc(inicio)}')
+        yield _dobrar(f'DTEND:{_data_hora_utc(fim)}')
+        yield _dobrar(f'SUMMARY:{_escapar(f"{titulo} - {paciente_nome}")}')
+        yield _dobrar(f'DESCRIPTION:{_escapar(descricao)}')
+        yield _dobrar(f'STATUS:{STATUS_ICS.get(status, "CONFIRMED")}')
+        yield _dobrar('END:VEVENT')
+
+    agora = _data_hora_utc(django_timezone.now())
+    excecoes = _excecoes(profissional).order_by('data').values_list('id', 'data', 'dia_inteiro', 'hora_inicio', 'hora_fim', 'descricao')
+    for id_, data, dia_inteiro, hora_inicio, hora_fim, descricao in excecoes.iterator(chunk_size=500):
+        resumo = descricao
+        if not dia_inteiro and hora_inicio and hora_fim:
+            resumo = f"Horário especial ({hora_inicio.strftime('%H:%M')} - {hora_fim.strftime('%H:%M')}): {descricao}"
+        yield _dobrar('BEGIN:VEVENT')
+        yield _dobrar(f'UID:excecao-{id_}@atma-app')
+        yield _dobrar(f'DTSTAMP:{agora}')
+        yield _dobrar(f'DTSTART;VALUE=DATE:{data.strftime("%Y%m%d")}')
+        yield _dobrar(f'DTEND;VALUE=DATE:{(data + timedelta(days=1)).strftime("%Y%m%d")}')
+        yield _dobrar(f'SUMMARY:{_escapar(resumo)}')
+        yield _dobrar('TRANSP:TRANSPARENT')
+        yield _dobrar('END:VEVENT')
+
+    yield _dobrar('END:VCALENDAR')
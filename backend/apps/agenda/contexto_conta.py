@@ -0,0 +1,80 @@
+"""
+Retrato (snapshot) dos dados da conta usados pelo atendimento do WhatsApp.
+
+A lista de intenções do FAQ, as respostas cadastradas, os serviços, o horário de
+funcionamento, a equipe, o perfil da clínica, a situação da assinatura e os modelos
+de mensagem personalizados são montados
+uma vez e guardados no cache compartilhado (CACHES no settings, no Redis), o mesmo
+para o servidor web e para o worker da fila. Cada mensagem passa a ler um único item
+do cache em vez de consultar essas tabelas.
+
+Os sinais de ItemFAQ, PerfilClinica, Servico, HorarioTrabalho, Profissional,
+Assinatura, Plano e ModeloMensagem apagam o retrato da conta (ver signals.py) depois que
+a transação é confirmada, para que ele não seja remontado com os dados de antes do commit.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.users.models import ItemFAQ, PerfilClinica, Profissional, Assinatura
+from apps.financas.models import Servico
+from .models import HorarioTrabalho, ModeloMensagem
+
+TEMPO_CACHE_CONTEXTO = 24 * 60 * 60
+
+
+def _chave_contexto(conta_id):
+    return f"contexto_conta_{conta_id}"
+
+
+def _situacao_assinatura(assinatura):
+    if assinatura is None:
+        return 'sem_assinatura'
+    if not assinatura.ativa or assinatura.plano.limite_mensagens_ia == 0:
+        return 'plano_incompativel'
+    return 'ativa'
+
+
+async def _montar_contexto(conta_id):
+    itens_faq = [item async for item in ItemFAQ.objects.filter(conta_id=conta_id).order_by('id')]
+    respostas_faq = {}
+    for item in itens_faq:
+        respostas_faq.setdefault(item.intencao_chave, item.resposta)
+
+    perfil, _ = await PerfilClinica.objects.select_related('servico_padrao').aget_or_create(conta_id=conta_id)
+    assinatura = await Assinatura.objects.select_related('plano').filter(conta_id=conta_id).afirst()
+
+    dias_semana = dict(HorarioTrabalho.DIAS_SEMANA)
+    horarios = HorarioTrabalho.objects.filter(profissional__conta_id=conta_id, ativo=True).order_by('dia_da_semana')
+    horarios_funcionamento = "".join([
+        f" {dias_semana[h.dia_da_semana]} das {h.hora_inicio.strftime('%H:%M')} às {h.hora_fim.strftime('%H:%M')};"
+        async for h in horarios
+    ])
+
+    return {
+        'intencoes_cadastradas': "\n".join([f"- {item.intencao_chave}: {item.perguntas_exemplo}" for item in itens_faq]),
+        'respostas_faq': respostas_faq,
+        'servicos': [s.nome_servico async for s in Servico.objects.filter(conta_id=conta_id, ativo=True)],
+        'horarios_funcionamento': horarios_funcionamento,
+        'equipe': [p.nome_completo async for p in Profissional.objects.filter(conta_id=conta_id, is_active=True)],
+        'perfil': perfil,
+        'situacao_assinatura': _situacao_assinatura(assinatura),
+        'modelos_mensagem': {
+            m.chave: (m.texto, m.reescrever_com_ia) async for m in ModeloMensagem.objects.filter(conta_id=conta_id)
+        },
+    }
+
+
+async def obter_contexto_conta(conta_id):
+    """ Retrato da conta, montado a partir do banco só quando não está no cache. """
+    chave = _chave_contexto(conta_id)
+    contexto = await cache.aget(chave)
+    if contexto is None:
+        contexto = await _montar_contexto(conta_id)
+        await cache.aset(chave, contexto, TEMPO_CACHE_CONTEXTO)
+    return contexto
+
+
+def invalidar_contexto_conta(*conta_ids):
+    chaves = [_chave_contexto(conta_id) for conta_id in conta_ids if conta_id]
+    if chaves:
+        transaction.on_commit(lambda: cache.delete_many(chaves))
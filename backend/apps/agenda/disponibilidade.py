@@ -0,0 +1,389 @@
+"""
+Motor de disponibilidade da agenda.
+
+Carrega os horários de trabalho, as exceções e os agendamentos de toda a janela
+de busca de uma só vez e calcula os intervalos livres em memória, em vez de
+consultar o banco a cada dia e a cada hora candidata.
+
+A agenda de cada dia fica guardada no cache por profissional e é invalidada
+pelos sinais de Agendamento, HorarioTrabalho e ExcecaoHorario (ver signals.py).
+As reservas temporárias entram no cache com a validade e o paciente, e são filtradas
+no momento da busca: uma reserva vencida deixa de ocupar o horário sem precisar invalidar nada.
+"""
+import heapq
+from datetime import datetime, time, timedelta, timezone
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from apps.users.models import Profissional
+from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, ReservaTemporaria
+
+PERIODOS = {
+    "manha": (time(8, 0), time(12, 0)),
+    "tarde": (time(12, 0), time(18, 0)),
+    "noite": (time(18, 0), time(21, 0)),
+}
+
+# Agendamentos nestes status não ocupam a agenda.
+STATUS_QUE_LIBERAM_HORARIO = ['Cancelado']
+
+MINUTOS_NO_DIA = 24 * 60
+
+# Duração, em minutos, usada quando nenhum serviço é informado.
+DURACAO_PADRAO = 60
+
+# Quantos dias à frente a agenda de um profissional pode ficar em cache.
+HORIZONTE_CACHE_DIAS = 60
+TEMPO_CACHE_AGENDA = 60 * 60
+
+
+def _minutos(hora: time) -> int:
+    return hora.hour * 60 + hora.minute
+
+
+def _minutos_ate(momento: datetime, dia, arredondar_para_cima=True) -> int:
+    """ Minutos entre o início do dia (horário local) e o momento, limitados ao próprio dia. """
+    if momento.date() < dia:
+        return 0
+    if momento.date() > dia:
+        return MINUTOS_NO_DIA
+    fracao = 1 if arredondar_para_cima and (momento.second or momento.microsecond) else 0
+    return momento.hour * 60 + momento.minute + fracao
+
+
+def mesclar_intervalos(intervalos):
+    """
+    Ordena e une intervalos (inicio, fim) que se sobrepõem ou se encostam.
+    """
+    mesclados = []
+    for inicio, fim in sorted(intervalos):
+        if mesclados and inicio <= mesclados[-1][1]:
+            if fim > mesclados[-1][1]:
+                mesclados[-1] = (mesclados[-1][0], fim)
+        else:
+            mesclados.append((inicio, fim))
+    return mesclados
+
+
+def subtrair_intervalos(janela, ocupados):
+    """
+    Retorna os trechos da janela (inicio, fim) não cobertos pelos intervalos ocupados.
+    `ocupados` precisa estar ordenado e mesclado (ver `mesclar_intervalos`).
+    """
+    inicio, fim = janela
+    livres = []
+    cursor = inicio
+    for ocupado_inicio, ocupado_fim in ocupados:
+        if ocupado_fim <= cursor:
+            continue
+        if ocupado_inicio >= fim:
+            break
+        if ocupado_inicio > cursor:
+            livres.append((cursor, ocupado_inicio))
+        cursor = max(cursor, ocupado_fim)
+    if cursor < fim:
+        livres.append((cursor, fim))
+    return livres
+
+
+def _intervalos_por_dia(inicio, fim, data_inicio, data_fim):
+    """ Divide o intervalo [inicio, fim) em (data, (minuto_inicio, minuto_fim)) por dia local, dentro da janela. """
+    inicio_local = django_timezone.localtime(inicio)
+    fim_local = django_timezone.localtime(fim)
+    dia = max(inicio_local.date(), data_inicio)
+    while dia <= data_fim and datetime.combine(dia, time.min) < fim_local.replace(tzinfo=None):
+        yield dia, (_minutos_ate(inicio_local, dia, arredondar_para_cima=False), _minutos_ate(fim_local, dia))
+        dia += timedelta(days=1)
+
+
+def carregar_agendas(profissional_ids, data_inicio, data_fim):
+    """
+    Monta a agenda de vários profissionais entre `data_inicio` e `data_fim` (inclusive)
+    com quatro consultas no total, independentemente de quantos profissionais forem.
+
+    Retorna {profissional_id: {data: (janela_de_trabalho, ocupados, reservas)}}, com tudo em minutos
+    do dia no horário local. `reservas` são as reservas temporárias ativas, como
+    (inicio, fim, expira_em_timestamp, paciente_id). Dias sem expediente não aparecem no resultado.
+    """
+    profissional_ids = list(profissional_ids)
+    horarios_semana = {profissional_id: {} for profissional_id in profissional_ids}
+    for profissional_id, dia_da_semana, hora_inicio, hora_fim in HorarioTrabalho.objects.filter(
+        profissional_id__in=profissional_ids, ativo=True
+    ).values_list('profissional_id', 'dia_da_semana', 'hora_inicio', 'hora_fim'):
+        horarios_semana[profissional_id][dia_da_semana] = (_minutos(hora_inicio), _minutos(hora_fim))
+
+    # Uma exceção substitui o horário padrão do dia; None significa dia fechado.
+    excecoes = {profissional_id: {} for profissional_id in profissional_ids}
+    for profissional_id, data, dia_inteiro, hora_inicio, hora_fim in ExcecaoHorario.objects.filter(
+        profissional_id__in=profissional_ids, data__range=(data_inicio, data_fim)
+    ).values_list('profissional_id', 'data', 'dia_inteiro', 'hora_inicio', 'hora_fim'):
+        excecoes_profissional = excecoes[profissional_id]
+        if dia_inteiro or not hora_inicio or not hora_fim:
+            excecoes_profissional[data] = None
+        elif excecoes_profissional.get(data, ()) is not None:
+            excecoes_profissional[data] = (_minutos(hora_inicio), _minutos(hora_fim))
+
+    inicio_janela = django_timezone.make_aware(datetime.combine(data_inicio, time.min))
+    fim_janela = django_timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), time.min))
+    ocupados_por_dia = {profissional_id: {} for profissional_id in profissional_ids}
+    agendamentos = Agendamento.objects.filter(
+        profissional_id__in=profissional_ids,
+        data_hora_inicio__lt=fim_janela,
+        data_hora_fim__gt=inicio_janela,
+    ).exclude(status__in=STATUS_QUE_LIBERAM_HORARIO).values_list('profissional_id', 'data_hora_inicio', 'data_hora_fim')
+    for profissional_id, inicio, fim in agendamentos:
+        for dia, intervalo in _intervalos_por_dia(inicio, fim, data_inicio, data_fim):
+            ocupados_por_dia[profissional_id].setdefault(dia, []).append(intervalo)
+
+    reservas_por_dia = {profissional_id: {} for profissional_id in profissional_ids}
+    reservas = ReservaTemporaria.objects.filter(
+        profissional_id__in=profissional_ids,
+        data_hora_inicio__lt=fim_janela,
+        data_hora_fim__gt=inicio_janela,
+        expira_em__gt=django_timezone.now(),
+    ).values_list('profissional_id', 'data_hora_inicio', 'data_hora_fim', 'expira_em', 'paciente_id')
+    for profissional_id, inicio, fim, expira_em, paciente_id in reservas:
+        for dia, (minuto_inicio, minuto_fim) in _intervalos_por_dia(inicio, fim, data_inicio, data_fim):
+            reservas_por_dia[profissional_id].setdefault(dia, []).append(
+                (minuto_inicio, minuto_fim, expira_em.timestamp(), paciente_id)
+            )
+
+    agendas = {}
+    for profissional_id in profissional_ids:
+        agenda = agendas[profissional_id] = {}
+        dia = data_inicio
+        while dia <= data_fim:
+            if dia in excecoes[profissional_id]:
+                janela = excecoes[profissional_id][dia]
+            else:
+                janela = horarios_semana[profissional_id].get(dia.weekday())
+            if janela and janela[0] < janela[1]:
+                agenda[dia] = (
+                    janela,
+                    mesclar_intervalos(ocupados_por_dia[profissional_id].get(dia, [])),
+                    sorted(reservas_por_dia[profissional_id].get(dia, [])),
+                )
+            dia += timedelta(days=1)
+    return agendas
+
+
+def carregar_agenda(profissional, data_inicio, data_fim):
+    """ Agenda de um único profissional, no formato de `carregar_agendas`. """
+    return carregar_agendas([profissional.pk], data_inicio, data_fim)[profissional.pk]
+
+
+def _chave_agenda_dia(profissional_id, dia):
+    return f"agenda_dia_{profissional_id}_{dia.isoformat()}"
+
+
+def obter_agendas(profissional_ids, data_inicio, data_fim):
+    """
+    Mesmo resultado de `carregar_agendas`, mas lendo do cache os dias já calculados.
+    Só os dias ausentes do cache são buscados no banco, numa única carga para todos os profissionais.
+    """
+    dias = [data_inicio + timedelta(days=n) for n in range((data_fim - data_inicio).days + 1)]
+    chaves = {
+        _chave_agenda_dia(profissional_id, dia): (profissional_id, dia)
+        for profissional_id in profissional_ids
+        for dia in dias
+    }
+    em_cache = cache.get_many(list(chaves))
+
+    # Dias sem expediente ficam no cache como tupla vazia.
+    agendas = {profissional_id: {} for profissional_id in profissional_ids}
+    for chave, valor in em_cache.items():
+        if valor:
+            profissional_id, dia = chaves[chave]
+            agendas[profissional_id][dia] = valor
+
+    faltando = [chaves[chave] for chave in chaves if chave not in em_cache]
+    if faltando:
+        carregadas = carregar_agendas(
+            {profissional_id for profissional_id, _ in faltando},
+            min(dia for _, dia in faltando),
+            max(dia for _, dia in faltando),
+        )
+        limite_cache = django_timezone.localdate() + timedelta(days=HORIZONTE_CACHE_DIAS)
+        novos = {}
+        for profissional_id, dia in faltando:
+            janela, ocupados, reservas = carregadas[profissional_id].get(dia, (None, None, None))
+            if janela:
+                agendas[profissional_id][dia] = (janela, ocupados, reservas)
+            if dia <= limite_cache:
+                novos[_chave_agenda_dia(profissional_id, dia)] = (janela, tuple(ocupados), tuple(reservas)) if janela else ()
+        cache.set_many(novos, TEMPO_CACHE_AGENDA)
+    return agendas
+
+
+def obter_agenda(profissional, data_inicio, data_fim):
+    """ Agenda de um único profissional, no formato de `carregar_agenda`, usando o cache. """
+    return obter_agendas([profissional.pk], data_inicio, data_fim)[profissional.pk]
+
+
+def invalidar_agenda(profissional_id, dias):
+    """
+    Remove do cache a agenda dos dias informados, depois que a transação atual for confirmada.
+    """
+    chaves = [_chave_agenda_dia(profissional_id, dia) for dia in set(dias)]
+    if chaves:
+        transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+def dias_do_horizonte(dia_da_semana=None):
+    """ Dias cobertos pelo cache, opcionalmente apenas os de um dia da semana. """
+    hoje = django_timezone.localdate()
+    dias = (hoje + timedelta(days=n) for n in range(HORIZONTE_CACHE_DIAS + 1))
+    return [dia for dia in dias if dia_da_semana is None or dia.weekday() == dia_da_semana]
+
+
+def dias_do_intervalo(inicio, fim):
+    """ Datas locais tocadas pelo intervalo [inicio, fim). """
+    if not inicio or not fim:
+        return []
+    dia = django_timezone.localtime(inicio).date()
+    ultimo = django_timezone.localtime(fim - timedelta(microseconds=1)).date() if fim > inicio else dia
+    dias = []
+    while dia <= ultimo:
+        dias.append(dia)
+        dia += timedelta(days=1)
+    return dias
+
+
+def _para_utc(dia, minutos: int) -> datetime:
+    momento = datetime.combine(dia, time.min) + timedelta(minutes=minutos)
+    return django_timezone.make_aware(momento).astimezone(timezone.utc)
+
+
+def gerar_horarios(agenda, preferencias=None, quantidade=3, duracao=DURACAO_PADRAO, a_partir_de=None, intervalo=0, paciente_id=None):
+    """
+    Percorre a agenda já carregada e devolve até `quantidade` inícios de horários livres (em UTC).
+
+    Os horários são encaixados a partir do começo de cada intervalo livre, em passos
+    de `duracao` + `intervalo` minutos, respeitando as preferências de data, dia da semana,
+    período e hora. O `intervalo` também é mantido antes e depois de cada agendamento existente.
+    Reservas temporárias ainda válidas ocupam o horário, exceto as do próprio `paciente_id`.
+    """
+    agora = django_timezone.now().timestamp()
+    preferencias = preferencias or {}
+    dia_preferido = preferencias.get('dia_semana')
+    periodo_preferido = preferencias.get('periodo')
+    data_preferida = None
+    if preferencias.get('data'):
+        try:
+            data_preferida = datetime.strptime(preferencias['data'], '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    hora_preferida = None
+    if preferencias.get('hora'):
+        try:
+            hora_preferida = _minutos(datetime.strptime(preferencias['hora'], '%H:%M').time())
+        except ValueError:
+            pass
+
+    horarios = []
+    for dia in sorted(agenda):
+        if dia_preferido is not None and dia.weekday() != dia_preferido:
+            continue
+        if data_preferida is not None and dia != data_preferida:
+            continue
+        janela_trabalho, ocupados, reservas = agenda[dia]
+        reservados = [
+            (inicio, fim) for inicio, fim, expira_em, reserva_paciente_id in reservas
+            if expira_em > agora and reserva_paciente_id != paciente_id
+        ]
+        if reservados:
+            ocupados = mesclar_intervalos(list(ocupados) + reservados)
+        if intervalo:
+            ocupados = mesclar_intervalos((inicio - intervalo, fim + intervalo) for inicio, fim in ocupados)
+        livres = subtrair_intervalos(janela_trabalho, ocupados)
+
+        minimo = 0
+        if a_partir_de is not None:
+            if dia < a_partir_de.date():
+                continue
+            if dia == a_partir_de.date():
+                minimo = _minutos_ate(a_partir_de, dia)
+
+        if hora_preferida is not None:
+            candidatos = (
+                hora_preferida
+                for livre_inicio, livre_fim in livres
+                if livre_inicio <= hora_preferida and hora_preferida + duracao <= livre_fim
+            )
+        else:
+            busca_inicio, busca_fim = 0, MINUTOS_NO_DIA
+            if periodo_preferido in PERIODOS:
+                busca_inicio, busca_fim = (_minutos(h) for h in PERIODOS[periodo_preferido])
+            candidatos = (
+                inicio
+                for livre_inicio, livre_fim in livres
+                for inicio in range(max(livre_inicio, busca_inicio), min(livre_fim - duracao, busca_fim - 1) + 1, duracao + intervalo)
+            )
+
+        for inicio in candidatos:
+            if inicio < minimo:
+                continue
+            horarios.append(_para_utc(dia, inicio))
+            if len(horarios) >= quantidade:
+                return horarios
+    return horarios
+
+
+def buscar_horarios_disponiveis(profissional, preferencias=None, quantidade=3, dias=30, duracao=DURACAO_PADRAO, intervalo=0, paciente_id=None):
+    """
+    Retorna os próximos `quantidade` horários livres do profissional nos próximos `dias` dias.
+    """
+    agora_local = django_timezone.localtime(django_timezone.now())
+    hoje = agora_local.date()
+    agenda = obter_agenda(profissional, hoje, hoje + timedelta(days=dias - 1))
+    return gerar_horarios(
+        agenda, preferencias, quantidade, duracao, a_partir_de=agora_local, intervalo=intervalo, paciente_id=paciente_id
+    )
+
+
+def buscar_horarios_conta(conta, quantidade=3, preferencias=None, especialidade=None, servico=None, dias=30, um_por_horario=False, intervalo=0, paciente_id=None):
+    """
+    Retorna os `quantidade` horários livres mais próximos entre todos os profissionais ativos da conta.
+
+    Cada item é um dicionário com `inicio`, `fim` (UTC) e `profissional_id`. O filtro por
+    `especialidade` restringe os profissionais; o `servico` define a duração de cada horário
+    e `intervalo` os minutos livres mantidos entre sessões.
+    Com `um_por_horario`, um mesmo início aparece só uma vez (com o primeiro profissional livre).
+    As reservas temporárias do `paciente_id` não bloqueiam os horários oferecidos a ele.
+    """
+    profissionais = Profissional.objects.filter(conta=conta, is_active=True)
+    if especialidade:
+        profissionais = profissionais.filter(especialidade__iexact=especialidade)
+    profissional_ids = list(profissionais.order_by('id').values_list('id', flat=True))
+    if not profissional_ids:
+        return []
+
+    duracao = servico.duracao_padrao if servico and servico.duracao_padrao else DURACAO_PADRAO
+    agora_local = django_timezone.localtime(django_timezone.now())
+    hoje = agora_local.date()
+    agendas = obter_agendas(profissional_ids, hoje, hoje + timedelta(days=dias - 1))
+
+    # Cada profissional contribui com no máximo `quantidade` horários; o merge mantém a ordem por início.
+    por_profissional = [
+        [(inicio, profissional_id) for inicio in gerar_horarios(
+            agendas[profissional_id], preferencias, quantidade, duracao,
+            a_partir_de=agora_local, intervalo=intervalo, paciente_id=paciente_id
+        )]
+        for profissional_id in profissional_ids
+    ]
+    horarios = []
+    inicios_usados = set()
+    for inicio, profissional_id in heapq.merge(*por_profissional):
+        if um_por_horario:
+            if inicio in inicios_usados:
+                continue
+            inicios_usados.add(inicio)
+        horarios.append({
+            'inicio': inicio,
+            'fim': inicio + timedelta(minutes=duracao),
+            'profissional_id': profissional_id,
+        })
+        if len(horarios) >= quantidade:
+            break
+    return horarios
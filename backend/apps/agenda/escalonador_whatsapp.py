@@ -0,0 +1,141 @@
+"""
+Divisão dos workers da fila do WhatsApp entre as contas.
+
+Sem divisão, uma campanha de uma clínica grande enche a fila e as mensagens das outras
+contas esperam atrás dela (e da mesma cota da Gemini). Ao reivindicar uma tarefa, o worker:
+
+1. ignora as contas que já têm `limite_atendimentos_simultaneos` mensagens em atendimento;
+2. dá preferência às tarefas de prioridade alta, marcadas na chegada por `prioridade_da_mensagem`;
+3. entre as contas com tarefas dessa prioridade, escolhe por rodízio ponderado (smooth
+   weighted round-robin) com o `peso_fila` do plano da conta.
+
+As contas são identificadas pelo número de destino da mensagem. A ordem calculada aqui já
+deixa de fora as contas no limite, mas quem garante o limite é fila_whatsapp.reivindicar_tarefa,
+que confere a contagem de novo na mesma transação da reivindicação, com a conta bloqueada.
+"""
+import time
+from collections import defaultdict
+from django.db.models import Count, Exists, Min, OuterRef
+from django.utils import timezone
+
+from apps.users.models import Assinatura, Paciente
+from .models import Agendamento, ListaEspera, ReservaTemporaria, TarefaWhatsApp
+from .roteador_intencoes import classificar_intencao, normalizar, CUMPRIMENTOS, CONFIRMACOES
+from .interpretador_horarios import interpretar_preferencias
+from .escolha_horario import menciona_posicao_na_lista
+
+PRIORIDADE_ALTA = 0
+PRIORIDADE_NORMAL = 1
+RESPOSTAS_LEMBRETE = {'sim', 'nao', 'reagendar'}
+
+# Valores usados para contas sem assinatura.
+PESO_PADRAO = 1
+LIMITE_PADRAO = 5
+# Por quanto tempo (segundos) o worker reaproveita os pesos e limites lidos dos planos.
+TEMPO_CACHE_PLANOS = 60
+
+
+def _parece_resposta(corpo):
+    """ Respostas curtas que só fazem sentido se o paciente tiver algo a responder ("sim", "ok", "2", "não"). """
+    texto = ' '.join(CUMPRIMENTOS.sub(' ', normalizar(corpo)).split())
+    return bool(CONFIRMACOES.match(texto)) or texto in RESPOSTAS_LEMBRETE or menciona_posicao_na_lista(corpo)
+
+
+async def remetente_aguarda_resposta(telefone, destinatario):
+    """
+    Indica se o paciente tem, nesta conta, horários segurados para ele, uma proposta da lista
+    de espera em aberto ou uma consulta futura com lembrete enviado.
+    """
+    agora = timezone.now()
+    return await Paciente.objects.filter(
+        conta__whatsapp_number=destinatario, contato_telefone__contains=telefone
+    ).filter(
+        Exists(ReservaTemporaria.objects.filter(paciente=OuterRef('pk'), expira_em__gt=agora))
+        | Exists(ListaEspera.objects.filter(paciente=OuterRef('pk'), oferta_expira_em__gt=agora))
+        | Exists(Agendamento.objects.filter(
+            paciente=OuterRef('pk'), status='Agendado', lembrete_enviado=True, data_hora_inicio__gte=agora
+        ))
+    ).aexists()
+
+
+async def prioridade_da_mensagem(telefone, destinatario, corpo):
+    """
+    Prioridade da tarefa, estimada na chegada. Pedidos de agendamento e preferências de dia e
+    horário são prioritários pelo próprio texto. Respostas curtas só são prioritárias quando o
+    remetente de fato aguarda uma resposta (ver `remetente_aguarda_resposta`): os "ok" e "sim"
+    de uma campanha em massa ficam com a prioridade normal.
+    """
+    intencao, _ = classificar_intencao(corpo)
+    if intencao == 'AGENDAR' or interpretar_preferencias(corpo):
+        return PRIORIDADE_ALTA
+    if _parece_resposta(corpo) and await remetente_aguarda_resposta(telefone, destinatario):
+        return PRIORIDADE_ALTA
+    return PRIORIDADE_NORMAL
+
+
+def profundidade_por_conta(destinatario=None):
+    """ {destinatario: {'pendentes': n, 'processando': n}} das contas com mensagens na fila. """
+    tarefas = TarefaWhatsApp.objects.filter(status__in=['pendente', 'processando'])
+    if destinatario:
+        tarefas = tarefas.filter(destinatario=destinatario)
+    profundidade = defaultdict(lambda: {'pendentes': 0, 'processando': 0})
+    for linha in tarefas.values('destinatario', 'status').annotate(total=Count('id')).order_by():
+        chave = 'pendentes' if linha['status'] == 'pendente' else 'processando'
+        profundidade[linha['destinatario']][chave] = linha['total']
+    return dict(profundidade)
+
+
+class EscalonadorContas:
+    """ Estado do rodízio ponderado de um worker. """
+
+    def __init__(self):
+        self.creditos = defaultdict(int)
+        self._planos = {}
+        self._planos_lidos_em = 0.0
+
+    def planos(self, destinatarios):
+        """ {destinatario: (peso, limite)}, lidos das assinaturas e guardados por TEMPO_CACHE_PLANOS. """
+        if time.monotonic() - self._planos_lidos_em > TEMPO_CACHE_PLANOS or not set(destinatarios) <= set(self._planos):
+            linhas = Assinatura.objects.filter(conta__whatsapp_number__in=destinatarios).values_list(
+                'conta__whatsapp_number', 'plano__peso_fila', 'plano__limite_atendimentos_simultaneos'
+            )
+            self._planos = {destinatario: (PESO_PADRAO, LIMITE_PADRAO) for destinatario in destinatarios}
+            self._planos.update({destinatario: (max(peso, 1), max(limite, 1)) for destinatario, peso, limite in linhas})
+            self._planos_lidos_em = time.monotonic()
+        return self._planos
+
+    def ordenar_contas(self, elegiveis):
+        """
+        Ordem em que as contas devem ser tentadas. `elegiveis` é uma consulta de tarefas pendentes
+        liberadas; as contas no limite de atendimentos simultâneos ficam de fora.
+        """
+        cabecas = dict(
+            elegiveis.values('destinatario').annotate(prioridade=Min('prioridade')).order_by()
+            .values_list('destinatario', 'prioridade')
+        )
+        if not cabecas:
+            return []
+        em_atendimento = dict(
+            TarefaWhatsApp.objects.filter(status='processando', destinatario__in=cabecas)
+            .values('destinatario').annotate(total=Count('id')).order_by().values_list('destinatario', 'total')
+        )
+        planos = self.planos(list(cabecas))
+        livres = {d: prioridade for d, prioridade in cabecas.items() if em_atendimento.get(d, 0) < planos[d][1]}
+        if not livres:
+            return []
+
+        # Rodízio ponderado entre as contas da melhor prioridade: cada rodada soma o peso de cada
+        # conta ao seu crédito; a de maior crédito é a escolhida e desconta o total dos pesos.
+        melhor = min(livres.values())
+        rodada = [d for d, prioridade in livres.items() if prioridade == melhor]
+        for destinatario in list(self.creditos):
+            if destinatario not in rodada:
+                del self.creditos[destinatario]
+        for destinatario in rodada:
+            self.creditos[destinatario] += planos[destinatario][0]
+        escolhida = max(rodada, key=lambda d: self.creditos[d])
+        self.creditos[escolhida] -= sum(planos[d][0] for d in rodada)
+
+        # As demais ficam como alternativas, caso a tarefa da escolhida seja pega por outro worker.
+        demais = sorted((d for d in livres if d != escolhida), key=lambda d: (livres[d], -self.creditos[d]))
+        return [escolhida] + demais
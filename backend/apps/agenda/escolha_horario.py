@@ -0,0 +1,111 @@
+"""
+Resolução local da escolha entre os horários oferecidos ao paciente.
+
+Os horários são apresentados numerados (1., 2., 3.) e a resposta do paciente é
+comparada com a lista do cache sem chamar a Gemini:
+
+- pelo número ou ordinal: "1", "opção 2", "a segunda opção", "o último";
+- pela data, dia da semana, período ou hora: "quinta", "às 14h", "dia 12"
+  (interpretados por interpretador_horarios).
+
+A comparação usa as datas e horas dos horários, não o texto formatado, e a lista é
+escrita com os nomes de formatacao_datas, então nada aqui depende do locale do servidor.
+Quando a resposta serve para mais de um horário, a escolha é marcada como ambígua e fica
+com a Gemini.
+"""
+from django.utils import timezone
+
+from .disponibilidade import PERIODOS
+from .formatacao_datas import dia_e_hora_por_extenso
+from .interpretador_horarios import interpretar_preferencias, PALAVRAS_NEUTRAS, DIAS_SEMANA
+from .roteador_intencoes import normalizar, CUMPRIMENTOS
+
+ORDINAIS = {
+    'primeira': 1, 'primeiro': 1, 'segunda': 2, 'segundo': 2, 'terceira': 3, 'terceiro': 3,
+    'quarta': 4, 'quarto': 4, 'quinta': 5, 'quinto': 5, 'ultima': -1, 'ultimo': -1,
+}
+
+# Palavras que confirmam que o número ou ordinal se refere à lista ("a segunda opção").
+PALAVRAS_DA_LISTA = {'opcao', 'opcoes', 'numero', 'n', 'item', 'horario', 'alternativa'}
+
+
+def formatar_horarios_numerados(inicios):
+    """ Lista numerada dos horários, no formato apresentado ao paciente. """
+    return "\n".join(
+        f"{numero}. {dia_e_hora_por_extenso(inicio)}"
+        for numero, inicio in enumerate(inicios, start=1)
+    )
+
+
+def horarios_compativeis(preferencias, horarios_oferecidos):
+    """ Horários oferecidos compatíveis com todas as preferências informadas. """
+    compativeis = []
+    for horario in horarios_oferecidos or []:
+        inicio = timezone.localtime(horario['inicio'])
+        if preferencias.get('data') and inicio.date().isoformat() != preferencias['data']:
+            continue
+        if preferencias.get('dia_semana') is not None and inicio.weekday() != preferencias['dia_semana']:
+            continue
+        if preferencias.get('hora') and inicio.strftime('%H:%M') != preferencias['hora']:
+            continue
+        if preferencias.get('periodo') in PERIODOS:
+            comeco, fim = PERIODOS[preferencias['periodo']]
+            if not comeco <= inicio.time() < fim:
+                continue
+        compativeis.append(horario)
+    return compativeis
+
+
+def _posicao_na_lista(mensagem, quantidade):
+    """
+    Posição (1..quantidade) indicada por número ou ordinal, ou None.
+    Retorna também se o ordinal também poderia ser um dia da semana ("a segunda").
+    """
+    palavras = CUMPRIMENTOS.sub(' ', normalizar(mensagem)).split()
+    menciona_lista = any(palavra in PALAVRAS_DA_LISTA for palavra in palavras)
+    restante = [p for p in palavras if p not in PALAVRAS_NEUTRAS and p not in PALAVRAS_DA_LISTA]
+    if len(restante) != 1:
+        return None, False
+
+    palavra = restante[0].rstrip('oa') if restante[0][:-1].isdigit() else restante[0]  # "1a", "2o"
+    if palavra.isdigit():
+        posicao = int(palavra)
+    elif palavra in ORDINAIS:
+        posicao = ORDINAIS[palavra] if ORDINAIS[palavra] > 0 else quantidade
+    else:
+        return None, False
+    if not 1 <= posicao <= quantidade:
+        return None, False
+    return posicao, palavra in DIAS_SEMANA and not menciona_lista
+
+
+def menciona_posicao_na_lista(mensagem, quantidade=5):
+    """ Indica se a mensagem aponta um item de uma lista numerada ("1", "opção 2", "a última"). """
+    return _posicao_na_lista(mensagem, quantidade)[0] is not None
+
+
+def resolver_escolha(mensagem, horarios_oferecidos):
+    """
+    Retorna (horario, ambiguo): o item de `horarios_oferecidos` escolhido pelo paciente, ou None.
+    `ambiguo` indica que a resposta combina com mais de um horário e deve ser analisada pela Gemini.
+    """
+    if not horarios_oferecidos:
+        return None, False
+
+    posicao, pode_ser_dia = _posicao_na_lista(mensagem, len(horarios_oferecidos))
+    preferencias = interpretar_preferencias(mensagem)
+    if not preferencias:
+        return (horarios_oferecidos[posicao - 1], False) if posicao else (None, False)
+
+    compativeis = horarios_compativeis(preferencias, horarios_oferecidos)
+    if posicao and pode_ser_dia:
+        # "a segunda" pode ser a 2ª opção ou a segunda-feira: sem horário na segunda-feira vale a
+        # posição; havendo, só vale se as duas leituras apontam para o mesmo horário.
+        por_posicao = horarios_oferecidos[posicao - 1]
+        if not compativeis or compativeis == [por_posicao]:
+            return por_posicao, False
+        return None, True
+    if len(compativeis) == 1:
+        return compativeis[0], False
+    # "pode ser a 1" também é lido como "à 1 hora": sem horário compatível, a Gemini decide.
+    return None, len(compativeis) > 1 or bool(posicao)
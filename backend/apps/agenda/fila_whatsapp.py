@@ -0,0 +1,168 @@
+"""
+Fila das mensagens recebidas pelo webhook do WhatsApp e das enviadas por iniciativa da clínica.
+
+Cada worker reivindica uma tarefa por vez com SELECT ... FOR UPDATE SKIP LOCKED, então
+vários workers trabalham em paralelo sem pegar a mesma tarefa. Uma tarefa só
+pode ser reivindicada quando não existe outra mais antiga do mesmo telefone pendente ou em
+processamento, o que mantém a ordem das mensagens de cada paciente.
+
+Mensagens enviadas em sequência pelo mesmo telefone são atendidas como uma só: cada
+mensagem nova adia o atendimento até `processar_apos` (fim da janela de agrupamento), e
+ao reivindicar a mais antiga o worker junta a ela as outras pendentes do telefone, que
+ficam com status 'agrupada'. A espera é limitada por ESPERA_MAXIMA_AGRUPAMENTO.
+
+A escolha da conta atendida a cada reivindicação fica com escalonador_whatsapp, para que
+uma conta com muitas mensagens não atrase as demais. O limite de atendimentos simultâneos
+da conta é conferido dentro da transação da reivindicação, com a linha da Conta bloqueada
+(SELECT ... FOR UPDATE): dois workers não reivindicam ao mesmo tempo para a mesma conta,
+e o segundo já conta a tarefa que o primeiro marcou como 'processando'.
+
+As tarefas de 'envio' (ex: proposta da lista de espera) só mandam o texto ao paciente; elas
+seguem a mesma ordem por telefone, mas não são agrupadas com as mensagens recebidas.
+"""
+import traceback
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from apps.users.models import Conta
+from .models import TarefaWhatsApp
+from .atendimento import AtendimentoWhatsApp
+from .escalonador_whatsapp import EscalonadorContas, prioridade_da_mensagem
+from .whatsapp import responder_paciente_via_whatsapp_async
+
+# Status que impedem mensagens mais novas do mesmo telefone de serem processadas.
+STATUS_EM_ABERTO = ['pendente', 'processando']
+
+# Depois desse tempo em processamento, considera-se que o worker parou e a tarefa volta para a fila.
+TEMPO_LIMITE_PROCESSAMENTO = 5 * 60
+MAX_TENTATIVAS = 3
+
+# Quem escreve sem parar não espera mais do que isso (segundos) pela resposta.
+ESPERA_MAXIMA_AGRUPAMENTO = 10
+
+_escalonador_padrao = EscalonadorContas()
+
+
+async def enfileirar_mensagem(telefone, destinatario, corpo):
+    """ Registra a mensagem recebida; o atendimento espera a janela de agrupamento do telefone. """
+    prioridade = await prioridade_da_mensagem(telefone, destinatario, corpo)
+    return await TarefaWhatsApp.objects.acreate(
+        telefone=telefone, destinatario=destinatario, corpo=corpo, prioridade=prioridade,
+        processar_apos=timezone.now() + timedelta(seconds=settings.WHATSAPP_JANELA_AGRUPAMENTO),
+    )
+
+
+def enfileirar_envios(envios):
+    """
+    Agenda o envio de mensagens aos pacientes pelo worker, sem esperar a Twilio na requisição.
+    `envios` é uma lista de (telefone, remetente, corpo), gravada com um único bulk_create.
+    """
+    return TarefaWhatsApp.objects.bulk_create([
+        TarefaWhatsApp(
+            tipo='envio', telefone=''.join(filter(str.isdigit, telefone)), destinatario=remetente or '', corpo=corpo, prioridade=0,
+        )
+        for telefone, remetente, corpo in envios
+    ])
+
+
+def reivindicar_tarefa(escalonador=None):
+    """
+    Marca como 'processando' e retorna a próxima tarefa liberada, ou None se não houver.
+    A conta é escolhida pelo `escalonador` (limite por conta, prioridade e rodízio ponderado)
+    e, dentro da conta, vale a prioridade e depois a ordem de chegada. Contas que já estão no
+    limite de atendimentos simultâneos são puladas.
+    As mensagens pendentes seguintes do mesmo telefone são agrupadas na tarefa retornada.
+    """
+    escalonador = escalonador or _escalonador_padrao
+    agora = timezone.now()
+    anteriores_em_aberto = TarefaWhatsApp.objects.filter(
+        telefone=OuterRef('telefone'), id__lt=OuterRef('id'), status__in=STATUS_EM_ABERTO
+    )
+    # O telefone ainda está dentro da janela de agrupamento de alguma mensagem pendente.
+    em_sequencia = TarefaWhatsApp.objects.filter(
+        telefone=OuterRef('telefone'), status='pendente', processar_apos__gt=agora
+    )
+    elegiveis = TarefaWhatsApp.objects.filter(status='pendente').exclude(
+        Exists(anteriores_em_aberto)
+    ).filter(
+        ~Exists(em_sequencia) | Q(criado_em__lte=agora - timedelta(seconds=ESPERA_MAXIMA_AGRUPAMENTO))
+    )
+    for destinatario in escalonador.ordenar_contas(elegiveis):
+        with transaction.atomic():
+            # Bloqueia a conta até o fim da transação; quem reivindicar para ela em seguida
+            # espera aqui e, depois, já enxerga a tarefa marcada abaixo.
+            list(Conta.objects.select_for_update().filter(whatsapp_number=destinatario).values_list('id', flat=True))
+            limite = escalonador.planos([destinatario])[destinatario][1]
+            if TarefaWhatsApp.objects.filter(destinatario=destinatario, status='processando').count() >= limite:
+                continue
+            tarefa = elegiveis.filter(destinatario=destinatario).select_for_update(skip_locked=True).order_by('prioridade', 'id').first()
+            if tarefa is None:
+                continue
+            tarefa.status = 'processando'
+            tarefa.tentativas += 1
+            tarefa.iniciado_em = agora
+            tarefa.save(update_fields=['status', 'tentativas', 'iniciado_em'])
+            seguintes = [] if tarefa.tipo == 'envio' else list(TarefaWhatsApp.objects.filter(
+                telefone=tarefa.telefone, status='pendente', id__gt=tarefa.id, tipo='recebida'
+            ).select_for_update(skip_locked=True).values_list('id', flat=True))
+            if seguintes:
+                TarefaWhatsApp.objects.filter(id__in=seguintes).update(status='agrupada', agrupada_em=tarefa, concluido_em=agora)
+            return tarefa
+    return None
+
+
+def corpo_da_tarefa(tarefa):
+    """ Texto da tarefa com o das mensagens agrupadas a ela, na ordem de chegada. """
+    return "\n".join([tarefa.corpo] + list(tarefa.agrupadas.order_by('id').values_list('corpo', flat=True)))
+
+
+def concluir_tarefa(tarefa, resultado=None, erro=None):
+    tarefa.status = 'erro' if erro else 'concluida'
+    tarefa.resultado = resultado
+    tarefa.erro = erro
+    tarefa.concluido_em = timezone.now()
+    tarefa.save(update_fields=['status', 'resultado', 'erro', 'concluido_em'])
+
+
+async def processar_tarefa(tarefa):
+    """ Executa o atendimento da mensagem da tarefa (ou o envio) e registra o resultado. """
+    if tarefa.tipo == 'envio':
+        enviado = await responder_paciente_via_whatsapp_async(tarefa.telefone, tarefa.corpo)
+        erro = None if enviado else 'Falha no envio pela Twilio.'
+        await sync_to_async(concluir_tarefa)(tarefa, resultado='enviado' if enviado else None, erro=erro)
+        return
+    try:
+        corpo = await sync_to_async(corpo_da_tarefa)(tarefa)
+        resultado = await AtendimentoWhatsApp().processar_mensagem(tarefa.telefone, tarefa.destinatario, corpo)
+    except Exception:
+        traceback.print_exc()
+        await sync_to_async(concluir_tarefa)(tarefa, erro=traceback.format_exc())
+        return
+    status = resultado.get('status')
+    erro = resultado.get('mensagem', status) if status == 'erro_geral' else None
+    await sync_to_async(concluir_tarefa)(tarefa, resultado=status, erro=erro)
+
+
+def recuperar_tarefas_travadas():
+    """
+    Devolve para a fila as tarefas que passaram do tempo limite em processamento
+    (ex: o worker foi encerrado no meio). Após MAX_TENTATIVAS, a tarefa fica com erro.
+    Retorna (devolvidas, abandonadas).
+    """
+    agora = timezone.now()
+    travadas = TarefaWhatsApp.objects.filter(
+        status='processando', iniciado_em__lt=agora - timedelta(seconds=TEMPO_LIMITE_PROCESSAMENTO)
+    )
+    abandonadas = travadas.filter(tentativas__gte=MAX_TENTATIVAS).update(
+        status='erro', erro='Tempo limite de processamento excedido.', concluido_em=agora
+    )
+    devolvidas = travadas.update(status='pendente')
+    return devolvidas, abandonadas
+
+
+def existem_tarefas_pendentes():
+    return TarefaWhatsApp.objects.filter(status='pendente').exists()
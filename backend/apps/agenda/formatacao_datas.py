@@ -0,0 +1,26 @@
+"""
+Datas por extenso, em português, nas mensagens enviadas ao paciente.
+
+Os nomes dos dias e dos meses vêm das tabelas abaixo, e não do locale do processo
+(strftime com %A e %B), que pode não estar configurado no servidor ou no worker.
+"""
+from django.utils import timezone
+
+DIAS_DA_SEMANA = ['segunda-feira', 'terça-feira', 'quarta-feira', 'quinta-feira', 'sexta-feira', 'sábado', 'domingo']
+MESES = [
+    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
+    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro',
+]
+
+
+def data_e_hora_por_extenso(momento):
+    """ Ex: "Segunda-feira, 20 de outubro às 09:00", no fuso local. """
+    local = timezone.localtime(momento)
+    texto = f"{DIAS_DA_SEMANA[local.weekday()]}, {local.day:02d} de {MESES[local.month - 1]} às {local:%H:%M}"
+    return texto.capitalize()
+
+
+def dia_e_hora_por_extenso(momento):
+    """ Ex: "Segunda-feira, dia 20, às 09:00", no fuso local (lista de horários oferecidos). """
+    local = timezone.localtime(momento)
+    return f"{DIAS_DA_SEMANA[local.weekday()]}, dia {local.day:02d}, às {local:%H:%M}".capitalize()
@@ -0,0 +1,81 @@
+"""
+Histórico das conversas do WhatsApp com limite de tamanho para os prompts.
+
+Durante o atendimento de uma mensagem, a mensagem recebida e as respostas enviadas ao
+paciente são acumuladas na memória (`registrar_conversa` + `anotar_resposta`) e gravadas
+com um único bulk_create no final. Para os prompts, `obter_historico` lê só os últimos
+turnos do paciente (pelo índice paciente + criado_em) e para quando o orçamento de tokens
+acaba, então o tamanho do prompt não cresce com a conversa.
+"""
+import math
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.utils import timezone
+
+from .models import MensagemConversa
+
+# Padrões da janela de histórico incluída nos prompts.
+LIMITE_TURNOS = 10
+ORCAMENTO_TOKENS = 500
+# Estimativa simples para português: cerca de 4 caracteres por token.
+CARACTERES_POR_TOKEN = 4
+
+# Mensagens mais antigas que isso são apagadas pelo comando limpar_mensagens_whatsapp.
+RETENCAO_CONVERSA = timedelta(days=90)
+
+_mensagens_do_atendimento = ContextVar('mensagens_do_atendimento', default=None)
+
+
+@asynccontextmanager
+async def registrar_conversa(paciente_id, mensagem_recebida):
+    """ Acumula as mensagens do atendimento em andamento e grava todas juntas ao sair. """
+    mensagens = [MensagemConversa(paciente_id=paciente_id, autor='paciente', texto=mensagem_recebida)]
+    token = _mensagens_do_atendimento.set(mensagens)
+    try:
+        yield
+    finally:
+        _mensagens_do_atendimento.reset(token)
+        try:
+            await MensagemConversa.objects.abulk_create(mensagens)
+        except Exception as e:
+            # O histórico é só contexto: uma falha ao gravá-lo não derruba o atendimento.
+            print(f"ERRO ao gravar o histórico da conversa: {e}")
+
+
+def anotar_resposta(texto):
+    """ Registra a resposta enviada ao paciente no atendimento em andamento, se houver. """
+    mensagens = _mensagens_do_atendimento.get()
+    if mensagens is not None:
+        mensagens.append(MensagemConversa(paciente_id=mensagens[0].paciente_id, autor='assistente', texto=texto))
+
+
+def estimar_tokens(texto):
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+
+async def obter_historico(paciente_id, limite_turnos=LIMITE_TURNOS, orcamento_tokens=ORCAMENTO_TOKENS):
+    """
+    Últimas mensagens do paciente, em ordem cronológica: no máximo `limite_turnos` mensagens e
+    `orcamento_tokens` tokens estimados, sempre as mais recentes.
+    """
+    recentes = MensagemConversa.objects.filter(paciente_id=paciente_id).order_by('-criado_em', '-id')[:limite_turnos]
+    mensagens, tokens = [], 0
+    async for mensagem in recentes.only('autor', 'texto', 'criado_em'):
+        tokens += estimar_tokens(mensagem.texto)
+        if tokens > orcamento_tokens:
+            break
+        mensagens.append(mensagem)
+    mensagens.reverse()
+    return mensagens
+
+
+def formatar_historico(mensagens):
+    """ Texto do histórico para os prompts ("Paciente: ..." / "Assistente: ..."). """
+    return "\n".join(f"{mensagem.get_autor_display()}: {mensagem.texto}" for mensagem in mensagens)
+
+
+def limpar_conversas_antigas():
+    """ Apaga as mensagens mais antigas que a retenção. Retorna quantas foram apagadas. """
+    apagadas, _ = MensagemConversa.objects.filter(criado_em__lt=timezone.now() - RETENCAO_CONVERSA).delete()
+    return apagadas
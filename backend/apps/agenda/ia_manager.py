@@ -1,13 +1,22 @@
 import os
+from asgiref.sync import sync_to_async
+from dataclasses import dataclass
 from google import genai
-from apps.users.models import Profissional, Conta, ItemFAQ, PerfilClinica, Paciente
-from apps.financas.models import Servico, Transacao
-from apps.agenda.models import Agendamento, HorarioTrabalho, ExcecaoHorario
+from google.genai import types
+from django.db.models import Sum
+from apps.users.models import Profissional, Conta, Paciente
+from apps.financas.models import Transacao
+from apps.agenda.disponibilidade import buscar_horarios_disponiveis
+from apps.agenda.interpretador_horarios import interpretar_preferencias
+from apps.agenda.escolha_horario import resolver_escolha, formatar_horarios_numerados
+from apps.agenda.roteador_intencoes import identificar_intencao_local, registrar_classificacao
+from apps.agenda.indice_faq import identificar_intencao_faq
+from apps.agenda.cache_respostas_ia import respostas_ia, chave_resposta, TEMPOS_CACHE
+from apps.agenda.contexto_conta import obter_contexto_conta
+from apps.agenda.modelos_mensagem import obter_modelo, montar_mensagem
+from apps.agenda.historico_conversa import obter_historico, formatar_historico
 from apps.solicitacoes.models import Solicitacao
-from datetime import timedelta, time, datetime, timezone
 import json
-from django.utils import timezone as django_timezone
-from twilio.rest import Client
 import re
 import locale
 
@@ -18,29 +27,167 @@ except locale.Error:
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+# Intenções que não dependem do FAQ da conta.
+INTENCOES_FIXAS = ['SAUDACAO', 'AGENDAR', 'AGENDAR_COM_PREFERENCIA', 'ESCOLHEU_HORARIO', 'VERIFICAR_PENDENCIAS', 'DESCONHECIDO']
+CAMPOS_PREFERENCIAS = ('dia_semana', 'periodo', 'hora')
+
+
+class RespostaIAInvalida(ValueError):
+    """ A Gemini respondeu fora do esquema JSON pedido. """
+
+
+@dataclass
+class AnaliseMensagem:
+    intencao: str
+    preferencias: dict = None  # dia_semana/periodo/hora, quando extraídos na mesma chamada
+    horario_escolhido: dict = None  # item da lista de horários oferecidos
+    origem: str = 'gemini'
+
+
+def _esquema_preferencias(propriedades=None, obrigatorios=()):
+    propriedades = dict(propriedades or {})
+    propriedades.update({
+        'dia_semana': types.Schema(type='INTEGER', nullable=True, minimum=0, maximum=6),
+        'periodo': types.Schema(type='STRING', nullable=True, enum=['manha', 'tarde', 'noite']),
+        'hora': types.Schema(type='STRING', nullable=True, description='Horário no formato HH:MM'),
+    })
+    return types.Schema(type='OBJECT', properties=propriedades, required=[*obrigatorios, *CAMPOS_PREFERENCIAS])
+
+
+def _esquema_analise(intencoes):
+    return _esquema_preferencias({
+        'intencao': types.Schema(type='STRING', enum=intencoes),
+        'horario_escolhido': types.Schema(type='INTEGER', nullable=True, minimum=1, description='Número do horário oferecido escolhido'),
+    }, obrigatorios=('intencao', 'horario_escolhido'))
+
+
+def _carregar_objeto_json(texto):
+    try:
+        dados = json.loads(texto)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise RespostaIAInvalida(f"JSON inválido: {texto!r}") from e
+    if not isinstance(dados, dict):
+        raise RespostaIAInvalida(f"Era esperado um objeto JSON: {texto!r}")
+    return dados
+
+
+def _validar_preferencias(texto, dados=None):
+    dados = _carregar_objeto_json(texto) if dados is None else dados
+    dia_semana, periodo, hora = (dados.get(campo) for campo in CAMPOS_PREFERENCIAS)
+    if dia_semana is not None and (type(dia_semana) is not int or not 0 <= dia_semana <= 6):
+        raise RespostaIAInvalida(f"dia_semana inválido: {dia_semana!r}")
+    if periodo not in (None, 'manha', 'tarde', 'noite'):
+        raise RespostaIAInvalida(f"periodo inválido: {periodo!r}")
+    if hora is not None and not (isinstance(hora, str) and re.fullmatch(r'([01]\d|2[0-3]):[0-5]\d', hora)):
+        raise RespostaIAInvalida(f"hora inválida: {hora!r}")
+    return {campo: dados.get(campo) for campo in CAMPOS_PREFERENCIAS}
+
+
+def _validar_analise(texto, intencoes_validas, quantidade_horarios):
+    dados = _carregar_objeto_json(texto)
+    if dados.get('intencao') not in intencoes_validas:
+        raise RespostaIAInvalida(f"intencao inválida: {dados.get('intencao')!r}")
+    escolhido = dados.get('horario_escolhido')
+    if escolhido is not None and (type(escolhido) is not int or not 1 <= escolhido <= quantidade_horarios):
+        raise RespostaIAInvalida(f"horario_escolhido inválido: {escolhido!r}")
+    return {'intencao': dados['intencao'], 'horario_escolhido': escolhido, **_validar_preferencias(texto, dados)}
+
+
 class GeminiAIManager:
     """
     Esta classe gere toda a comunicação com a API da Gemini.
+    Os métodos são assíncronos: usam o ORM assíncrono do Django e o cliente `aio` da Gemini,
+    para que um único processo atenda várias conversas ao mesmo tempo.
+    O `profissional` (e, nas contas, o `proprietario`) deve vir carregado com select_related.
     """
     def __init__(self, profissional: Profissional):
         self.profissional = profissional
         self.client = genai.Client(api_key=GEMINI_API_KEY)
         self.model_name = 'gemini-2.5-flash'
 
-    def _generate_content(self, prompt: str) -> str:
-        """Função auxiliar para chamar a API."""
-        response = self.client.models.generate_content(
+    async def _generate_content(self, prompt: str, tipo_cache: str = None, config: types.GenerateContentConfig = None) -> str:
+        """
+        Função auxiliar para chamar a API (cliente assíncrono, não bloqueia o event loop).
+        Com `tipo_cache` (uma chave de TEMPOS_CACHE), a resposta de um prompt já visto para a
+        mesma conta é reaproveitada sem chamar a Gemini. `config` é repassado à API (ex: modo JSON).
+        """
+        if tipo_cache:
+            chave = await chave_resposta(self.model_name, prompt, self.profissional.conta_id)
+            resposta_guardada = respostas_ia.obter(chave)
+            if resposta_guardada is not None:
+                return resposta_guardada
+
+        response = await self.client.aio.models.generate_content(
             model=self.model_name,
-            contents=prompt
+            contents=prompt,
+            config=config
         )
-        return response.text.strip()
+        texto = response.text.strip()
+        if tipo_cache and texto:
+            respostas_ia.guardar(chave, texto, TEMPOS_CACHE[tipo_cache])
+        return texto
 
-    def identificar_intencao_geral(self, mensagem_paciente: str, conta: Conta):
+    async def _gerar_json(self, prompt: str, esquema: types.Schema, validar):
+        """
+        Chama a Gemini no modo JSON com o esquema informado e valida a resposta com `validar`.
+        Uma resposta fora do esquema é pedida de novo uma vez; se persistir, RespostaIAInvalida é propagada.
         """
-        Primeiro passo: Tenta classificar a mensagem em uma intenção de alto nível.
+        config = types.GenerateContentConfig(response_mime_type='application/json', response_schema=esquema)
+        for tentativa in range(2):
+            texto = await self._generate_content(prompt, config=config)
+            try:
+                return validar(texto)
+            except RespostaIAInvalida as e:
+                print(f"--> Resposta da Gemini fora do esquema (tentativa {tentativa + 1}): {e}")
+                print(f"--> Resposta recebida: {texto!r}")
+                if tentativa:
+                    raise
+
+    async def analisar_mensagem(self, mensagem_paciente: str, conta: Conta, horarios_oferecidos: list = None, paciente_id: int = None):
         """
-        itens_faq = ItemFAQ.objects.filter(conta=conta)
-        intencoes_cadastradas = "\n".join([f"- {item.intencao_chave}: {item.perguntas_exemplo}" for item in itens_faq])
+        Classifica a mensagem e, na mesma chamada, extrai as preferências de agendamento e o
+        horário escolhido entre os oferecidos. As mensagens mais comuns são resolvidas pelas regras
+        locais e as perguntas do FAQ pelo índice de busca da conta; só as demais vão para a Gemini.
+        `horarios_oferecidos` é a lista de horários em oferta no cache ({'inicio', 'fim', 'profissional_id'}).
+        Com `paciente_id`, as últimas mensagens da conversa vão no prompt da Gemini como contexto.
+        """
+        horarios_oferecidos = horarios_oferecidos or []
+        intencao_local = identificar_intencao_local(mensagem_paciente, len(horarios_oferecidos))
+        if intencao_local:
+            print(f"--> Intenção identificada localmente: {intencao_local}")
+            registrar_classificacao('regras', intencao_local)
+            # A regra de confirmação só vale quando há exatamente um horário em oferta.
+            escolhido = horarios_oferecidos[0] if intencao_local == 'ESCOLHEU_HORARIO' else None
+            return AnaliseMensagem(intencao_local, horario_escolhido=escolhido, origem='regras')
+
+        escolhido, escolha_ambigua = resolver_escolha(mensagem_paciente, horarios_oferecidos)
+        if escolhido:
+            print(f"--> Horário escolhido identificado localmente: {escolhido['inicio']}")
+            registrar_classificacao('regras', 'ESCOLHEU_HORARIO')
+            return AnaliseMensagem('ESCOLHEU_HORARIO', horario_escolhido=escolhido, origem='regras')
+
+        # Uma resposta que serve para mais de um horário oferecido fica com a Gemini.
+        preferencias = None if escolha_ambigua else interpretar_preferencias(mensagem_paciente)
+        if preferencias:
+            print(f"--> Preferência de horário interpretada localmente: {preferencias}")
+            registrar_classificacao('regras', 'AGENDAR_COM_PREFERENCIA')
+            return AnaliseMensagem('AGENDAR_COM_PREFERENCIA', preferencias=preferencias, origem='regras')
+
+        intencao_faq = await identificar_intencao_faq(mensagem_paciente, conta.id)
+        if intencao_faq:
+            print(f"--> Intenção identificada pelo índice do FAQ: {intencao_faq}")
+            registrar_classificacao('faq', intencao_faq)
+            return AnaliseMensagem(intencao_faq, origem='faq')
+
+        registrar_classificacao('gemini')
+        contexto = await obter_contexto_conta(conta.id)
+        intencoes_validas = INTENCOES_FIXAS + list(contexto['respostas_faq'])
+        if not horarios_oferecidos:
+            intencoes_validas.remove('ESCOLHEU_HORARIO')
+            texto_oferecidos = "Nenhum horário foi oferecido ainda."
+        else:
+            texto_oferecidos = formatar_horarios_numerados([h['inicio'] for h in horarios_oferecidos])
+        historico = formatar_historico(await obter_historico(paciente_id)) if paciente_id else ''
 
         prompt = f"""
         Analise a mensagem do paciente e classifique-a em uma das intenções abaixo.
@@ -55,28 +202,67 @@ class GeminiAIManager:
         - ESCOLHEU_HORARIO: Se a mensagem do paciente corresponde claramente a um dos horários específicos que foram oferecidos.
 
         Intenções do FAQ da Clínica:
-        {intencoes_cadastradas}
+        {contexto['intencoes_cadastradas']}
         
         Intenção de Finanças:
         - VERIFICAR_PENDENCIAS: Se o paciente está perguntando sobre débitos ou pagamentos pendentes. (Ex: "tenho algo para pagar?", "estou devendo alguma consulta?", "qual o valor em aberto?")
 
-        Se não se encaixar em nada, responda "DESCONHECIDO".
+        Se não se encaixar em nada, use "DESCONHECIDO".
+
+        Horários oferecidos ao paciente:
+        {texto_oferecidos}
+
+        Mensagens anteriores da conversa (só como contexto; classifique a mensagem atual):
+        {historico or "Nenhuma."}
+
+        Além da intenção, preencha:
+        - "dia_semana": número de 0 (Segunda) a 6 (Domingo) mencionado pelo paciente, ou null.
+        - "periodo": "manha", "tarde" ou "noite", ou null.
+        - "hora": horário específico no formato "HH:MM", ou null.
+        - "horario_escolhido": o número do horário oferecido que o paciente escolheu, ou null.
 
         Mensagem: "{mensagem_paciente}"
-        Sua Resposta: 
         """
-        return self._generate_content(prompt)
-    
-    def gerar_pergunta_onboarding(self, nome_paciente: str):
-        """ Gera a mensagem para solicitar os dados de onboarding. """
+        try:
+            dados = await self._gerar_json(
+                prompt, _esquema_analise(intencoes_validas),
+                lambda texto: _validar_analise(texto, intencoes_validas, len(horarios_oferecidos)),
+            )
+        except RespostaIAInvalida:
+            # Sem uma análise confiável, o paciente recebe a oferta de falar com um atendente.
+            print("--> Análise da Gemini descartada; mensagem tratada como DESCONHECIDO.")
+            return AnaliseMensagem('DESCONHECIDO')
+        escolhido = dados['horario_escolhido']
+        return AnaliseMensagem(
+            dados['intencao'],
+            preferencias={chave: dados[chave] for chave in CAMPOS_PREFERENCIAS},
+            horario_escolhido=horarios_oferecidos[escolhido - 1] if escolhido else None,
+        )
+
+    async def _mensagem_fixa(self, chave: str, **variaveis):
+        """
+        Monta uma mensagem fixa a partir do modelo da conta (ou do padrão), sem chamar a Gemini.
+        Só quando a conta marcou o modelo para ser reescrito pela IA o texto montado vai para a Gemini.
+        """
+        contexto = await obter_contexto_conta(self.profissional.conta_id)
+        texto, reescrever_com_ia = obter_modelo(contexto, chave)
+        variaveis.setdefault('profissional', self.profissional.nome_completo)
+        mensagem = montar_mensagem(texto, chave, **variaveis)
+        if not reescrever_com_ia:
+            return mensagem
+
         prompt = f"""
-        Você é uma secretária virtual. O novo paciente, {nome_paciente}, acabou de ter sua primeira consulta agendada.
-        Sua tarefa é gerar uma mensagem amigável para adiantar o cadastro dele, pedindo o CPF e a data de nascimento.
+        Você é uma secretária virtual. Reescreva a mensagem abaixo com suas palavras, de forma amigável,
+        mantendo o mesmo sentido, as mesmas informações e o mesmo tamanho aproximado. Responda só com a mensagem.
 
-        Exemplo de resposta:
-        "Perfeito, {nome_paciente}! Seu agendamento está confirmado. Para agilizar seu atendimento no dia, você poderia me informar seu CPF e data de nascimento, por favor? (Ex: 123.456.789-10 e 25/12/1990)"
+        Mensagem: "{mensagem}"
         """
-        return self._generate_content(prompt)
+        resposta = await self._generate_content(prompt, tipo_cache=chave)
+        return resposta or mensagem
+
+    async def gerar_pergunta_onboarding(self, nome_paciente: str):
+        """ Mensagem que pede os dados de onboarding (CPF e data de nascimento). """
+        return await self._mensagem_fixa('pergunta_onboarding', nome=nome_paciente)
 
     def extrair_dados_onboarding(self, mensagem: str):
         """ Extrai CPF e Data de Nascimento da mensagem do paciente. """
@@ -91,14 +277,14 @@ class GeminiAIManager:
         
         return {'cpf': cpf, 'data_nascimento': data_nascimento}
         
-    def buscar_e_responder_pendencias(self, paciente: Paciente):
+    async def buscar_e_responder_pendencias(self, paciente: Paciente):
         """ Consulta e gera uma resposta sobre as pendências financeiras do paciente. """
         pendencias = Transacao.objects.filter(paciente=paciente, status='pendente')
         
-        if not pendencias.exists():
+        if not await pendencias.aexists():
             return f"Verifiquei aqui, {paciente.nome_completo.split(' ')[0]}, e não há nenhum valor pendente em seu nome. Está tudo certo!"
 
-        total_pendente = pendencias.aggregate(total=models.Sum('valor_cobrado'))['total']
+        total_pendente = (await pendencias.aaggregate(total=Sum('valor_cobrado')))['total']
         valor_formatado = f"R$ {total_pendente:.2f}".replace('.', ',')
 
         prompt = f"""
@@ -110,44 +296,38 @@ class GeminiAIManager:
         Exemplo de resposta:
         "Olá, {paciente.nome_completo.split(' ')[0]}! Verifiquei no sistema e consta um valor total de {valor_formatado} em aberto. Gostaria que eu enviasse o código PIX para facilitar o pagamento?"
         """
-        return self._generate_content(prompt)
+        return await self._generate_content(prompt)
     
-    def buscar_e_gerar_resposta_faq(self, intencao_identificada: str, conta: Conta):
+    async def buscar_e_gerar_resposta_faq(self, intencao_identificada: str, conta: Conta):
         """
         Busca a resposta no banco de dados, enriquece com dados dinâmicos se necessário,
         e gera uma resposta amigável para o paciente.
         """
         try:
-            item_faq = ItemFAQ.objects.get(conta=conta, intencao_chave=intencao_identificada)
-            resposta_base = item_faq.resposta
+            contexto = await obter_contexto_conta(conta.id)
+            resposta_base = contexto['respostas_faq'].get(intencao_identificada)
+            if resposta_base is None:
+                return "Peço desculpas, mas não encontrei uma resposta para sua pergunta. Posso tentar ajudar com outra coisa?"
             contexto_dinamico = ""
 
             if intencao_identificada == 'conhecer_servicos':
-                servicos = Servico.objects.filter(conta=conta, ativo=True)
-                if servicos.exists():
-                    lista_servicos = ", ".join([s.nome_servico for s in servicos])
+                if contexto['servicos']:
+                    lista_servicos = ", ".join(contexto['servicos'])
                     contexto_dinamico = f"Aqui estão os serviços que oferecemos: {lista_servicos}."
                 else:
                     contexto_dinamico = "Ainda não temos uma lista de serviços cadastrada."
 
             elif intencao_identificada == 'localizacao_contato':
-                perfil = conta.perfil
-                horarios = HorarioTrabalho.objects.filter(profissional__conta=conta, ativo=True).order_by('dia_da_semana')
-                
+                perfil = contexto['perfil']
                 info_perfil = f"O endereço é {perfil.endereco_completo or '[Endereço não informado]'}. O telefone para contato é {self.profissional.contato_telefone or '[Telefone não informado]'}. O site é {perfil.site_url or '[Site não informado]'}"
                 
-                if horarios.exists():
-                    texto_horarios = " Nosso horário de funcionamento é:"
-                    dias_semana = dict(HorarioTrabalho.DIAS_SEMANA)
-                    for h in horarios:
-                        texto_horarios += f" {dias_semana[h.dia_da_semana]} das {h.hora_inicio.strftime('%H:%M')} às {h.hora_fim.strftime('%H:%M')};"
-                    contexto_dinamico = info_perfil + texto_horarios
+                if contexto['horarios_funcionamento']:
+                    contexto_dinamico = info_perfil + " Nosso horário de funcionamento é:" + contexto['horarios_funcionamento']
                 else:
                     contexto_dinamico = info_perfil + ". O horário de funcionamento não foi cadastrado."
 
             elif intencao_identificada == 'conhecer_profissionais':
-                profissionais = Profissional.objects.filter(conta=conta, is_active=True)
-                lista_profissionais = ", ".join([p.nome_completo for p in profissionais])
+                lista_profissionais = ", ".join(contexto['equipe'])
                 contexto_dinamico = f"Nossa equipe é composta por: {lista_profissionais}."
 
             prompt = f"""
@@ -162,74 +342,31 @@ class GeminiAIManager:
             Sua tarefa é formular uma resposta amigável e natural para o paciente. Se houver informações adicionais, integre-as de forma fluida à resposta padrão.
             Não inclua os colchetes como '[Endereço não informado]', apenas omita a informação se ela não existir.
             """
-            return self._generate_content(prompt)
+            return await self._generate_content(prompt, tipo_cache='faq')
             
-        except ItemFAQ.DoesNotExist:
-            return "Peço desculpas, mas não encontrei uma resposta para sua pergunta. Posso tentar ajudar com outra coisa?"
         except Exception as e:
             print(f"ERRO inesperado ao buscar resposta do FAQ: {e}")
             return "Não consegui processar sua solicitação no momento. Por favor, tente novamente."
 
-    def analisar_mensagem_paciente(self, mensagem_paciente: str, horarios_oferecidos: list = None):
-        horarios_ofertados_str = "Nenhum horário foi oferecido ainda."
-        if horarios_oferecidos:
-            horarios_formatados = [
-                f"'{django_timezone.localtime(h).strftime('%A, dia %d, às %H:%M')}'"
-                for h in horarios_oferecidos
-            ]
-            horarios_ofertados_str = f"Os seguintes horários foram oferecidos ao paciente: {', '.join(horarios_formatados)}"
+    async def gerar_pergunta_nome_completo(self):
+        return await self._mensagem_fixa('pergunta_nome_completo')
 
-        prompt = f"""
-        Analise a mensagem do paciente e determine sua intenção principal, considerando o contexto da conversa.
-        Responda APENAS com um JSON contendo a chave "intent".
-
-        Contexto da conversa:
-        {horarios_ofertados_str}
-
-        As intenções possíveis são:
-        - "SAUDACAO": Se for apenas um cumprimento ou uma mensagem genérica sem um pedido claro. (Ex: "oi, bom dia", "olá", "tudo bem?")
-        - "AGENDAR": Se o paciente quer marcar uma consulta, mas não especificou um dia ou período.
-        - "AGENDAR_COM_PREFERENCIA": Se o paciente quer marcar e JÁ ESPECIFICOU um dia ou período.
-        - "ESCOLHEU_HORARIO": Se a mensagem do paciente corresponde claramente a um dos horários específicos que foram oferecidos.
-        - "DUVIDA": Se o paciente está fazendo uma pergunta geral.
+    async def gerar_mensagem_encaminhamento(self):
+        """ Resposta para mensagens que não foram entendidas: oferece falar com um atendente. """
+        return await self._mensagem_fixa('encaminhamento_humano')
 
-        Mensagem do paciente: "{mensagem_paciente}"
-        """
-        response_text = self._generate_content(prompt)
-        try:
-            cleaned_response = response_text.strip().replace('```json', '').replace('```', '')
-            return json.loads(cleaned_response)
-        except (json.JSONDecodeError, AttributeError):
-            return {"intent": "DESCONHECIDO"}
-
-    def gerar_pergunta_nome_completo(self):
-        prompt = """
-        Você é uma secretária virtual. Um novo paciente acaba de confirmar um horário para sua primeira consulta.
-        Sua tarefa é pedir, de forma amigável, o nome completo dele para finalizar o agendamento.
-
-        Exemplo de resposta:
-        "Ótimo! Para finalizar o seu agendamento, por favor, me informe o seu nome completo."
-        """
-        return self._generate_content(prompt)
-
-    def gerar_pergunta_preferencia(self, nome_paciente: str):
+    async def gerar_pergunta_preferencia(self, nome_paciente: str):
         # MELHORIA: Usa uma saudação mais genérica se o nome for padrão
         saudacao_nome = nome_paciente if nome_paciente and "Meu nome é" not in nome_paciente and "Novo Contato" not in nome_paciente else "tudo bem?"
-        
-        prompt = f"""
-        Você é uma secretária virtual para {self.profissional.nome_completo}.
-        Sua tarefa é responder a um paciente chamado {saudacao_nome} que pediu para agendar uma consulta.
-        Responda de forma amigável e pergunte qual o dia da semana ou período (manhã/tarde) de sua preferência para o agendamento.
+        return await self._mensagem_fixa('pergunta_preferencia', nome=saudacao_nome)
 
-        Exemplo de resposta:
-        "Olá, {saudacao_nome}! Claro! Para te ajudar a encontrar o melhor horário, você tem alguma preferência de dia da semana ou período (manhã ou tarde)?"
-        """
-        return self._generate_content(prompt)
+    async def extrair_preferencias(self, mensagem_paciente: str):
+        preferencias = interpretar_preferencias(mensagem_paciente)
+        if preferencias:
+            return preferencias
 
-    def extrair_preferencias(self, mensagem_paciente: str):
         prompt = f"""
         Analise a mensagem do paciente e extraia o dia da semana, o período (manhã, tarde, noite) e um horário específico, se houver.
-        Responda APENAS com um JSON contendo as chaves "dia_semana", "periodo" e "hora".
         - "dia_semana": número de 0 (Segunda) a 6 (Domingo). Se não for mencionado, use null.
         - "periodo": "manha", "tarde" ou "noite". Se não for mencionado, use null.
         - "hora": "HH:MM". Se não for mencionado, use null.
@@ -242,115 +379,24 @@ class GeminiAIManager:
 
         Mensagem do paciente: "{mensagem_paciente}"
         """
-        response_text = self._generate_content(prompt)
         try:
-            cleaned_response = response_text.strip().replace('```json', '').replace('```', '')
-            return json.loads(cleaned_response)
-        except (json.JSONDecodeError, AttributeError):
-            return {"dia_semana": None, "periodo": None, "hora": None}
-
-    def extrair_horario_escolhido(self, mensagem_paciente: str, horarios_oferecidos: list):
-        """
-        A partir de uma lista de horários oferecidos, identifica qual deles o paciente escolheu.
-        """
-        horarios_formatados = [
-            f"'{django_timezone.localtime(h).strftime('%A, dia %d, às %H:%M')}'" 
-            for h in horarios_oferecidos
-        ]
-        
-        prompt = f"""
-        Analise a mensagem do paciente e determine qual dos horários da lista ele escolheu.
-        Responda APENAS com o horário escolhido, exatamente como ele aparece na lista.
-        Se a mensagem do paciente não corresponder a nenhum horário, responda com "NENHUM".
+            return await self._gerar_json(prompt, _esquema_preferencias(), _validar_preferencias)
+        except RespostaIAInvalida:
+            # Sem preferências, a busca oferece os próximos horários livres.
+            return {}
 
-        Lista de horários oferecidos:
-        {", ".join(horarios_formatados)}
-
-        Mensagem do paciente: "{mensagem_paciente}"
-        """
-        escolha = self._generate_content(prompt).replace("'", "")
-
-        if escolha == "NENHUM":
-            return None
-
-        for horario_obj in horarios_oferecidos:
-            if django_timezone.localtime(horario_obj).strftime('%A, dia %d, às %H:%M') == escolha:
-                return horario_obj
-        
-        return None
-
-    def encontrar_horarios_disponiveis(self, preferencias=None):
+    async def encontrar_horarios_disponiveis(self, preferencias=None):
         """
         Verifica a agenda do profissional e retorna os próximos 3 horários livres.
         """
-        # (Seu código original aqui, sem alterações)
-        agora_local = django_timezone.localtime(django_timezone.now())
-        horarios_encontrados = []
-        periodos = { "manha": (time(8, 0), time(12, 0)), "tarde": (time(12, 0), time(18, 0)), "noite": (time(18, 0), time(21, 0)), }
-        dia_preferido = preferencias.get('dia_semana') if preferencias else None
-        periodo_preferido = preferencias.get('periodo') if preferencias else None
-        hora_preferida_str = preferencias.get('hora') if preferencias else None
-        for dia_delta in range(30):
-            data_atual = agora_local.date() + timedelta(days=dia_delta)
-            dia_da_semana = data_atual.weekday()
-            if dia_preferido is not None and dia_da_semana != dia_preferido:
-                continue
-            horario_inicio_trabalho = None
-            horario_fim_trabalho = None
-            try:
-                excecao = ExcecaoHorario.objects.get(profissional=self.profissional, data=data_atual)
-                if excecao.dia_inteiro:
-                    continue
-                else:
-                    horario_inicio_trabalho = excecao.hora_inicio
-                    horario_fim_trabalho = excecao.hora_fim
-            except ExcecaoHorario.DoesNotExist:
-                try:
-                    horario_padrao = HorarioTrabalho.objects.get(profissional=self.profissional, dia_da_semana=dia_da_semana, ativo=True)
-                    horario_inicio_trabalho = horario_padrao.hora_inicio
-                    horario_fim_trabalho = horario_padrao.hora_fim
-                except HorarioTrabalho.DoesNotExist:
-                    continue
-            if not horario_inicio_trabalho or not horario_fim_trabalho:
-                continue
-            horas_para_verificar = []
-            if hora_preferida_str:
-                try:
-                    hora_proposta_time = datetime.strptime(hora_preferida_str, '%H:%M').time()
-                    if hora_proposta_time >= horario_inicio_trabalho and hora_proposta_time < horario_fim_trabalho:
-                        horas_para_verificar.append(hora_proposta_time)
-                except ValueError:
-                    pass
-            else:
-                hora_inicio_busca = horario_inicio_trabalho
-                hora_fim_busca = horario_fim_trabalho
-                if periodo_preferido and periodo_preferido in periodos:
-                    hora_inicio_busca = max(horario_inicio_trabalho, periodos[periodo_preferido][0])
-                    hora_fim_busca = min(horario_fim_trabalho, periodos[periodo_preferido][1])
-                hora_atual = datetime.combine(data_atual, hora_inicio_busca)
-                hora_limite = datetime.combine(data_atual, hora_fim_busca)
-                while hora_atual < hora_limite:
-                    horas_para_verificar.append(hora_atual.time())
-                    hora_atual += timedelta(hours=1)
-            for hora_time in horas_para_verificar:
-                hora_proposta = datetime.combine(data_atual, hora_time)
-                horario_proposto_local = django_timezone.make_aware(hora_proposta)
-                if horario_proposto_local > agora_local:
-                    horario_proposto_utc_fim = (horario_proposto_local + timedelta(hours=1)).astimezone(timezone.utc)
-                    conflito = Agendamento.objects.filter(profissional=self.profissional, data_hora_inicio__lt=horario_proposto_utc_fim, data_hora_fim__gt=horario_proposto_local.astimezone(timezone.utc)).exists()
-                    if not conflito:
-                        horarios_encontrados.append(horario_proposto_local.astimezone(timezone.utc))
-                        if len(horarios_encontrados) >= 3:
-                            return horarios_encontrados
-        return horarios_encontrados
-
-    def gerar_resposta_com_horarios(self, nome_paciente: str, horarios=None):
+        return await sync_to_async(buscar_horarios_disponiveis)(self.profissional, preferencias)
+
+    async def gerar_resposta_com_horarios(self, nome_paciente: str, horarios=None):
         if not horarios:
-            return f"Olá, {nome_paciente}! Puxa, não encontrei horários disponíveis com essa preferência para os próximos 30 dias. Gostaria de tentar outro dia ou período? Se preferir, posso deixar seu nome em nossa lista de espera."
+            return f"Olá, {nome_paciente}! Puxa, não encontrei horários disponíveis com essa preferência para os próximos 30 dias. Deixei seu nome em nossa lista de espera e aviso você por aqui assim que um horário assim vagar. Se quiser, posso procurar em outro dia ou período."
 
-        # MELHORIA: Usa o strftime para formatar em português
-        horarios_formatados = [django_timezone.localtime(h).strftime('%A, dia %d, às %H:%M') for h in horarios]
-        texto_horarios = "\n".join(f"• {h.capitalize()}" for h in horarios_formatados)
+        # Os horários vão numerados para que o paciente possa responder só com o número
+        texto_horarios = formatar_horarios_numerados(horarios)
 
         # MELHORIA: Usa uma saudação mais genérica se o nome for padrão
         saudacao_nome = nome_paciente if nome_paciente and "Meu nome é" not in nome_paciente and "Novo Contato" not in nome_paciente else "você"
@@ -360,8 +406,8 @@ class GeminiAIManager:
 
         **Instruções para a resposta:**
         - **Tom de voz:** Amigável e prestativo.
-        - **Apresente os horários:** Diga que encontrou alguns horários e apresente a lista.
-        - **Chamada para ação:** Pergunte qual opção é a melhor para ele.
+        - **Apresente os horários:** Diga que encontrou alguns horários e apresente a lista exatamente como está, com a numeração.
+        - **Chamada para ação:** Pergunte qual opção é a melhor para ele, pedindo que responda com o número.
         - **Idioma:** Responda sempre em português do Brasil.
 
         **Horários disponíveis:**
@@ -370,27 +416,24 @@ class GeminiAIManager:
         **Exemplo de resposta:**
         "Perfeito, {saudacao_nome}! Verifiquei aqui e encontrei os seguintes horários para você:
         {texto_horarios}
-        Qual dessas opções fica melhor?"
+        Qual dessas opções fica melhor? É só me responder com o número."
 
         Agora, escreva a resposta final para o paciente.
         """
         try:
-            return self._generate_content(prompt)
+            return await self._generate_content(prompt)
         except Exception as e:
             print(f"Erro ao gerar resposta com a Gemini: {e}")
             return "Encontrei alguns horários. Poderia, por favor, ligar para confirmarmos?"
 
-    def registrar_solicitacao_paciente(self, intencao: str, conta: Conta, paciente: 'Paciente'):
+    async def registrar_solicitacao_paciente(self, intencao: str, conta: Conta, paciente: 'Paciente'):
         # (Seu código original aqui, sem alterações)
         mapa_intencao_tipo = { 'solicitar_receita': 'RECEITA', 'solicitar_atestado': 'ATESTADO', 'solicitar_recibo': 'RECIBO' }
         tipo = mapa_intencao_tipo.get(intencao)
         if not tipo:
             return "Não entendi qual documento você precisa. Pode especificar?"
-        Solicitacao.objects.create(conta=conta, paciente=paciente, profissional_atribuido=conta.proprietario, tipo_solicitacao=tipo)
-        prompt = f"""
-        Você é uma secretária virtual. O paciente {paciente.nome_completo} acabou de solicitar um documento do tipo '{tipo}'.
-        Sua tarefa é gerar uma resposta curta e amigável confirmando que a solicitação foi registrada e será encaminhada ao profissional responsável.
-        
-        Exemplo: "Registrado! Sua solicitação de {tipo.lower()} foi encaminhada para o(a) Dr(a). {conta.proprietario.nome_completo}. Avisaremos assim que estiver pronto!"
-        """
-        return self._generate_content(prompt)
\ No newline at end of file
+        await Solicitacao.objects.acreate(conta=conta, paciente=paciente, profissional_atribuido=conta.proprietario, tipo_solicitacao=tipo)
+        return await self._mensagem_fixa(
+            'solicitacao_registrada', nome=paciente.nome_completo, tipo_documento=tipo.lower(),
+            profissional=conta.proprietario.nome_completo,
+        )
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""
+Índice de busca (BM25) sobre as perguntas de exemplo do FAQ de cada conta.
+
+Cada pergunta de `ItemFAQ.perguntas_exemplo` (separadas por ";") vira um documento
+ligado à `intencao_chave` do item. Quando a mensagem do paciente cobre bem uma dessas
+perguntas e a melhor intenção se destaca das demais, a intenção é retornada direto,
+sem a chamada de classificação à Gemini.
+
+O índice fica na memória do processo, um por conta, junto com a versão do FAQ da conta
+no momento em que foi montado. Os sinais de ItemFAQ incrementam essa versão no cache
+compartilhado (ver versoes_cache) depois que a transação é confirmada. Cada busca lê a
+versão atual e, se ela for diferente da do índice, o índice da conta é reconstruído do
+banco, em qualquer processo (servidor web, worker da fila).
+"""
+import math
+import re
+from collections import Counter
+from django.db import transaction
+
+from apps.users.models import ItemFAQ
+from .roteador_intencoes import normalizar, CUMPRIMENTOS
+from .versoes_cache import ler_versao, incrementar_versao
+
+# Parâmetros usuais do BM25.
+K1 = 1.2
+B = 0.75
+
+# Fração mínima do peso (idf) das palavras da mensagem que precisa aparecer na melhor pergunta.
+COBERTURA_MINIMA = 0.6
+# Quanto a melhor intenção precisa pontuar acima da segunda para ser aceita.
+VANTAGEM_MINIMA = 1.3
+
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'da', 'do', 'das', 'dos', 'em', 'no', 'na',
+    'nos', 'nas', 'e', 'ou', 'para', 'por', 'com', 'que', 'se', 'eu', 'me', 'meu', 'minha', 'voce',
+    'voces', 'ele', 'ela', 'isso', 'esse', 'essa', 'este', 'esta', 'ao', 'aos', 'ja', 'mais', 'muito',
+    'gostaria', 'queria', 'saber', 'favor', 'obrigado', 'obrigada', 'ai', 'la', 'aqui', 'tem', 'ter',
+    'sobre', 'algum', 'alguma', 'so', 'entao', 'pode', 'poderia',
+}
+
+_indices = {}
+
+
+def _chave_versao(conta_id):
+    return f"indice_faq_versao_{conta_id}"
+
+
+def tokenizar(texto):
+    """ Palavras normalizadas, sem stopwords, com o plural simples reduzido ao singular. """
+    texto = re.sub(r'\[[^\]]*\]', ' ', texto or '')  # Remove marcadores como "[Nome do Convênio]"
+    texto = CUMPRIMENTOS.sub(' ', normalizar(texto))
+    tokens = []
+    for palavra in texto.split():
+        if palavra in STOPWORDS or len(palavra) < 2:
+            continue
+        if len(palavra) > 4 and palavra.endswith('s'):
+            palavra = palavra[:-1]
+        tokens.append(palavra)
+    return tokens
+
+
+def perguntas_do_item(item):
+    return [pergunta.strip() for pergunta in re.split(r'[;\n]', item.perguntas_exemplo or '') if pergunta.strip()]
+
+
+class IndiceFAQ:
+    """ Índice invertido de uma conta. """
+
+    def __init__(self, versao=None):
+        self.versao = versao
+        self.documentos = []  # (intencao_chave, Counter de termos, tamanho)
+        self.frequencia_documentos = Counter()
+        self.total_documentos = 0
+        self.soma_tamanhos = 0
+
+    def adicionar_item(self, item):
+        for pergunta in perguntas_do_item(item):
+            termos = Counter(tokenizar(pergunta))
+            if not termos:
+                continue
+            tamanho = sum(termos.values())
+            self.documentos.append((item.intencao_chave, termos, tamanho))
+            self.frequencia_documentos.update(termos.keys())
+            self.total_documentos += 1
+            self.soma_tamanhos += tamanho
+
+    def idf(self, termo):
+        df = self.frequencia_documentos.get(termo, 0)
+        return math.log((self.total_documentos - df + 0.5) / (df + 0.5) + 1)
+
+    def buscar(self, mensagem):
+        """
+        Retorna (intencao_chave, pontuacao) quando a mensagem corresponde com segurança
+        a uma intenção do FAQ, ou (None, 0.0).
+        """
+        consulta = set(tokenizar(mensagem))
+        if not consulta or not self.total_documentos:
+            return None, 0.0
+
+        tamanho_medio = self.soma_tamanhos / self.total_documentos
+        pesos = {termo: self.idf(termo) for termo in consulta}
+        peso_total = sum(pesos.values())
+        melhores = {}  # intencao -> (pontuacao, cobertura) da melhor pergunta da intenção
+        for intencao, termos, tamanho in self.documentos:
+            comuns = consulta.intersection(termos)
+            if not comuns:
+                continue
+            pontuacao = sum(
+                pesos[termo] * termos[termo] * (K1 + 1)
+                / (termos[termo] + K1 * (1 - B + B * tamanho / tamanho_medio))
+                for termo in comuns
+            )
+            if pontuacao > melhores.get(intencao, (0.0, 0.0))[0]:
+                melhores[intencao] = (pontuacao, sum(pesos[termo] for termo in comuns) / peso_total)
+
+        if not melhores:
+            return None, 0.0
+        ranking = sorted(melhores.items(), key=lambda par: par[1][0], reverse=True)
+        intencao, (pontuacao, cobertura) = ranking[0]
+        segunda = ranking[1][1][0] if len(ranking) > 1 else 0.0
+        if cobertura < COBERTURA_MINIMA or pontuacao < VANTAGEM_MINIMA * segunda:
+            return None, 0.0
+        return intencao, pontuacao
+
+
+async def obter_indice_faq(conta_id):
+    """ Índice da conta, reconstruído quando a versão no cache mudou desde a última construção. """
+    versao = await ler_versao(_chave_versao(conta_id))
+    indice = _indices.get(conta_id)
+    if indice is None or indice.versao != versao:
+        indice = IndiceFAQ(versao)
+        async for item in ItemFAQ.objects.filter(conta_id=conta_id).only('id', 'intencao_chave', 'perguntas_exemplo'):
+            indice.adicionar_item(item)
+        _indices[conta_id] = indice
+    return indice
+
+
+async def identificar_intencao_faq(mensagem, conta_id):
+    intencao, _ = (await obter_indice_faq(conta_id)).buscar(mensagem)
+    return intencao
+
+
+def invalidar_indice_faq(conta_id):
+    """ Chamado pelos sinais de ItemFAQ. A versão só muda depois que a transação for confirmada. """
+    transaction.on_commit(lambda: incrementar_versao(_chave_versao(conta_id)))
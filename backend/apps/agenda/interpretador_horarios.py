@@ -0,0 +1,210 @@
+"""
+Interpretação local das preferências de horário escritas pelo paciente.
+
+Converte expressões como "sexta às 10h", "quarta à tarde", "amanhã de manhã",
+"dia 15", "15/10" ou "às dez e meia" nas preferências usadas pela busca de horários
+({'dia_semana', 'periodo', 'hora', 'data'}), sem chamar a Gemini.
+
+O texto é normalizado como no roteador de intenções (sem acentos e sem pontuação).
+Quando a mensagem traz expressões contraditórias (dois dias diferentes, duas horas)
+ou qualquer palavra além da preferência e de palavras neutras, a interpretação é
+recusada e a mensagem segue para a Gemini.
+"""
+import re
+from datetime import date, timedelta
+from typing import Optional, TypedDict
+from django.utils import timezone
+
+from .roteador_intencoes import normalizar, CUMPRIMENTOS
+
+DIAS_SEMANA = {
+    'segunda': 0, 'terca': 1, 'quarta': 2, 'quinta': 3, 'sexta': 4, 'sabado': 5, 'domingo': 6,
+    'seg': 0, 'qua': 2, 'qui': 3, 'sex': 4, 'sab': 5, 'dom': 6,
+}
+MESES = {
+    'janeiro': 1, 'fevereiro': 2, 'marco': 3, 'abril': 4, 'maio': 5, 'junho': 6, 'julho': 7,
+    'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12,
+}
+NUMEROS = {
+    'uma': 1, 'um': 1, 'duas': 2, 'dois': 2, 'tres': 3, 'quatro': 4, 'cinco': 5, 'seis': 6, 'sete': 7,
+    'oito': 8, 'nove': 9, 'dez': 10, 'onze': 11, 'doze': 12, 'treze': 13, 'catorze': 14, 'quatorze': 14,
+    'quinze': 15, 'dezesseis': 16, 'dezessete': 17, 'dezoito': 18, 'dezenove': 19, 'vinte': 20,
+}
+MINUTOS_POR_EXTENSO = {'meia': 30, 'quinze': 15, 'trinta': 30, 'quarenta e cinco': 45, 'dez': 10, 'vinte': 20}
+
+# Horas de 1 a 6 sem período ("às 3") são entendidas como da tarde: a clínica não atende de madrugada.
+ULTIMA_HORA_AMBIGUA = 6
+
+_NUMERO = r'(\d{1,2}|' + '|'.join(sorted(NUMEROS, key=len, reverse=True)) + r')'
+_MINUTOS_EXTENSO = '|'.join(sorted(MINUTOS_POR_EXTENSO, key=len, reverse=True))
+
+PADRAO_DATA_NUMERICA = re.compile(r'\b(\d{1,2})/(\d{1,2})(?:/(\d{2}|\d{4}))?\b')
+PADRAO_DATA_EXTENSO = re.compile(r'\b(?:dia )?(\d{1,2}) de (' + '|'.join(MESES) + r')\b')
+PADRAO_DIA_DO_MES = re.compile(r'\bdia (\d{1,2})\b')
+PADRAO_RELATIVO = re.compile(r'\b(depois de amanha|amanha|hoje)\b')
+PADRAO_DIA_SEMANA = re.compile(
+    r'\b(segunda|terca|quarta|quinta|sexta|sabado|domingo|seg|qua|qui|sex|sab|dom)(?: feira)?\b'
+    r'(?! (?:opcao|vez|via|horario))'  # "a segunda opção" é escolha de horário, não dia da semana
+)
+PADRAO_MEIO_DIA = re.compile(r'\bmeio dia( e meia)?\b')
+PADRAO_HORA = re.compile(
+    r'\b(?:(?P<hh>\d{1,2}):(?P<mm>\d{2})'
+    r'|(?P<h>\d{1,2}) ?h(?P<hm>\d{2})?'
+    r'|(?P<horas>\d{1,2}) ?(?:hs|horas?)'
+    r'|(?P<solto>\d{1,2})(?= (?:da|de) (?:manha|tarde|noite))'
+    r'|(?:as|a|umas|por volta das|la pelas|pelas) (?P<extenso>' + _NUMERO[1:-1] + r')'
+    r'(?::(?P<emm>\d{2})|h(?P<ehm>\d{2})?|hs| (?:horas?|hs|h))?'
+    r'(?: e (?P<minutos>' + _MINUTOS_EXTENSO + r'))?)\b'
+    r'(?: (?:da|de) (?P<periodo>manha|tarde|noite))?'
+)
+PADRAO_PERIODO = re.compile(
+    r'\b(manha|manhazinha|cedo|tarde|tardinha|fim da tarde|final da tarde|depois do almoco|noite|noitinha)\b'
+)
+PERIODOS_POR_EXPRESSAO = {
+    'manha': 'manha', 'manhazinha': 'manha', 'cedo': 'manha',
+    'tarde': 'tarde', 'tardinha': 'tarde', 'fim da tarde': 'tarde', 'final da tarde': 'tarde', 'depois do almoco': 'tarde',
+    'noite': 'noite', 'noitinha': 'noite',
+}
+
+# Palavras que podem acompanhar uma preferência sem mudar o sentido ("pode ser na quarta à tarde").
+PALAVRAS_NEUTRAS = set(
+    'a o as os um uma na no nas nos de da do em e para por pode ser seria sim ok entao quero queria gostaria prefiro '
+    'preferencia melhor se possivel tem teria algum alguma horario horarios vaga vagas consulta sessao marcar '
+    'agendar agendamento remarcar reagendar que tal ai mais ou menos umas tipo la pelas volta proxima proximo '
+    'semana vem essa esse nessa nesse dessa desse qualquer hora obrigado obrigada favor mesmo'.split()
+)
+
+
+class PreferenciaHorario(TypedDict):
+    """ Preferências usadas pela busca de horários (ver disponibilidade.gerar_horarios); None é "qualquer". """
+    dia_semana: Optional[int]
+    periodo: Optional[str]
+    hora: Optional[str]
+    data: Optional[str]
+
+
+def _proxima_data_do_dia(dia, hoje):
+    """ Próxima data (a partir de hoje) com o dia do mês informado. """
+    ano, mes = hoje.year, hoje.month
+    for _ in range(13):
+        try:
+            candidata = date(ano, mes, dia)
+        except ValueError:
+            candidata = None
+        if candidata and candidata >= hoje:
+            return candidata
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return None
+
+
+def _data_com_ano(dia, mes, ano, hoje):
+    if ano is None:
+        ano = hoje.year
+        try:
+            if date(ano, mes, dia) < hoje:
+                ano += 1
+        except ValueError:
+            return None
+    elif ano < 100:
+        ano += 2000
+    try:
+        return date(ano, mes, dia)
+    except ValueError:
+        return None
+
+
+def _hora(match):
+    """ Converte um match de PADRAO_HORA em (hora, minuto), aplicando o período quando informado. """
+    grupos = match.groupdict()
+    periodo = grupos['periodo']
+    if grupos['hh']:
+        hora, minuto = int(grupos['hh']), int(grupos['mm'])
+    elif grupos['h']:
+        hora, minuto = int(grupos['h']), int(grupos['hm'] or 0)
+    elif grupos['horas'] or grupos['solto']:
+        hora, minuto = int(grupos['horas'] or grupos['solto']), 0
+    else:
+        extenso = grupos['extenso']
+        hora = int(extenso) if extenso.isdigit() else NUMEROS[extenso]
+        minuto = int(grupos['emm'] or grupos['ehm'] or 0)
+        if grupos['minutos']:
+            minuto = MINUTOS_POR_EXTENSO[grupos['minutos']]
+
+    if periodo in ('tarde', 'noite') and hora < 12:
+        hora += 12
+    elif periodo is None and 1 <= hora <= ULTIMA_HORA_AMBIGUA:
+        hora += 12
+    if not (0 <= hora <= 23 and 0 <= minuto <= 59):
+        return None
+    return hora, minuto
+
+
+def interpretar_preferencias(mensagem, hoje=None, estrito=True) -> Optional[PreferenciaHorario]:
+    """
+    Retorna a PreferenciaHorario com 'dia_semana', 'periodo', 'hora' ("HH:MM") e 'data' ("AAAA-MM-DD"),
+    com None nas chaves não mencionadas.
+
+    Retorna None quando a mensagem não tem expressão de tempo reconhecível, tem expressões
+    contraditórias ou traz outros assuntos além da preferência e de palavras neutras
+    ("na quarta, meu filho tem aula de manhã" fica com a Gemini).
+
+    Com `estrito=False` as outras palavras são ignoradas: o resultado é um palpite, usado só
+    para adiantar a busca de horários enquanto a Gemini analisa a mensagem.
+    """
+    hoje = hoje or timezone.localdate()
+    texto = CUMPRIMENTOS.sub(' ', normalizar(mensagem))
+    texto = ' '.join(texto.split())
+    datas, dias_semana, periodos, horas = set(), set(), set(), set()
+
+    def consumir(padrao, tratar):
+        nonlocal texto
+        for match in padrao.finditer(texto):
+            tratar(match)
+        texto = padrao.sub(' ', texto)
+
+    def tratar_data_numerica(match):
+        dia, mes, ano = int(match.group(1)), int(match.group(2)), match.group(3)
+        datas.add(_data_com_ano(dia, mes, int(ano) if ano else None, hoje))
+
+    def tratar_data_extenso(match):
+        datas.add(_data_com_ano(int(match.group(1)), MESES[match.group(2)], None, hoje))
+
+    def tratar_relativo(match):
+        deslocamento = {'hoje': 0, 'amanha': 1, 'depois de amanha': 2}[match.group(1)]
+        datas.add(hoje + timedelta(days=deslocamento))
+
+    def tratar_hora(match):
+        horas.add(_hora(match))
+        if match.group('periodo'):
+            periodos.add(match.group('periodo'))
+
+    def tratar_meio_dia(match):
+        horas.add((12, 30 if match.group(1) else 0))
+
+    consumir(PADRAO_DATA_NUMERICA, tratar_data_numerica)
+    consumir(PADRAO_DATA_EXTENSO, tratar_data_extenso)
+    consumir(PADRAO_DIA_DO_MES, lambda match: datas.add(_proxima_data_do_dia(int(match.group(1)), hoje)))
+    consumir(PADRAO_RELATIVO, tratar_relativo)
+    consumir(PADRAO_DIA_SEMANA, lambda match: dias_semana.add(DIAS_SEMANA[match.group(1)]))
+    consumir(PADRAO_MEIO_DIA, tratar_meio_dia)
+    consumir(PADRAO_HORA, tratar_hora)
+    consumir(PADRAO_PERIODO, lambda match: periodos.add(PERIODOS_POR_EXPRESSAO[match.group(1)]))
+
+    restante = [palavra for palavra in texto.split() if palavra not in PALAVRAS_NEUTRAS]
+    if (restante and estrito) or not (datas or dias_semana or periodos or horas):
+        return None
+    if None in datas or None in horas or len(datas) > 1 or len(dias_semana) > 1 or len(periodos) > 1 or len(horas) > 1:
+        return None
+
+    data = next(iter(datas), None)
+    dia_semana = next(iter(dias_semana), None)
+    if data and dia_semana is not None and data.weekday() != dia_semana:
+        return None  # "sexta, dia 15" quando o dia 15 não é sexta
+    hora = next(iter(horas), None)
+
+    return PreferenciaHorario(
+        dia_semana=data.weekday() if data else dia_semana,
+        periodo=next(iter(periodos), None) if hora is None else None,
+        hora=f"{hora[0]:02d}:{hora[1]:02d}" if hora else None,
+        data=data.isoformat() if data else None,
+    )
@@ -0,0 +1,214 @@
+"""
+Lista de espera de pacientes.
+
+Quando agendamentos são cancelados (um pela tela ou pelo WhatsApp, ou vários no
+cancelamento em lote), os horários liberados são comparados de uma vez com as inscrições
+ativas por profissional, dia da semana e período, e os primeiros pacientes da fila
+recebem a proposta. Cada paciente recebe no máximo um horário, e quem já tem uma
+proposta em aberto fica de fora.
+
+Nas inscrições, "qualquer profissional/dia/período" continua gravado como NULL. Para a
+busca usar o índice parcial de ListaEspera (conta, profissional, dia_semana, periodo,
+só das inscrições ativas), o filtro é montado como uma lista de combinações exatas
+(valor do horário ou NULL em cada campo), e não como "campo = valor OU campo IS NULL"
+campo a campo, que obriga o banco a ler toda a lista ativa da conta.
+
+A proposta fica gravada na própria inscrição (e não no cache do processo que cancelou),
+para que o worker da fila a reconheça quando o paciente responder. A mensagem vai pela
+fila do WhatsApp, sem esperar a Twilio dentro da requisição.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import ListaEspera
+from .disponibilidade import PERIODOS
+from .formatacao_datas import data_e_hora_por_extenso
+from .recorrencia import detectar_conflitos
+from .reservas import TEMPO_RESERVA_TEMPORARIA
+from .whatsapp import responder_paciente_via_whatsapp
+
+# Quantos pacientes da fila recebem a proposta de um mesmo horário liberado.
+QUANTIDADE_AVISADOS = 3
+
+
+def periodo_do_horario(hora):
+    """ Nome do período ('manha', 'tarde', 'noite') que contém a hora, ou None. """
+    for nome, (inicio, fim) in PERIODOS.items():
+        if inicio <= hora < fim:
+            return nome
+    return None
+
+
+def inscrever_na_lista_espera(paciente, preferencias=None, profissional=None):
+    """
+    Inscreve o paciente na lista de espera com as preferências extraídas da conversa.
+    Se ele já aguarda com as mesmas preferências, a inscrição existente é mantida.
+    """
+    preferencias = preferencias or {}
+    periodo = preferencias.get('periodo') if preferencias.get('periodo') in PERIODOS else None
+    if not periodo and preferencias.get('hora'):
+        try:
+            periodo = periodo_do_horario(datetime.strptime(preferencias['hora'], '%H:%M').time())
+        except ValueError:
+            pass
+    dia_semana = preferencias.get('dia_semana') if preferencias.get('dia_semana') in range(7) else None
+
+    campos = dict(conta=paciente.conta, paciente=paciente, profissional=profissional, dia_semana=dia_semana, periodo=periodo)
+    inscricao = ListaEspera.objects.filter(ativo=True, **campos).first()
+    if not inscricao:
+        inscricao = ListaEspera.objects.create(**campos)
+    return inscricao
+
+
+def _filtro_inscricoes(conta_id, profissional_id, dia_semana, periodo):
+    """
+    Inscrições ativas que aceitam o horário, como uma combinação exata por campo. `ativo` vai em
+    cada combinação para que o banco reconheça o índice parcial em cada uma das buscas.
+    """
+    combinacoes = {
+        (profissional, dia, periodo_inscricao)
+        for profissional in (profissional_id, None)
+        for dia in (dia_semana, None)
+        for periodo_inscricao in (periodo, None)
+    }
+    filtro = Q()
+    for profissional, dia, periodo_inscricao in combinacoes:
+        filtro |= Q(conta_id=conta_id, profissional_id=profissional, dia_semana=dia, periodo=periodo_inscricao, ativo=True)
+    return filtro
+
+
+def _aceita(inscricao, conta_id, profissional_id, dia_semana, periodo):
+    return (
+        inscricao.conta_id == conta_id
+        and inscricao.profissional_id in (profissional_id, None)
+        and inscricao.dia_semana in (dia_semana, None)
+        and inscricao.periodo in (periodo, None)
+    )
+
+
+def inscricoes_para_horarios_liberados(agendamentos, quantidade=QUANTIDADE_AVISADOS):
+    """
+    Distribui os horários dos agendamentos cancelados entre as inscrições ativas compatíveis,
+    com uma única consulta à lista de espera. Cada horário vai para até `quantidade` pacientes,
+    por ordem de inscrição, e cada paciente recebe um horário só.
+    Horários que já passaram ou voltaram a ser ocupados ficam de fora.
+
+    Grava a proposta nas inscrições escolhidas e retorna [(agendamento, [inscricoes])].
+    Os agendamentos devem vir com o `profissional` carregado.
+    """
+    agora = timezone.now()
+    por_profissional = defaultdict(list)
+    for agendamento in agendamentos:
+        if agendamento.data_hora_inicio > agora:
+            por_profissional[agendamento.profissional_id].append(agendamento)
+    liberados = []
+    for profissional_id, cancelados in por_profissional.items():
+        ocupados = {inicio for inicio, _ in detectar_conflitos(
+            profissional_id, [(agendamento.data_hora_inicio, agendamento.data_hora_fim) for agendamento in cancelados]
+        )}
+        liberados += [agendamento for agendamento in cancelados if agendamento.data_hora_inicio not in ocupados]
+    if not liberados:
+        return []
+    liberados.sort(key=lambda agendamento: agendamento.data_hora_inicio)
+
+    criterios = {}
+    for agendamento in liberados:
+        inicio_local = timezone.localtime(agendamento.data_hora_inicio)
+        criterios[agendamento.pk] = (
+            agendamento.profissional.conta_id, agendamento.profissional_id,
+            inicio_local.weekday(), periodo_do_horario(inicio_local.time()),
+        )
+    filtro = Q()
+    for criterio in set(criterios.values()):
+        filtro |= _filtro_inscricoes(*criterio)
+
+    com_proposta_em_aberto = ListaEspera.objects.filter(paciente_id=OuterRef('paciente_id'), oferta_expira_em__gt=agora)
+    inscricoes = ListaEspera.objects.filter(filtro).exclude(
+        paciente__contato_telefone__isnull=True
+    ).exclude(paciente__contato_telefone='').exclude(
+        Exists(com_proposta_em_aberto)
+    ).select_related('paciente', 'conta').order_by('criado_em')
+    # Folga para inscrições repetidas do mesmo paciente e para as que só servem a outro horário.
+    inscricoes = list(inscricoes[:quantidade * len(liberados) * 3])
+
+    # Em rodadas: cada horário recebe um paciente antes que algum receba o segundo.
+    escolhidas = {agendamento.pk: [] for agendamento in liberados}
+    avisados = set()
+    expira_em = agora + timedelta(seconds=TEMPO_RESERVA_TEMPORARIA)
+    for _ in range(quantidade):
+        for agendamento in liberados:
+            inscricao = next((
+                inscricao for inscricao in inscricoes
+                if inscricao.paciente_id not in avisados and inscricao.paciente_id != agendamento.paciente_id
+                and _aceita(inscricao, *criterios[agendamento.pk])
+            ), None)
+            if inscricao is None:
+                continue
+            inscricao.notificado_em = agora
+            inscricao.oferta_inicio = agendamento.data_hora_inicio
+            inscricao.oferta_fim = agendamento.data_hora_fim
+            inscricao.oferta_profissional_id = agendamento.profissional_id
+            inscricao.oferta_expira_em = expira_em
+            escolhidas[agendamento.pk].append(inscricao)
+            avisados.add(inscricao.paciente_id)
+    distribuicao = [(agendamento, escolhidas[agendamento.pk]) for agendamento in liberados if escolhidas[agendamento.pk]]
+
+    ListaEspera.objects.bulk_update(
+        [inscricao for _, do_horario in distribuicao for inscricao in do_horario],
+        ['notificado_em', 'oferta_inicio', 'oferta_fim', 'oferta_profissional', 'oferta_expira_em'],
+    )
+    return distribuicao
+
+
+def avisar_lista_espera(*agendamentos):
+    """
+    Propõe os horários dos agendamentos cancelados aos primeiros pacientes da lista de espera.
+    O horário fica como oferta na inscrição de cada um; quem responder primeiro fica com ele.
+    """
+    # Importado aqui: fila_whatsapp depende do atendimento, que usa este módulo.
+    from .fila_whatsapp import enfileirar_envios
+
+    envios = []
+    for agendamento, inscricoes in inscricoes_para_horarios_liberados(agendamentos):
+        data_local_formatada = data_e_hora_por_extenso(agendamento.data_hora_inicio)
+        for inscricao in inscricoes:
+            paciente = inscricao.paciente
+            print(f"--> Lista de espera: propondo {data_local_formatada} para {paciente.nome_completo}")
+            nome = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else ""
+            mensagem = (
+                f"Olá{', ' + nome if nome else ''}! Vagou um horário que combina com o que você procurava: {data_local_formatada}. "
+                "Se quiser, é só responder confirmando que eu reservo para você."
+            )
+            envios.append((paciente.contato_telefone, inscricao.conta.whatsapp_number, mensagem))
+
+    if settings.WHATSAPP_USAR_FILA:
+        enfileirar_envios(envios)
+    else:
+        for telefone, _, mensagem in envios:
+            responder_paciente_via_whatsapp(telefone, mensagem)
+
+
+def ofertas_lista_espera(paciente):
+    """
+    Horários da lista de espera propostos ao paciente e ainda válidos, no formato dos
+    horários oferecidos pelo atendimento ({'inicio', 'fim', 'profissional_id'}).
+    """
+    ofertas = ListaEspera.objects.filter(
+        paciente=paciente, ativo=True, oferta_expira_em__gt=timezone.now()
+    ).order_by('oferta_inicio').values_list('oferta_inicio', 'oferta_fim', 'oferta_profissional_id')
+    horarios = []
+    for inicio, fim, profissional_id in ofertas:
+        horario = {'inicio': inicio, 'fim': fim, 'profissional_id': profissional_id}
+        if profissional_id and horario not in horarios:
+            horarios.append(horario)
+    return horarios
+
+
+def descartar_ofertas_lista_espera(paciente):
+    """ Retira as propostas pendentes do paciente, quando outros horários passam a ser oferecidos a ele. """
+    ListaEspera.objects.filter(paciente=paciente, oferta_expira_em__isnull=False).update(
+        oferta_inicio=None, oferta_fim=None, oferta_profissional=None, oferta_expira_em=None
+    )
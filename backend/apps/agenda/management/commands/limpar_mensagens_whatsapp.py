@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.agenda.mensagens_recebidas import limpar_mensagens_recebidas
+from apps.agenda.historico_conversa import limpar_conversas_antigas
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove os registros antigos do WhatsApp: os MessageSid usados para ignorar repetições da Twilio '
+        'e as mensagens do histórico de conversa fora da retenção.'
+    )
+
+    def handle(self, *args, **options):
+        total = limpar_mensagens_recebidas()
+        self.stdout.write(self.style.SUCCESS(f'{total} registro(s) de mensagens recebidas fora da retenção removido(s).'))
+        total = limpar_conversas_antigas()
+        self.stdout.write(self.style.SUCCESS(f'{total} mensagem(ns) de conversa fora da retenção removida(s).'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.agenda.models import ReservaTemporaria
+
+
+class Command(BaseCommand):
+    help = 'Remove de uma só vez as reservas temporárias de horários que já expiraram.'
+
+    def handle(self, *args, **options):
+        # Reservas vencidas já são ignoradas pela busca de horários, então não é preciso invalidar o cache.
+        total, _ = ReservaTemporaria.objects.filter(expira_em__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f'{total} reserva(s) temporária(s) expirada(s) removida(s).'))
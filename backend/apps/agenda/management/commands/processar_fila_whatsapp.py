@@ -0,0 +1,111 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connections
+from apps.agenda.fila_whatsapp import (
+    reivindicar_tarefa, processar_tarefa, recuperar_tarefas_travadas, existem_tarefas_pendentes
+)
+from apps.agenda.roteador_intencoes import estatisticas_roteador
+from apps.agenda.mensagens_recebidas import limpar_mensagens_recebidas
+from apps.agenda.escalonador_whatsapp import EscalonadorContas, profundidade_por_conta
+from apps.agenda.whatsapp import fechar_cliente_twilio_async
+
+# De quanto em quanto tempo (segundos) o worker procura tarefas travadas de outros workers.
+INTERVALO_RECUPERACAO = 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Processa as mensagens do WhatsApp enfileiradas pelo webhook, em paralelo entre pacientes e em ordem '
+        'para cada telefone. O atendimento é assíncrono: um único processo mantém várias conversas em andamento. '
+        'As contas se revezam pelo peso do plano, cada uma limitada a alguns atendimentos simultâneos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concorrencia', type=int, default=50, help='Quantas mensagens ficam em atendimento ao mesmo tempo.')
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Segundos de espera quando a fila está vazia.')
+        parser.add_argument('--uma-vez', action='store_true', help='Processa o que houver na fila e encerra.')
+
+    def _recuperar(self):
+        devolvidas, abandonadas = recuperar_tarefas_travadas()
+        if devolvidas or abandonadas:
+            self.stdout.write(self.style.WARNING(
+                f'{devolvidas} tarefa(s) travada(s) devolvida(s) para a fila, {abandonadas} marcada(s) com erro.'
+            ))
+        # Aproveita a passagem periódica para descartar os MessageSid fora da retenção.
+        limpar_mensagens_recebidas()
+
+    def _relatar_roteador(self):
+        estatisticas = estatisticas_roteador()
+        if estatisticas['total']:
+            self.stdout.write(
+                f"Intenções: {estatisticas['local']} de {estatisticas['total']} classificadas sem a Gemini "
+                f"({estatisticas['taxa_local']:.0%}) {estatisticas['por_intencao']}"
+            )
+
+    def _relatar_fila(self):
+        profundidade = profundidade_por_conta()
+        if profundidade:
+            self.stdout.write("Fila por conta: " + ", ".join(
+                f"{destinatario} ({dados['pendentes']} pendente(s), {dados['processando']} em atendimento)"
+                for destinatario, dados in sorted(profundidade.items(), key=lambda item: -item[1]['pendentes'])
+            ))
+
+    async def _atender(self, tarefa, vagas):
+        try:
+            await processar_tarefa(tarefa)
+        finally:
+            vagas.release()
+
+    async def _executar(self, concorrencia, intervalo, uma_vez):
+        """
+        Reivindica tarefas enquanto houver vagas e atende cada uma numa task própria.
+        Com a fila vazia, só este laço consulta o banco (uma vez por intervalo).
+        """
+        loop = asyncio.get_running_loop()
+        vagas = asyncio.Semaphore(concorrencia)
+        escalonador = EscalonadorContas()
+        em_andamento = set()
+        processadas = 0
+        ultima_recuperacao = loop.time()
+        await sync_to_async(self._recuperar)()
+
+        while True:
+            await vagas.acquire()
+            tarefa = await sync_to_async(reivindicar_tarefa)(escalonador)
+            if tarefa:
+                atendimento = asyncio.create_task(self._atender(tarefa, vagas))
+                em_andamento.add(atendimento)
+                atendimento.add_done_callback(em_andamento.discard)
+                processadas += 1
+                continue
+            vagas.release()
+
+            if uma_vez and not em_andamento and not await sync_to_async(existem_tarefas_pendentes)():
+                break
+            # Tarefas pendentes podem estar esperando outra mensagem do mesmo telefone ou vaga na conta.
+            if em_andamento:
+                await asyncio.wait(em_andamento, timeout=intervalo, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(intervalo)
+
+            if loop.time() - ultima_recuperacao >= INTERVALO_RECUPERACAO:
+                await sync_to_async(self._recuperar)()
+                await sync_to_async(self._relatar_fila)()
+                self._relatar_roteador()
+                ultima_recuperacao = loop.time()
+
+        await fechar_cliente_twilio_async()
+        await sync_to_async(connections.close_all)()
+        return processadas
+
+    def handle(self, *args, **options):
+        concorrencia = max(options['concorrencia'], 1)
+        self.stdout.write(f'Processando a fila do WhatsApp com até {concorrencia} mensagem(ns) em paralelo...')
+        try:
+            processadas = asyncio.run(self._executar(concorrencia, options['intervalo'], options['uma_vez']))
+        except KeyboardInterrupt:
+            self.stdout.write('Worker encerrado.')
+            return
+        self.stdout.write(self.style.SUCCESS(f'{processadas} mensagem(ns) processada(s).'))
+        self._relatar_roteador()
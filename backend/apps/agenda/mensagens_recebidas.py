@@ -0,0 +1,49 @@
+"""
+Registro dos MessageSid recebidos pelo webhook do WhatsApp, para que as repetições da
+Twilio não sejam atendidas duas vezes (nova classificação, agendamento duplicado e
+resposta repetida).
+
+O primeiro webhook de cada MessageSid cria o registro (índice único) e guarda a resposta
+dada; as repetições só leem esse registro. Se o atendimento terminou em erro, o registro é
+apagado para que a repetição da Twilio tente de novo.
+"""
+from datetime import timedelta
+from django.utils import timezone
+
+from .models import MensagemRecebidaWhatsApp
+
+# A Twilio repete o webhook por alguns minutos; um dia cobre qualquer repetição com folga.
+RETENCAO_MENSAGENS_RECEBIDAS = timedelta(days=1)
+
+
+async def registrar_mensagem_recebida(message_sid):
+    """
+    Retorna (registro, nova): `nova` é False quando o MessageSid já foi recebido antes.
+    get_or_create cria o registro num savepoint, então a corrida entre duas repetições
+    simultâneas (violação do índice único) não quebra uma transação em andamento.
+    """
+    return await MensagemRecebidaWhatsApp.objects.aget_or_create(message_sid=message_sid)
+
+
+async def concluir_mensagem_recebida(registro, status, tarefa=None):
+    if status == 'erro_geral':
+        await registro.adelete()
+        return
+    registro.status = status
+    registro.tarefa = tarefa
+    await registro.asave(update_fields=['status', 'tarefa'])
+
+
+def resposta_original(registro):
+    """ Corpo da resposta dada ao primeiro webhook do MessageSid. """
+    resposta = {"status": registro.status, "duplicada": True}
+    if registro.tarefa_id:
+        resposta["tarefa"] = registro.tarefa_id
+    return resposta
+
+
+def limpar_mensagens_recebidas():
+    """ Apaga os registros mais antigos que a retenção. Retorna quantos foram apagados. """
+    limite = timezone.now() - RETENCAO_MENSAGENS_RECEBIDAS
+    apagados, _ = MensagemRecebidaWhatsApp.objects.filter(criado_em__lt=limite).delete()
+    return apagados
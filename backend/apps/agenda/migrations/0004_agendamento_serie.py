@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 06:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0003_feedbacknps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agendamento',
+            name='serie',
+            field=models.UUIDField(blank=True, db_index=True, help_text='Identifica os agendamentos criados juntos em uma série recorrente.', null=True),
+        ),
+    ]
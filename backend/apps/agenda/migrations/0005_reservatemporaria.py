@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 06:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0004_agendamento_serie'),
+        ('users', '0008_profissional_token_calendario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaTemporaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_hora_inicio', models.DateTimeField()),
+                ('data_hora_fim', models.DateTimeField()),
+                ('expira_em', models.DateTimeField(db_index=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_temporarias', to='users.paciente')),
+                ('profissional', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_temporarias', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Reserva Temporária',
+                'verbose_name_plural': 'Reservas Temporárias',
+                'indexes': [models.Index(fields=['profissional', 'data_hora_inicio'], name='agenda_rese_profiss_fe97b7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.7 on 2026-10-18 06:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0005_reservatemporaria'),
+        ('users', '0008_profissional_token_calendario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.IntegerField(blank=True, choices=[(0, 'Segunda-feira'), (1, 'Terça-feira'), (2, 'Quarta-feira'), (3, 'Quinta-feira'), (4, 'Sexta-feira'), (5, 'Sábado'), (6, 'Domingo')], null=True)),
+                ('periodo', models.CharField(blank=True, choices=[('manha', 'Manhã'), ('tarde', 'Tarde'), ('noite', 'Noite')], max_length=10, null=True)),
+                ('ativo', models.BooleanField(default=True)),
+                ('notificado_em', models.DateTimeField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('conta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='users.conta')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='users.paciente')),
+                ('profissional', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lista de Espera',
+                'verbose_name_plural': 'Lista de Espera',
+                'ordering': ['criado_em'],
+                'indexes': [models.Index(fields=['profissional', 'dia_semana', 'periodo'], name='agenda_list_profiss_a0ba84_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0006_listaespera'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaWhatsApp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telefone', models.CharField(help_text='Número do remetente, apenas dígitos.', max_length=20)),
+                ('destinatario', models.CharField(help_text='Número da conta que recebeu a mensagem.', max_length=20)),
+                ('corpo', models.TextField()),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluida', 'Concluída'), ('erro', 'Erro')], default='pendente', max_length=20)),
+                ('tentativas', models.PositiveIntegerField(default=0)),
+                ('resultado', models.CharField(blank=True, max_length=100, null=True)),
+                ('erro', models.TextField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Tarefa do WhatsApp',
+                'verbose_name_plural': 'Tarefas do WhatsApp',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='agenda_tare_status_6ef6fb_idx'), models.Index(fields=['telefone', 'status'], name='agenda_tare_telefon_f7fd3e_idx')],
+            },
+        ),
+    ]
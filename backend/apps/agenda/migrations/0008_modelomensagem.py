@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0007_tarefawhatsapp'),
+        ('users', '0008_profissional_token_calendario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModeloMensagem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(choices=[('pergunta_onboarding', 'Pedido de CPF e data de nascimento'), ('pergunta_nome_completo', 'Pedido do nome completo'), ('pergunta_preferencia', 'Pergunta de preferência de dia e período'), ('solicitacao_registrada', 'Confirmação de solicitação de documento')], max_length=50)),
+                ('texto', models.TextField(help_text='Variáveis entre chaves, ex: {nome}, {profissional}, {tipo_documento}.')),
+                ('reescrever_com_ia', models.BooleanField(default=False, help_text='Pede à IA uma variação do texto a cada envio.')),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('conta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='modelos_mensagem', to='users.conta')),
+            ],
+            options={
+                'verbose_name': 'Modelo de Mensagem',
+                'verbose_name_plural': 'Modelos de Mensagem',
+                'unique_together': {('conta', 'chave')},
+            },
+        ),
+    ]
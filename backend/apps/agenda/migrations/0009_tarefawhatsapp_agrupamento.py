@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0008_modelomensagem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefawhatsapp',
+            name='agrupada_em',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='agrupadas', to='agenda.tarefawhatsapp'),
+        ),
+        migrations.AddField(
+            model_name='tarefawhatsapp',
+            name='processar_apos',
+            field=models.DateTimeField(blank=True, help_text='Fim da janela de espera por outras mensagens do mesmo telefone.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='tarefawhatsapp',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluida', 'Concluída'), ('agrupada', 'Agrupada'), ('erro', 'Erro')], default='pendente', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0009_tarefawhatsapp_agrupamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensagemRecebidaWhatsApp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_sid', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(default='processando', max_length=100)),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('tarefa', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mensagens_recebidas', to='agenda.tarefawhatsapp')),
+            ],
+            options={
+                'verbose_name': 'Mensagem Recebida do WhatsApp',
+                'verbose_name_plural': 'Mensagens Recebidas do WhatsApp',
+            },
+        ),
+    ]
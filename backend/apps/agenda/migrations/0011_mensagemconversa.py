@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0010_mensagemrecebidawhatsapp'),
+        ('users', '0008_profissional_token_calendario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensagemConversa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('autor', models.CharField(choices=[('paciente', 'Paciente'), ('assistente', 'Assistente')], max_length=20)),
+                ('texto', models.TextField()),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens_conversa', to='users.paciente')),
+            ],
+            options={
+                'verbose_name': 'Mensagem da Conversa',
+                'verbose_name_plural': 'Mensagens da Conversa',
+                'ordering': ['criado_em', 'id'],
+                'indexes': [models.Index(fields=['paciente', 'criado_em'], name='agenda_mens_pacient_5f08db_idx'), models.Index(fields=['criado_em'], name='agenda_mens_criado__3c9a24_idx')],
+            },
+        ),
+    ]
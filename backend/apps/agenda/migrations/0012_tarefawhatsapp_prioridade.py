@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0011_mensagemconversa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefawhatsapp',
+            name='prioridade',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Alta'), (1, 'Normal')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='tarefawhatsapp',
+            index=models.Index(fields=['destinatario', 'status'], name='agenda_tare_destina_d7f0e6_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0012_tarefawhatsapp_prioridade'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listaespera',
+            name='oferta_expira_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listaespera',
+            name='oferta_fim',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listaespera',
+            name='oferta_inicio',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listaespera',
+            name='oferta_profissional',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='tarefawhatsapp',
+            name='tipo',
+            field=models.CharField(choices=[('recebida', 'Recebida'), ('envio', 'Envio')], default='recebida', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='tarefawhatsapp',
+            name='destinatario',
+            field=models.CharField(help_text='Número da conta que recebeu (ou envia) a mensagem.', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='tarefawhatsapp',
+            name='telefone',
+            field=models.CharField(help_text='Número do paciente (remetente ou, no envio, destinatário), apenas dígitos.', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0013_listaespera_oferta_tarefawhatsapp_tipo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='excecaohorario',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
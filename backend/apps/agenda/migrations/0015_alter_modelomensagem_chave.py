@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0014_excecaohorario_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='modelomensagem',
+            name='chave',
+            field=models.CharField(choices=[('pergunta_onboarding', 'Pedido de CPF e data de nascimento'), ('pergunta_nome_completo', 'Pedido do nome completo'), ('pergunta_preferencia', 'Pergunta de preferência de dia e período'), ('solicitacao_registrada', 'Confirmação de solicitação de documento'), ('encaminhamento_humano', 'Oferta de encaminhar a um atendente')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0015_alter_modelomensagem_chave'),
+        ('users', '0010_profissional_agenda_atualizada_em'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='listaespera',
+            name='agenda_list_profiss_a0ba84_idx',
+        ),
+        migrations.AddIndex(
+            model_name='listaespera',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['conta', 'profissional', 'dia_semana', 'periodo'], name='lista_espera_ativa_idx'),
+        ),
+    ]
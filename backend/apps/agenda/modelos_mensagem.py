@@ -0,0 +1,85 @@
+"""
+Modelos das mensagens fixas do atendimento pelo WhatsApp.
+
+As perguntas de nome completo, preferência de horário e dados do cadastro, a
+confirmação de solicitação de documento e a oferta de falar com um atendente têm
+sempre o mesmo texto. Elas são montadas a partir de um modelo com variáveis
+({nome}, {profissional}, {tipo_documento}), sem chamar a Gemini.
+
+Cada conta pode trocar o texto padrão por um ModeloMensagem. Os textos personalizados
+vêm no retrato da conta (contexto_conta) e os modelos já analisados ficam guardados na
+memória do processo. Quando o modelo tem `reescrever_com_ia`, o texto montado é
+reescrito pela Gemini antes do envio.
+"""
+from functools import lru_cache
+from string import Formatter
+
+MODELOS_PADRAO = {
+    'pergunta_onboarding': (
+        "Perfeito, {nome}! Seu agendamento está confirmado. Para agilizar seu atendimento no dia, "
+        "você poderia me informar seu CPF e data de nascimento, por favor? (Ex: 123.456.789-10 e 25/12/1990)"
+    ),
+    'pergunta_nome_completo': "Ótimo! Para finalizar o seu agendamento, por favor, me informe o seu nome completo.",
+    'pergunta_preferencia': (
+        "Olá, {nome}! Claro! Para te ajudar a encontrar o melhor horário, você tem alguma preferência "
+        "de dia da semana ou período (manhã ou tarde)?"
+    ),
+    'solicitacao_registrada': (
+        "Registrado! Sua solicitação de {tipo_documento} foi encaminhada para o(a) Dr(a). {profissional}. "
+        "Avisaremos assim que estiver pronto!"
+    ),
+    'encaminhamento_humano': (
+        "Não tenho certeza de como responder a isso. Deseja que eu encaminhe sua mensagem para um de nossos atendentes?"
+    ),
+}
+
+# Variáveis que cada mensagem pode usar.
+VARIAVEIS = {
+    'pergunta_onboarding': {'nome', 'profissional'},
+    'pergunta_nome_completo': {'profissional'},
+    'pergunta_preferencia': {'nome', 'profissional'},
+    'solicitacao_registrada': {'nome', 'profissional', 'tipo_documento'},
+    'encaminhamento_humano': {'profissional'},
+}
+
+
+class ModeloInvalido(ValueError):
+    """ O texto do modelo tem chaves mal formadas ou variáveis desconhecidas. """
+
+
+@lru_cache(maxsize=512)
+def compilar_modelo(texto, chave):
+    """
+    Separa o texto em trechos fixos e variáveis: [(texto_fixo, variavel_ou_None), ...].
+    Levanta ModeloInvalido quando o texto não pode ser montado com as variáveis da mensagem.
+    """
+    partes = []
+    try:
+        for literal, campo, formato, conversao in Formatter().parse(texto):
+            if campo is not None:
+                if campo not in VARIAVEIS[chave]:
+                    permitidas = ", ".join(f"{{{v}}}" for v in sorted(VARIAVEIS[chave]))
+                    raise ModeloInvalido(f"Variável {{{campo}}} não disponível nesta mensagem. Use: {permitidas}.")
+                if formato or conversao:
+                    raise ModeloInvalido(f"A variável {{{campo}}} não aceita formatação.")
+            partes.append((literal, campo))
+    except ValueError as e:
+        if isinstance(e, ModeloInvalido):
+            raise
+        raise ModeloInvalido("Texto com chaves { } mal formadas. Para escrever uma chave, use {{ ou }}.") from e
+    return tuple(partes)
+
+
+def montar_mensagem(texto, chave, **variaveis):
+    return "".join(literal + (str(variaveis.get(campo) or '') if campo else '') for literal, campo in compilar_modelo(texto, chave))
+
+
+def obter_modelo(contexto, chave):
+    """ (texto, reescrever_com_ia) da mensagem: o personalizado pela conta ou o padrão. """
+    texto, reescrever = contexto.get('modelos_mensagem', {}).get(chave, (MODELOS_PADRAO[chave], False))
+    try:
+        compilar_modelo(texto, chave)
+    except ModeloInvalido as e:
+        print(f"AVISO: Modelo '{chave}' da conta inválido ({e}). Usando o texto padrão.")
+        return MODELOS_PADRAO[chave], reescrever
+    return texto, reescrever
@@ -1,4 +1,6 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from apps.users.models import Profissional, Paciente
 from apps.financas.models import Servico
 import uuid
@@ -45,6 +47,7 @@ class Agendamento(models.Model):
     lembrete_enviado = models.BooleanField(default=False)
     token_confirmacao = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     follow_up_enviado = models.BooleanField(default=False)
+    serie = models.UUIDField(null=True, blank=True, db_index=True, help_text="Identifica os agendamentos criados juntos em uma série recorrente.")
 
     # Timestamps
     criado_em = models.DateTimeField(auto_now_add=True)
@@ -59,6 +62,26 @@ class Agendamento(models.Model):
         # Acessamos o paciente através do self para evitar a importação
         return f"{self.titulo} - {self.paciente.nome_completo} ({self.data_hora_inicio.strftime('%d/%m/%Y %H:%M')})"
 
+class ReservaTemporaria(models.Model):
+    """
+    Segura por alguns minutos um horário oferecido ao paciente pelo WhatsApp,
+    para que o mesmo horário não seja oferecido em outras conversas.
+    """
+    profissional = models.ForeignKey('users.Profissional', on_delete=models.CASCADE, related_name='reservas_temporarias')
+    paciente = models.ForeignKey('users.Paciente', on_delete=models.CASCADE, related_name='reservas_temporarias')
+    data_hora_inicio = models.DateTimeField()
+    data_hora_fim = models.DateTimeField()
+    expira_em = models.DateTimeField(db_index=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Reserva Temporária"
+        verbose_name_plural = "Reservas Temporárias"
+        indexes = [models.Index(fields=['profissional', 'data_hora_inicio'])]
+
+    def __str__(self):
+        return f"Reserva de {self.data_hora_inicio.strftime('%d/%m/%Y %H:%M')} até {self.expira_em.strftime('%H:%M')}"
+
 class HorarioTrabalho(models.Model):
     """
     Define o horário de trabalho padrão do profissional para cada dia da semana.
@@ -97,10 +120,184 @@ class ExcecaoHorario(models.Model):
     hora_inicio = models.TimeField(null=True, blank=True)
     hora_fim = models.TimeField(null=True, blank=True)
     descricao = models.CharField(max_length=255, help_text="Ex: Feriado, Férias, Congresso")
+    atualizado_em = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Exceção em {self.data.strftime('%d/%m/%Y')} - {self.descricao}"
 
+class ListaEspera(models.Model):
+    """
+    Pacientes aguardando um horário. Dia da semana, período e profissional vazios
+    significam "qualquer um". Quando um agendamento é cancelado, os primeiros da fila
+    que combinam com o horário liberado são avisados; o horário proposto fica na inscrição
+    até `oferta_expira_em`, para ser reconhecido na resposta do paciente.
+    """
+    PERIODO_CHOICES = [
+        ('manha', 'Manhã'),
+        ('tarde', 'Tarde'),
+        ('noite', 'Noite'),
+    ]
+    conta = models.ForeignKey('users.Conta', on_delete=models.CASCADE, related_name='lista_espera')
+    paciente = models.ForeignKey('users.Paciente', on_delete=models.CASCADE, related_name='lista_espera')
+    profissional = models.ForeignKey('users.Profissional', on_delete=models.CASCADE, null=True, blank=True, related_name='lista_espera')
+    dia_semana = models.IntegerField(choices=HorarioTrabalho.DIAS_SEMANA, null=True, blank=True)
+    periodo = models.CharField(max_length=10, choices=PERIODO_CHOICES, null=True, blank=True)
+    ativo = models.BooleanField(default=True)
+    notificado_em = models.DateTimeField(null=True, blank=True)
+    oferta_inicio = models.DateTimeField(null=True, blank=True)
+    oferta_fim = models.DateTimeField(null=True, blank=True)
+    oferta_profissional = models.ForeignKey('users.Profissional', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    oferta_expira_em = models.DateTimeField(null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Lista de Espera"
+        verbose_name_plural = "Lista de Espera"
+        ordering = ['criado_em']
+        # "Qualquer" fica como NULL; a busca por horário liberado usa uma combinação exata por
+        # inscrição compatível (ver lista_espera._filtro_inscricoes), resolvida neste índice.
+        indexes = [
+            models.Index(
+                fields=['conta', 'profissional', 'dia_semana', 'periodo'],
+                condition=models.Q(ativo=True), name='lista_espera_ativa_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.paciente.nome_completo} - {self.get_dia_semana_display() or 'Qualquer dia'} / {self.get_periodo_display() or 'Qualquer período'}"
+
+class TarefaWhatsApp(models.Model):
+    """
+    Mensagem recebida pelo webhook do WhatsApp aguardando processamento pelo worker, ou
+    mensagem a enviar ao paciente por iniciativa da clínica (tipo 'envio', ex: proposta da
+    lista de espera). Mensagens do mesmo telefone são processadas uma de cada vez, na ordem de chegada.
+    Mensagens recebidas em sequência são atendidas juntas: as seguintes ficam 'agrupada',
+    apontando para a tarefa que as atendeu.
+    """
+    TIPO_CHOICES = [
+        ('recebida', 'Recebida'),
+        ('envio', 'Envio'),
+    ]
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluida', 'Concluída'),
+        ('agrupada', 'Agrupada'),
+        ('erro', 'Erro'),
+    ]
+    # Respostas a horários oferecidos e pedidos de agendamento passam na frente de dúvidas e saudações.
+    PRIORIDADE_CHOICES = [
+        (0, 'Alta'),
+        (1, 'Normal'),
+    ]
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, default='recebida')
+    telefone = models.CharField(max_length=20, help_text="Número do paciente (remetente ou, no envio, destinatário), apenas dígitos.")
+    destinatario = models.CharField(max_length=20, help_text="Número da conta que recebeu (ou envia) a mensagem.")
+    corpo = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    prioridade = models.PositiveSmallIntegerField(choices=PRIORIDADE_CHOICES, default=1)
+    tentativas = models.PositiveIntegerField(default=0)
+    resultado = models.CharField(max_length=100, blank=True, null=True)
+    erro = models.TextField(blank=True, null=True)
+    agrupada_em = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='agrupadas')
+    criado_em = models.DateTimeField(auto_now_add=True)
+    processar_apos = models.DateTimeField(null=True, blank=True, help_text="Fim da janela de espera por outras mensagens do mesmo telefone.")
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarefa do WhatsApp"
+        verbose_name_plural = "Tarefas do WhatsApp"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['telefone', 'status']),
+            models.Index(fields=['destinatario', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.telefone} ({self.get_status_display()}) - {self.criado_em.strftime('%d/%m/%Y %H:%M:%S')}"
+
+class ModeloMensagem(models.Model):
+    """
+    Texto personalizado pela conta para uma mensagem fixa do atendimento pelo WhatsApp.
+    Sem registro, vale o texto padrão de modelos_mensagem.MODELOS_PADRAO.
+    """
+    CHAVE_CHOICES = [
+        ('pergunta_onboarding', 'Pedido de CPF e data de nascimento'),
+        ('pergunta_nome_completo', 'Pedido do nome completo'),
+        ('pergunta_preferencia', 'Pergunta de preferência de dia e período'),
+        ('solicitacao_registrada', 'Confirmação de solicitação de documento'),
+        ('encaminhamento_humano', 'Oferta de encaminhar a um atendente'),
+    ]
+    conta = models.ForeignKey('users.Conta', on_delete=models.CASCADE, related_name='modelos_mensagem')
+    chave = models.CharField(max_length=50, choices=CHAVE_CHOICES)
+    texto = models.TextField(help_text="Variáveis entre chaves, ex: {nome}, {profissional}, {tipo_documento}.")
+    reescrever_com_ia = models.BooleanField(default=False, help_text="Pede à IA uma variação do texto a cada envio.")
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Modelo de Mensagem"
+        verbose_name_plural = "Modelos de Mensagem"
+        unique_together = ('conta', 'chave')
+
+    def clean(self):
+        from .modelos_mensagem import compilar_modelo, ModeloInvalido
+        try:
+            compilar_modelo(self.texto, self.chave)
+        except ModeloInvalido as e:
+            raise ValidationError({'texto': str(e)})
+
+    def __str__(self):
+        return f"{self.get_chave_display()} ({self.conta})"
+
+class MensagemConversa(models.Model):
+    """
+    Histórico das mensagens trocadas com o paciente pelo WhatsApp, usado como contexto nos prompts.
+    As mensagens de cada atendimento são gravadas juntas no final (ver historico_conversa) e as
+    antigas são apagadas pelo comando limpar_mensagens_whatsapp.
+    """
+    AUTOR_CHOICES = [
+        ('paciente', 'Paciente'),
+        ('assistente', 'Assistente'),
+    ]
+    paciente = models.ForeignKey('users.Paciente', on_delete=models.CASCADE, related_name='mensagens_conversa')
+    autor = models.CharField(max_length=20, choices=AUTOR_CHOICES)
+    texto = models.TextField()
+    # Definido na criação da mensagem, não na gravação em lote, para manter a ordem real da conversa.
+    criado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Mensagem da Conversa"
+        verbose_name_plural = "Mensagens da Conversa"
+        ordering = ['criado_em', 'id']
+        indexes = [
+            models.Index(fields=['paciente', 'criado_em']),
+            models.Index(fields=['criado_em']),  # Limpeza por retenção
+        ]
+
+    def __str__(self):
+        return f"{self.get_autor_display()} ({self.criado_em.strftime('%d/%m/%Y %H:%M')}): {self.texto[:50]}"
+
+class MensagemRecebidaWhatsApp(models.Model):
+    """
+    MessageSid das mensagens já recebidas pelo webhook, com a resposta dada à Twilio.
+    Quando a Twilio repete o webhook (ex: por demora na resposta), a repetição recebe a
+    mesma resposta sem ser processada de novo. Os registros antigos são apagados pelo
+    comando limpar_mensagens_whatsapp.
+    """
+    message_sid = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=100, default='processando')
+    tarefa = models.ForeignKey(TarefaWhatsApp, on_delete=models.SET_NULL, null=True, blank=True, related_name='mensagens_recebidas')
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Mensagem Recebida do WhatsApp"
+        verbose_name_plural = "Mensagens Recebidas do WhatsApp"
+
+    def __str__(self):
+        return f"{self.message_sid} ({self.status})"
+
 class LogMensagemIA(models.Model):
     assinatura = models.ForeignKey('users.Assinatura', on_delete=models.CASCADE, related_name='logs_mensagens')
     data_envio = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,145 @@
+"""
+Criação de séries de agendamentos recorrentes (semanais ou quinzenais).
+
+Todas as ocorrências são validadas contra os agendamentos, o horário de trabalho e as
+exceções de horário do profissional com uma consulta por tabela, e inseridas com um
+único bulk_create.
+"""
+import uuid
+from bisect import bisect_left
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+
+from apps.users.models import Profissional
+from .models import Agendamento, ExcecaoHorario, HorarioTrabalho
+from .disponibilidade import STATUS_QUE_LIBERAM_HORARIO, mesclar_intervalos, invalidar_agenda, dias_do_intervalo
+
+FREQUENCIAS = {
+    'semanal': timedelta(weeks=1),
+    'quinzenal': timedelta(weeks=2),
+}
+
+# Limite de ocorrências por série (dois anos de sessões semanais).
+MAX_OCORRENCIAS = 104
+
+
+def gerar_ocorrencias(inicio, fim, frequencia, data_limite=None, quantidade=None, pular=()):
+    """
+    Retorna a lista de (inicio, fim) da série, mantendo o mesmo horário local em todas as ocorrências.
+    A série termina em `data_limite` (inclusive) ou após `quantidade` ocorrências; datas em `pular` são omitidas.
+    """
+    passo = FREQUENCIAS[frequencia]
+    duracao = fim - inicio
+    inicio_local = timezone.localtime(inicio).replace(tzinfo=None)
+    pular = set(pular)
+    limite = quantidade or MAX_OCORRENCIAS
+
+    ocorrencias = []
+    for n in range(MAX_OCORRENCIAS):
+        ocorrencia_local = inicio_local + passo * n
+        if data_limite and ocorrencia_local.date() > data_limite:
+            break
+        if ocorrencia_local.date() in pular:
+            continue
+        ocorrencia_inicio = timezone.make_aware(ocorrencia_local)
+        ocorrencias.append((ocorrencia_inicio, ocorrencia_inicio + duracao))
+        if len(ocorrencias) >= limite:
+            break
+    return ocorrencias
+
+
+def detectar_conflitos(profissional, ocorrencias, intervalo=0):
+    """
+    Verifica todas as ocorrências de uma vez: uma consulta para os agendamentos do período,
+    uma para o horário de trabalho e outra para as exceções de horário. Retorna uma lista de
+    (inicio, motivo). `intervalo` são os minutos livres exigidos entre a ocorrência e outros
+    agendamentos. Como na disponibilidade, uma exceção substitui o horário de trabalho do dia.
+    """
+    if not ocorrencias:
+        return []
+    folga = timedelta(minutes=intervalo)
+    primeiro_inicio = min(inicio for inicio, _ in ocorrencias)
+    ultimo_fim = max(fim for _, fim in ocorrencias)
+
+    ocupados = mesclar_intervalos(
+        (inicio - folga, fim + folga)
+        for inicio, fim in Agendamento.objects.filter(
+            profissional=profissional,
+            data_hora_inicio__lt=ultimo_fim + folga,
+            data_hora_fim__gt=primeiro_inicio - folga,
+        ).exclude(status__in=STATUS_QUE_LIBERAM_HORARIO).values_list('data_hora_inicio', 'data_hora_fim')
+    )
+    inicios_ocupados = [inicio for inicio, _ in ocupados]
+
+    horarios_semana = {
+        dia_da_semana: (hora_inicio, hora_fim)
+        for dia_da_semana, hora_inicio, hora_fim in HorarioTrabalho.objects.filter(
+            profissional=profissional, ativo=True
+        ).values_list('dia_da_semana', 'hora_inicio', 'hora_fim')
+    }
+
+    excecoes = {}
+    for data, dia_inteiro, hora_inicio, hora_fim, descricao in ExcecaoHorario.objects.filter(
+        profissional=profissional,
+        data__range=(timezone.localtime(primeiro_inicio).date(), timezone.localtime(ultimo_fim).date()),
+    ).values_list('data', 'dia_inteiro', 'hora_inicio', 'hora_fim', 'descricao'):
+        excecoes.setdefault(data, []).append((dia_inteiro, hora_inicio, hora_fim, descricao))
+
+    conflitos = []
+    for inicio, fim in ocorrencias:
+        # Intervalos mesclados são disjuntos: basta olhar o último que começa antes do fim da ocorrência.
+        posicao = bisect_left(inicios_ocupados, fim) - 1
+        if posicao >= 0 and ocupados[posicao][1] > inicio:
+            conflitos.append((inicio, "Já existe um agendamento neste horário."))
+            continue
+
+        inicio_local = timezone.localtime(inicio)
+        fim_local = timezone.localtime(fim)
+        excecoes_do_dia = excecoes.get(inicio_local.date())
+        if excecoes_do_dia:
+            for dia_inteiro, hora_inicio, hora_fim, descricao in excecoes_do_dia:
+                if dia_inteiro or not _dentro_da_janela(inicio_local, fim_local, hora_inicio, hora_fim):
+                    conflitos.append((inicio, f"Exceção de horário: {descricao}"))
+                    break
+        elif not _dentro_da_janela(inicio_local, fim_local, *horarios_semana.get(inicio_local.weekday(), (None, None))):
+            conflitos.append((inicio, "Fora do horário de trabalho do profissional."))
+    return conflitos
+
+
+def _dentro_da_janela(inicio_local, fim_local, hora_inicio, hora_fim):
+    """ Indica se a ocorrência cabe entre hora_inicio e hora_fim do próprio dia. """
+    if not hora_inicio or not hora_fim or fim_local.date() != inicio_local.date():
+        return False
+    return hora_inicio <= inicio_local.time() and fim_local.time() <= hora_fim
+
+
+def criar_serie(profissional, ocorrencias, ignorar_conflitos=False, intervalo=0, **campos):
+    """
+    Cria todas as ocorrências em uma única transação, com a linha do profissional bloqueada
+    para que agendamentos concorrentes não ocupem os mesmos horários durante a validação.
+
+    `intervalo` são os minutos livres exigidos entre as sessões (PerfilClinica.intervalo_entre_sessoes).
+    Retorna (agendamentos_criados, conflitos). Se houver conflitos e `ignorar_conflitos`
+    for falso, nada é criado.
+    """
+    with transaction.atomic():
+        Profissional.objects.select_for_update().get(pk=profissional.pk)
+        conflitos = detectar_conflitos(profissional, ocorrencias, intervalo)
+        if conflitos and not ignorar_conflitos:
+            return [], conflitos
+
+        inicios_em_conflito = {inicio for inicio, _ in conflitos}
+        serie = uuid.uuid4()
+        agendamentos = Agendamento.objects.bulk_create([
+            Agendamento(profissional=profissional, data_hora_inicio=inicio, data_hora_fim=fim, serie=serie, **campos)
+            for inicio, fim in ocorrencias
+            if inicio not in inicios_em_conflito
+        ])
+
+        # bulk_create não dispara os sinais, então o cache de disponibilidade é invalidado aqui.
+        invalidar_agenda(profissional.pk, [
+            dia for agendamento in agendamentos
+            for dia in dias_do_intervalo(agendamento.data_hora_inicio, agendamento.data_hora_fim)
+        ])
+    return agendamentos, conflitos
@@ -0,0 +1,114 @@
+"""
+Reserva atômica de horários vindos da conversa com a IA.
+
+Os horários oferecidos ao paciente podem ter sido calculados a partir do cache e
+vários pacientes podem escolher o mesmo horário ao mesmo tempo. A reserva bloqueia
+a agenda do profissional, confere o conflito no banco e só então cria o agendamento.
+
+Enquanto o paciente decide, os horários oferecidos ficam segurados por uma
+ReservaTemporaria, que some quando vira agendamento ou quando expira.
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+
+from apps.users.models import Profissional
+from .models import Agendamento, ReservaTemporaria, ListaEspera
+from .disponibilidade import buscar_horarios_conta, invalidar_agenda, dias_do_intervalo
+from .recorrencia import detectar_conflitos
+
+
+# Por quanto tempo os horários oferecidos ficam segurados (o mesmo tempo que a oferta fica no cache).
+TEMPO_RESERVA_TEMPORARIA = 10 * 60
+
+
+def _dias_das_reservas(reservas):
+    dias = {}
+    for profissional_id, inicio, fim in reservas:
+        dias.setdefault(profissional_id, set()).update(dias_do_intervalo(inicio, fim))
+    return dias
+
+
+def liberar_reservas(paciente):
+    """ Remove as reservas temporárias do paciente e invalida os dias que elas ocupavam. """
+    reservas = ReservaTemporaria.objects.filter(paciente=paciente)
+    dias = _dias_das_reservas(reservas.values_list('profissional_id', 'data_hora_inicio', 'data_hora_fim'))
+    reservas.delete()
+    for profissional_id, dias_profissional in dias.items():
+        invalidar_agenda(profissional_id, dias_profissional)
+
+
+def segurar_horarios(paciente, horarios, segundos=TEMPO_RESERVA_TEMPORARIA):
+    """
+    Segura os horários oferecidos ao paciente (itens de `buscar_horarios_conta`), substituindo
+    as reservas anteriores dele. Tudo numa transação, com um único bulk_create.
+    """
+    expira_em = timezone.now() + timedelta(seconds=segundos)
+    with transaction.atomic():
+        liberar_reservas(paciente)
+        ReservaTemporaria.objects.bulk_create([
+            ReservaTemporaria(
+                paciente=paciente, profissional_id=h['profissional_id'],
+                data_hora_inicio=h['inicio'], data_hora_fim=h['fim'], expira_em=expira_em
+            )
+            for h in horarios
+        ])
+        # bulk_create não dispara os sinais, então o cache de disponibilidade é invalidado aqui.
+        dias = _dias_das_reservas((h['profissional_id'], h['inicio'], h['fim']) for h in horarios)
+        for profissional_id, dias_profissional in dias.items():
+            invalidar_agenda(profissional_id, dias_profissional)
+
+
+def _reservado_para_outro(paciente, profissional_id, inicio, fim):
+    return ReservaTemporaria.objects.filter(
+        profissional_id=profissional_id, data_hora_inicio__lt=fim, data_hora_fim__gt=inicio,
+        expira_em__gt=timezone.now(),
+    ).exclude(paciente=paciente).exists()
+
+
+@dataclass
+class ResultadoReserva:
+    agendamento: Agendamento = None
+    motivo_conflito: str = None
+    alternativas: list = field(default_factory=list)
+
+    @property
+    def sucesso(self):
+        return self.agendamento is not None
+
+
+def reservar_horario(paciente, profissional_id, inicio, fim, servico=None, intervalo=0,
+                     titulo="Consulta agendada pela IA", status='Confirmado', preferencias=None):
+    """
+    Cria o agendamento se o horário ainda estiver livre.
+
+    A linha do profissional fica bloqueada (SELECT ... FOR UPDATE) durante a checagem e a criação,
+    então duas conversas que escolhem o mesmo horário são serializadas e só a primeira é atendida.
+    Reservas temporárias de outros pacientes também contam como conflito; as do próprio paciente
+    são convertidas no agendamento (removidas na mesma transação), e o paciente sai da lista de espera.
+    Em caso de conflito, devolve novos horários da conta em `alternativas` para serem oferecidos.
+    """
+    with transaction.atomic():
+        Profissional.objects.select_for_update().get(pk=profissional_id)
+        conflitos = detectar_conflitos(profissional_id, [(inicio, fim)], intervalo=intervalo)
+        if not conflitos and _reservado_para_outro(paciente, profissional_id, inicio, fim):
+            conflitos = [(inicio, "Horário reservado para outro paciente.")]
+        if not conflitos:
+            agendamento = Agendamento.objects.create(
+                paciente=paciente, profissional_id=profissional_id, servico=servico, titulo=titulo,
+                data_hora_inicio=inicio, data_hora_fim=fim, status=status
+            )
+            liberar_reservas(paciente)
+            ListaEspera.objects.filter(paciente=paciente, ativo=True).update(ativo=False)
+            return ResultadoReserva(agendamento=agendamento)
+
+    # O cache pode ainda não refletir a reserva concorrente; descarta o dia antes de buscar alternativas.
+    invalidar_agenda(profissional_id, dias_do_intervalo(inicio, fim))
+    alternativas = buscar_horarios_conta(
+        paciente.conta, preferencias=preferencias, servico=servico, intervalo=intervalo,
+        um_por_horario=True, paciente_id=paciente.pk
+    )
+    alternativas = [h for h in alternativas if h['inicio'] != inicio]
+    segurar_horarios(paciente, alternativas)
+    return ResultadoReserva(motivo_conflito=conflitos[0][1], alternativas=alternativas)
@@ -0,0 +1,173 @@
+"""
+Classificação local das mensagens mais comuns do WhatsApp, antes da Gemini.
+
+Cumprimentos, pedidos de agendamento sem preferência, perguntas sobre pendências e
+pedidos de receita/atestado/recibo são reconhecidos por regras sobre o texto
+normalizado (minúsculas, sem acentos e sem pontuação). Cada regra tem uma confiança;
+quando nenhuma regra passa de CONFIANCA_MINIMA, ou quando regras de intenções
+diferentes casam com a mesma mensagem, a classificação fica com a Gemini.
+
+Os contadores de acertos são do processo (webhook ou worker), registrados por
+registrar_classificacao() e lidos com estatisticas_roteador().
+"""
+import re
+import unicodedata
+from collections import Counter
+
+# Abaixo desta confiança a mensagem é enviada para a Gemini.
+CONFIANCA_MINIMA = 0.8
+
+# Mensagens longas costumam misturar assuntos: a confiança cai a cada palavra acima deste limite.
+PALAVRAS_SEM_PENALIDADE = 10
+PENALIDADE_POR_PALAVRA = 0.03
+
+# Abreviações comuns no WhatsApp, trocadas antes de aplicar as regras.
+ABREVIACOES = {
+    'vc': 'voce', 'vcs': 'voces', 'q': 'que', 'pq': 'porque', 'td': 'tudo', 'tb': 'tambem',
+    'tbm': 'tambem', 'p': 'para', 'pra': 'para', 'pro': 'para o', 'to': 'estou', 'tou': 'estou',
+    'ta': 'esta', 'hj': 'hoje', 'amn': 'amanha', 'qdo': 'quando', 'qto': 'quanto', 'msg': 'mensagem',
+    'dr': 'doutor', 'dra': 'doutora', 'blz': 'beleza', 'obg': 'obrigado', 'vlw': 'valeu',
+}
+
+CUMPRIMENTOS = re.compile(
+    r'\b(oi+e*|ola+|opa|alo|hello|hi|hey|eai|e ai|bom dia|boa tarde|boa noite|'
+    r'tudo (bem|bom|certo|joia|tranquilo)( (com|contigo) voce)?|como (vai|voce esta|esta)|'
+    r'beleza|doutor|doutora)\b'
+)
+
+# Indicações de dia ou período: com elas o pedido de agendamento traz preferência e fica com a Gemini.
+PREFERENCIAS = re.compile(
+    r'\b(hoje|amanha|depois de amanha|segunda|terca|quarta|quinta|sexta|sabado|domingo|'
+    r'manha|tarde|noite|cedo|almoco|semana|mes|fim de semana|final de semana|'
+    r'janeiro|fevereiro|marco|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro|'
+    r'dia \d{1,2}|\d{1,2} ?(h|hs|horas?)|\d{1,2}:\d{2}|\d{1,2}/\d{1,2})\b'
+)
+
+PEDIDO_AGENDAMENTO = re.compile(r'\b(marcar|agendar|agendamento|marcacao|remarcar|reagendar)\b')
+PEDIDO_VAGA = re.compile(
+    r'\b(quero|queria|gostaria|preciso|tem|teria|tenho interesse|ha|existe|disponivel|disponiveis|livre)\b'
+    r'.*\b(consulta|sessao|atendimento|horario|vaga)s?\b'
+)
+
+# Perguntas sobre a clínica (valores, endereço, convênio...) que mencionam consulta mas são do FAQ.
+ASSUNTOS_FAQ = re.compile(
+    r'\b(quanto|valor|valores|preco|custa|custo|onde|endereco|convenio|plano|aceita|aceitam|'
+    r'reembolso|como funciona|duracao|dura|cancelar|desmarcar|pix|cartao|parcel\w*)\b'
+)
+
+PENDENCIAS = re.compile(
+    r'\b(quanto (eu )?devo|(estou|eu estou) devendo|devo (algo|alguma coisa|algum valor)|'
+    r'debitos?|pendencias?|pendente|em aberto|falta pagar|'
+    r'tenho (algo|alguma coisa|algum valor|conta) (para|a) pagar|(algo|alguma coisa) (para|a) pagar)\b'
+)
+
+PEDIDO_DOCUMENTO = re.compile(
+    r'\b(preciso|quero|queria|gostaria|pode|poderia|podia|manda|mande|mandar|enviar|envia|envie|'
+    r'emitir|solicitar|solicito|pedir|segunda via|fazer)\b'
+)
+DOCUMENTOS = {
+    'solicitar_receita': re.compile(r'\b(receita|receituario|prescricao)s?\b'),
+    'solicitar_atestado': re.compile(r'\b(atestado|declaracao de comparecimento)s?\b'),
+    'solicitar_recibo': re.compile(r'\b(recibo|nota fiscal)s?\b'),
+}
+
+# Confirmações curtas, usadas quando o paciente tem um único horário oferecido.
+CONFIRMACOES = re.compile(
+    r'^(sim|s|pode ser|pode|quero|quero sim|confirmo|confirmado|fechado|combinado|ok|okay|'
+    r'perfeito|otimo|claro|com certeza|pode marcar|pode reservar|reserva|reserve)( (sim|por favor|obrigado|obrigada))?$'
+)
+
+_estatisticas = Counter()
+
+
+def normalizar(texto):
+    """ Minúsculas, sem acentos, sem pontuação e com as abreviações comuns expandidas. """
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii').lower()
+    palavras = re.sub(r'[^a-z0-9:/]+', ' ', texto).split()
+    return ' '.join(ABREVIACOES.get(palavra, palavra) for palavra in palavras)
+
+
+def _ajustar_pelo_tamanho(confianca, texto):
+    excesso = len(texto.split()) - PALAVRAS_SEM_PENALIDADE
+    return confianca - PENALIDADE_POR_PALAVRA * excesso if excesso > 0 else confianca
+
+
+def classificar_intencao(mensagem, horarios_oferecidos=0):
+    """
+    Aplica as regras locais e retorna (intencao, confianca).
+    `horarios_oferecidos` é a quantidade de horários em oferta para o paciente: com exatamente
+    um, uma confirmação curta ("sim", "pode ser") vale como escolha desse horário.
+    Retorna (None, 0.0) quando nenhuma regra casa ou quando regras diferentes se contradizem.
+    """
+    texto = normalizar(mensagem)
+    if not texto:
+        return None, 0.0
+
+    sem_cumprimentos = ' '.join(CUMPRIMENTOS.sub(' ', texto).split())
+    if not sem_cumprimentos:
+        return 'SAUDACAO', 0.95
+
+    if horarios_oferecidos == 1 and CONFIRMACOES.match(sem_cumprimentos):
+        return 'ESCOLHEU_HORARIO', 0.9
+
+    candidatas = {}
+    if PENDENCIAS.search(sem_cumprimentos):
+        candidatas['VERIFICAR_PENDENCIAS'] = 0.9
+
+    if PEDIDO_DOCUMENTO.search(sem_cumprimentos):
+        for intencao, padrao in DOCUMENTOS.items():
+            if padrao.search(sem_cumprimentos):
+                candidatas[intencao] = 0.9
+
+    if not ASSUNTOS_FAQ.search(sem_cumprimentos):
+        if PEDIDO_AGENDAMENTO.search(sem_cumprimentos):
+            candidatas['AGENDAR'] = 0.9
+        elif PEDIDO_VAGA.search(sem_cumprimentos) and not candidatas:
+            # "preciso do recibo da consulta" menciona consulta, mas o pedido é o documento.
+            candidatas['AGENDAR'] = 0.85
+        # Com dia ou período, a extração das preferências fica com a Gemini.
+        if 'AGENDAR' in candidatas and PREFERENCIAS.search(sem_cumprimentos):
+            del candidatas['AGENDAR']
+
+    if len(candidatas) != 1:
+        return None, 0.0
+    intencao, confianca = candidatas.popitem()
+    return intencao, _ajustar_pelo_tamanho(confianca, sem_cumprimentos)
+
+
+def identificar_intencao_local(mensagem, horarios_oferecidos=0):
+    """
+    Retorna a intenção quando as regras locais têm confiança suficiente, ou None para
+    indicar que a mensagem deve seguir para a próxima etapa da classificação.
+    """
+    intencao, confianca = classificar_intencao(mensagem, horarios_oferecidos)
+    return intencao if intencao and confianca >= CONFIANCA_MINIMA else None
+
+
+def registrar_classificacao(origem, intencao=None):
+    """ Conta uma mensagem classificada por `origem` ('regras', 'faq' ou 'gemini'). """
+    _estatisticas[origem] += 1
+    if origem != 'gemini':
+        _estatisticas[f'{origem}:{intencao}'] += 1
+
+
+def estatisticas_roteador():
+    """ Quantas mensagens foram classificadas sem a Gemini (regras e índice do FAQ), quantas foram para a Gemini e a taxa local. """
+    local = _estatisticas['regras'] + _estatisticas['faq']
+    total = local + _estatisticas['gemini']
+    return {
+        'total': total,
+        'local': local,
+        'regras': _estatisticas['regras'],
+        'faq': _estatisticas['faq'],
+        'gemini': _estatisticas['gemini'],
+        'taxa_local': round(local / total, 3) if total else 0.0,
+        'por_intencao': {
+            chave.split(':', 1)[1]: quantidade
+            for chave, quantidade in sorted(_estatisticas.items()) if ':' in chave
+        },
+    }
+
+
+def zerar_estatisticas_roteador():
+    _estatisticas.clear()
@@ -1,5 +1,10 @@
+from datetime import timedelta
 from rest_framework import serializers
-from .models import Agendamento, HorarioTrabalho, ExcecaoHorario
+from apps.users.models import Paciente
+from apps.financas.models import Servico
+from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, ListaEspera, ModeloMensagem
+from .modelos_mensagem import compilar_modelo, ModeloInvalido
+from .recorrencia import FREQUENCIAS, MAX_OCORRENCIAS
 
 class AgendamentoSerializer(serializers.ModelSerializer):
     """
@@ -17,6 +22,16 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         fields = '__all__'
         # Adicionamos os campos extras que criamos acima à lista de campos a serem lidos.
         read_only_fields = ['paciente_nome', 'profissional_nome', 'servico_nome', 'profissional']
+        # O fim pode ser omitido quando há um serviço: ele é calculado pela duração padrão.
+        extra_kwargs = {'data_hora_fim': {'required': False}}
+
+    def validate(self, data):
+        if 'data_hora_fim' not in data and not (self.instance and self.partial):
+            servico = data.get('servico')
+            if not servico or not data.get('data_hora_inicio'):
+                raise serializers.ValidationError({"data_hora_fim": "Informe o fim do agendamento ou um serviço com duração padrão."})
+            data['data_hora_fim'] = data['data_hora_inicio'] + timedelta(minutes=servico.duracao_padrao)
+        return data
 
 class HorarioTrabalhoSerializer(serializers.ModelSerializer):
     """
@@ -33,4 +48,108 @@ class ExcecaoHorarioSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = ExcecaoHorario
-        fields = ['id', 'data', 'dia_inteiro', 'hora_inicio', 'hora_fim', 'descricao']
\ No newline at end of file
+        fields = ['id', 'data', 'dia_inteiro', 'hora_inicio', 'hora_fim', 'descricao']
+
+class AtualizacaoStatusLoteSerializer(serializers.Serializer):
+    """
+    Valida uma mudança de status em lote: por lista de IDs, por período (data local
+    do início) ou pelos dois combinados. Sem 'data_fim', o período é só o dia de 'data_inicio'.
+    """
+    status = serializers.ChoiceField(choices=Agendamento.STATUS_CHOICES)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=500)
+    data_inicio = serializers.DateField(required=False)
+    data_fim = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if not data.get('ids') and not data.get('data_inicio'):
+            raise serializers.ValidationError("Informe os IDs dos agendamentos ou a data de início do período.")
+        if data.get('data_fim') and not data.get('data_inicio'):
+            raise serializers.ValidationError({"data_inicio": "Informe a data de início junto com a data de fim."})
+        if data.get('data_inicio'):
+            data.setdefault('data_fim', data['data_inicio'])
+            if data['data_fim'] < data['data_inicio']:
+                raise serializers.ValidationError({"data_fim": "A data de fim deve ser igual ou posterior à data de início."})
+        return data
+
+class ListaEsperaSerializer(serializers.ModelSerializer):
+    """
+    Serializer para o modelo ListaEspera.
+    """
+    paciente_nome = serializers.CharField(source='paciente.nome_completo', read_only=True)
+    profissional_nome = serializers.CharField(source='profissional.nome_completo', read_only=True, allow_null=True)
+
+    class Meta:
+        model = ListaEspera
+        fields = ['id', 'paciente', 'paciente_nome', 'profissional', 'profissional_nome', 'dia_semana', 'periodo', 'ativo', 'notificado_em', 'oferta_inicio', 'oferta_expira_em', 'criado_em']
+        read_only_fields = ['notificado_em', 'oferta_inicio', 'oferta_expira_em', 'criado_em']
+
+    def validate(self, data):
+        conta = self.context['request'].user.conta
+        paciente = data.get('paciente')
+        if paciente and paciente.conta != conta:
+            raise serializers.ValidationError({"paciente": "Este paciente não pertence à sua clínica/conta."})
+        profissional = data.get('profissional')
+        if profissional and profissional.conta != conta:
+            raise serializers.ValidationError({"profissional": "Este profissional não pertence à sua clínica/conta."})
+        return data
+
+class ModeloMensagemSerializer(serializers.ModelSerializer):
+    """
+    Serializer para o modelo ModeloMensagem. O texto é validado contra as variáveis da mensagem.
+    """
+    class Meta:
+        model = ModeloMensagem
+        fields = ['id', 'chave', 'texto', 'reescrever_com_ia', 'atualizado_em']
+        read_only_fields = ['atualizado_em']
+
+    def validate(self, data):
+        chave = data.get('chave', self.instance.chave if self.instance else None)
+        texto = data.get('texto', self.instance.texto if self.instance else None)
+        try:
+            compilar_modelo(texto, chave)
+        except ModeloInvalido as e:
+            raise serializers.ValidationError({"texto": str(e)})
+
+        conta = self.context['request'].user.conta
+        existentes = ModeloMensagem.objects.filter(conta=conta, chave=chave)
+        if self.instance:
+            existentes = existentes.exclude(pk=self.instance.pk)
+        if existentes.exists():
+            raise serializers.ValidationError({"chave": "Esta mensagem já foi personalizada. Edite o modelo existente."})
+        return data
+
+class AgendamentoSerieSerializer(serializers.Serializer):
+    """
+    Valida os dados de uma série de agendamentos recorrentes.
+    O primeiro horário define o dia da semana e a hora de todas as ocorrências.
+    """
+    paciente = serializers.PrimaryKeyRelatedField(queryset=Paciente.objects.all())
+    servico = serializers.PrimaryKeyRelatedField(queryset=Servico.objects.all(), required=False, allow_null=True)
+    titulo = serializers.CharField(max_length=200)
+    notas_agendamento = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    status = serializers.ChoiceField(choices=Agendamento.STATUS_CHOICES, default='Agendado')
+    data_hora_inicio = serializers.DateTimeField()
+    data_hora_fim = serializers.DateTimeField(required=False)
+    frequencia = serializers.ChoiceField(choices=list(FREQUENCIAS))
+    data_limite = serializers.DateField(required=False)
+    quantidade = serializers.IntegerField(required=False, min_value=1, max_value=MAX_OCORRENCIAS)
+    pular = serializers.ListField(child=serializers.DateField(), required=False, default=list)
+    ignorar_conflitos = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        conta = self.context['request'].user.conta
+        if data['paciente'].conta != conta:
+            raise serializers.ValidationError({"paciente": "Este paciente não pertence à sua clínica/conta."})
+        servico = data.get('servico')
+        if servico and servico.conta != conta:
+            raise serializers.ValidationError({"servico": "Este serviço não pertence à sua clínica/conta."})
+        if not data.get('data_limite') and not data.get('quantidade'):
+            raise serializers.ValidationError("Informe a data limite ou a quantidade de ocorrências da série.")
+
+        if 'data_hora_fim' not in data:
+            if not servico:
+                raise serializers.ValidationError({"data_hora_fim": "Informe o fim do agendamento ou um serviço com duração padrão."})
+            data['data_hora_fim'] = data['data_hora_inicio'] + timedelta(minutes=servico.duracao_padrao)
+        if data['data_hora_fim'] <= data['data_hora_inicio']:
+            raise serializers.ValidationError({"data_hora_fim": "O fim deve ser posterior ao início."})
+        return data
@@ -0,0 +1,106 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.users.models import ItemFAQ, PerfilClinica, Profissional, Assinatura, Plano
+from apps.financas.models import Servico
+from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, ModeloMensagem
+from .disponibilidade import invalidar_agenda, dias_do_horizonte, dias_do_intervalo
+from .indice_faq import invalidar_indice_faq
+from .cache_respostas_ia import invalidar_respostas_conta
+from .contexto_conta import invalidar_contexto_conta
+from .calendario import marcar_agenda_alterada
+
+
+@receiver(post_init, sender=Agendamento)
+@receiver(post_init, sender=HorarioTrabalho)
+@receiver(post_init, sender=ExcecaoHorario)
+def guardar_estado_original(sender, instance, **kwargs):
+    """
+    Guarda os campos que definem a agenda no momento em que a instância é carregada,
+    para que uma alteração invalide também os dias que ela deixou de ocupar.
+    """
+    # Lê direto do __dict__ para não disparar consultas em campos adiados (.only/.defer).
+    campos = instance.__dict__
+    if sender is Agendamento:
+        instance._agenda_original = (campos.get('profissional_id'), campos.get('data_hora_inicio'), campos.get('data_hora_fim'))
+    elif sender is HorarioTrabalho:
+        instance._agenda_original = (campos.get('profissional_id'), campos.get('dia_da_semana'))
+    else:
+        instance._agenda_original = (campos.get('profissional_id'), campos.get('data'))
+
+
+@receiver(post_save, sender=Agendamento)
+@receiver(post_delete, sender=Agendamento)
+def invalidar_agenda_agendamento(sender, instance, **kwargs):
+    invalidar_agenda(instance.profissional_id, dias_do_intervalo(instance.data_hora_inicio, instance.data_hora_fim))
+    profissional_id, inicio, fim = getattr(instance, '_agenda_original', (None, None, None))
+    if profissional_id:
+        invalidar_agenda(profissional_id, dias_do_intervalo(inicio, fim))
+    _marcar_feed_alterado(instance, profissional_id, excluido=kwargs['signal'] is post_delete)
+    guardar_estado_original(sender, instance)
+
+
+def _marcar_feed_alterado(instance, profissional_original_id, excluido):
+    """ A exclusão (ou a troca de profissional) tira o evento do feed ICS sem alterar `atualizado_em`. """
+    if excluido:
+        marcar_agenda_alterada(instance.profissional_id)
+    elif profissional_original_id and profissional_original_id != instance.profissional_id:
+        marcar_agenda_alterada(profissional_original_id)
+
+
+@receiver(post_save, sender=HorarioTrabalho)
+@receiver(post_delete, sender=HorarioTrabalho)
+def invalidar_agenda_horario_trabalho(sender, instance, **kwargs):
+    invalidar_agenda(instance.profissional_id, dias_do_horizonte(instance.dia_da_semana))
+    profissional_id, dia_da_semana = getattr(instance, '_agenda_original', (None, None))
+    if profissional_id and dia_da_semana is not None:
+        invalidar_agenda(profissional_id, dias_do_horizonte(dia_da_semana))
+    guardar_estado_original(sender, instance)
+
+
+@receiver(post_save, sender=ExcecaoHorario)
+@receiver(post_delete, sender=ExcecaoHorario)
+def invalidar_agenda_excecao(sender, instance, **kwargs):
+    invalidar_agenda(instance.profissional_id, [instance.data])
+    profissional_id, data = getattr(instance, '_agenda_original', (None, None))
+    if profissional_id and data:
+        invalidar_agenda(profissional_id, [data])
+    _marcar_feed_alterado(instance, profissional_id, excluido=kwargs['signal'] is post_delete)
+    guardar_estado_original(sender, instance)
+
+
+@receiver(post_save, sender=ItemFAQ)
+@receiver(post_delete, sender=ItemFAQ)
+def invalidar_faq(sender, instance, **kwargs):
+    invalidar_indice_faq(instance.conta_id)
+    invalidar_respostas_conta(instance.conta_id)
+    invalidar_contexto_conta(instance.conta_id)
+
+
+@receiver(post_save, sender=PerfilClinica)
+@receiver(post_delete, sender=PerfilClinica)
+def invalidar_respostas_perfil(sender, instance, **kwargs):
+    invalidar_respostas_conta(instance.conta_id)
+    invalidar_contexto_conta(instance.conta_id)
+
+
+@receiver(post_save, sender=Servico)
+@receiver(post_delete, sender=Servico)
+@receiver(post_save, sender=Profissional)
+@receiver(post_delete, sender=Profissional)
+@receiver(post_save, sender=Assinatura)
+@receiver(post_delete, sender=Assinatura)
+@receiver(post_save, sender=ModeloMensagem)
+@receiver(post_delete, sender=ModeloMensagem)
+def invalidar_contexto(sender, instance, **kwargs):
+    invalidar_contexto_conta(instance.conta_id)
+
+
+@receiver(post_save, sender=HorarioTrabalho)
+@receiver(post_delete, sender=HorarioTrabalho)
+def invalidar_contexto_horario_trabalho(sender, instance, **kwargs):
+    invalidar_contexto_conta(Profissional.objects.filter(pk=instance.profissional_id).values_list('conta_id', flat=True).first())
+
+
+@receiver(post_save, sender=Plano)
+def invalidar_contexto_plano(sender, instance, **kwargs):
+    invalidar_contexto_conta(*Assinatura.objects.filter(plano=instance).values_list('conta_id', flat=True))
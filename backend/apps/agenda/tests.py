@@ -1,3 +1,1723 @@
-from django.test import TestCase
+import asyncio
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from time import perf_counter, sleep
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.users.models import Assinatura, CategoriaFAQ, Conta, ItemFAQ, Paciente, PerfilClinica, Plano, Profissional
+from apps.users.signals import DEFAULT_FAQ_STRUCTURE
+from apps.financas.models import Servico, Transacao
+from .atendimento import AtendimentoWhatsApp, BuscaEspeculativa, TemposAtendimento
+from .cache_respostas_ia import CacheRespostasIA, respostas_ia
+from .calendario import versao_calendario
+from .contexto_conta import obter_contexto_conta
+from .disponibilidade import (
+    _chave_agenda_dia, buscar_horarios_conta, buscar_horarios_disponiveis, gerar_horarios, mesclar_intervalos,
+    subtrair_intervalos,
+)
+from .escalonador_whatsapp import PRIORIDADE_ALTA, PRIORIDADE_NORMAL, EscalonadorContas, prioridade_da_mensagem
+from .fila_whatsapp import (
+    ESPERA_MAXIMA_AGRUPAMENTO, MAX_TENTATIVAS, TEMPO_LIMITE_PROCESSAMENTO, concluir_tarefa, corpo_da_tarefa, enfileirar_mensagem,
+    processar_tarefa, recuperar_tarefas_travadas, reivindicar_tarefa,
+)
+from .escolha_horario import formatar_horarios_numerados, resolver_escolha
+from .formatacao_datas import data_e_hora_por_extenso
+from .historico_conversa import (
+    LIMITE_TURNOS, RETENCAO_CONVERSA, anotar_resposta, formatar_historico, limpar_conversas_antigas, obter_historico,
+    registrar_conversa,
+)
+from .ia_manager import GeminiAIManager
+from .indice_faq import IndiceFAQ, identificar_intencao_faq, obter_indice_faq
+from .interpretador_horarios import PreferenciaHorario, interpretar_preferencias
+from .lista_espera import _filtro_inscricoes, avisar_lista_espera, inscricoes_para_horarios_liberados, ofertas_lista_espera
+from .modelos_mensagem import MODELOS_PADRAO, ModeloInvalido, compilar_modelo, montar_mensagem, obter_modelo
+from .models import (
+    Agendamento, ExcecaoHorario, HorarioTrabalho, ListaEspera, MensagemConversa, MensagemRecebidaWhatsApp, ModeloMensagem,
+    ReservaTemporaria, TarefaWhatsApp,
+)
+from .recorrencia import detectar_conflitos, gerar_ocorrencias
+from .reservas import reservar_horario, segurar_horarios
+from .roteador_intencoes import (
+    CONFIANCA_MINIMA, classificar_intencao, estatisticas_roteador, identificar_intencao_local, zerar_estatisticas_roteador,
+)
+from .versoes_cache import incrementar_versao, ler_versao
+from .whatsapp import fechar_cliente_twilio_async, responder_paciente_via_whatsapp_async
+
+
+class DadosAgendaMixin:
+    """ Conta com um profissional que atende todos os dias das 08:00 às 18:00. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'profissional@teste.com', 'senha', nome_completo='Ana Souza', funcao='proprietario'
+        )
+        # bulk_create não dispara os sinais de Conta (perfil e FAQ padrão), desnecessários aqui.
+        cls.conta, = Conta.objects.bulk_create([
+            Conta(nome_conta='Clínica Teste', proprietario=cls.profissional, whatsapp_number='5511999990000')
+        ])
+        PerfilClinica.objects.create(conta=cls.conta)
+        cls.profissional.conta = cls.conta
+        cls.profissional.save()
+        plano = Plano.objects.create(nome='PREMIUM', preco_mensal=0, limite_mensagens_ia=1000)
+        Assinatura.objects.create(conta=cls.conta, plano=plano)
+        cls.paciente = Paciente.objects.create(nome_completo='João Silva', contato_telefone='5511988887777', conta=cls.conta)
+        for dia_da_semana in range(7):
+            HorarioTrabalho.objects.create(
+                profissional=cls.profissional, dia_da_semana=dia_da_semana, hora_inicio=time(8), hora_fim=time(18)
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.amanha = timezone.localdate() + timedelta(days=1)
+
+    def as_horas(self, dia, hora):
+        return timezone.make_aware(datetime.combine(dia, time(hora)))
+
+
+class CacheAgendaEntreProcessosTests(DadosAgendaMixin, TestCase):
+    """
+    O servidor web (API) e o worker da fila (bot) são processos diferentes: uma alteração feita
+    por um caminho precisa apagar a agenda em cache que o outro lê.
+    """
+
+    def primeiro_horario_bot(self):
+        horarios = buscar_horarios_conta(self.conta, quantidade=1, preferencias={'data': self.amanha.isoformat()})
+        return timezone.localtime(horarios[0]['inicio'])
+
+    def test_cache_padrao_e_compartilhado(self):
+        self.assertIsInstance(caches['default'], RedisCache)
+
+    def test_agendamento_pela_api_some_da_agenda_do_bot(self):
+        self.assertEqual(self.primeiro_horario_bot(), self.as_horas(self.amanha, 8))
+        chave = _chave_agenda_dia(self.profissional.pk, self.amanha)
+        # O worker lê o mesmo Redis com o seu próprio cliente.
+        cache_do_worker = RedisCache(settings.CACHES['default']['LOCATION'], {})
+        self.assertIsNotNone(cache_do_worker.get(chave))
+
+        cliente = APIClient()
+        cliente.force_authenticate(self.profissional)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = cliente.post('/api/agendamentos/', {
+                'paciente': self.paciente.pk, 'titulo': 'Consulta',
+                'data_hora_inicio': self.as_horas(self.amanha, 8).isoformat(),
+                'data_hora_fim': self.as_horas(self.amanha, 9).isoformat(),
+            }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+
+        self.assertIsNone(cache_do_worker.get(chave))
+        self.assertEqual(self.primeiro_horario_bot(), self.as_horas(self.amanha, 9))
+
+    def test_excecao_pela_api_fecha_o_dia_para_o_bot(self):
+        self.primeiro_horario_bot()
+        cliente = APIClient()
+        cliente.force_authenticate(self.profissional)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = cliente.post('/api/excecoes-horario/', {
+                'data': self.amanha.isoformat(), 'dia_inteiro': True, 'descricao': 'Congresso',
+            }, format='json')
+        self.assertEqual(resposta.status_code, 201)
+
+        self.assertEqual(buscar_horarios_conta(self.conta, preferencias={'data': self.amanha.isoformat()}), [])
+
+    def test_reserva_pelo_bot_some_da_disponibilidade_da_api(self):
+        cliente = APIClient()
+        cliente.force_authenticate(self.profissional)
+        url = '/api/disponibilidade/?quantidade=2&dias=2&hora=08:00'
+        inicio_amanha = self.as_horas(self.amanha, 8)
+        primeiro = cliente.get(url).json()
+        self.assertIn(inicio_amanha, [datetime.fromisoformat(h['inicio']) for h in primeiro])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = reservar_horario(self.paciente, self.profissional.pk, inicio_amanha, inicio_amanha + timedelta(hours=1))
+        self.assertTrue(resultado.agendamento)
+
+        segundo = cliente.get(url).json()
+        self.assertNotIn(inicio_amanha, [datetime.fromisoformat(h['inicio']) for h in segundo])
+
+
+class ListaEsperaTests(DadosAgendaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.outro = Paciente.objects.create(nome_completo='Maria Lima', contato_telefone='5511977776666', conta=self.conta)
+        self.inscricao = ListaEspera.objects.create(conta=self.conta, paciente=self.outro)
+        self.inicio = self.as_horas(self.amanha, 10)
+
+    @override_settings(WHATSAPP_USAR_FILA=True)
+    def test_cancelamento_grava_a_oferta_e_enfileira_o_envio(self):
+        agendamento = Agendamento.objects.create(
+            paciente=self.paciente, profissional=self.profissional, titulo='Consulta',
+            data_hora_inicio=self.inicio, data_hora_fim=self.inicio + timedelta(hours=1),
+        )
+        cliente = APIClient()
+        cliente.force_authenticate(self.profissional)
+        with mock.patch('apps.agenda.lista_espera.responder_paciente_via_whatsapp') as enviar:
+            resposta = cliente.patch(f'/api/agendamentos/{agendamento.pk}/', {'status': 'Cancelado'}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        enviar.assert_not_called()
+
+        self.inscricao.refresh_from_db()
+        self.assertEqual(self.inscricao.oferta_inicio, self.inicio)
+        self.assertEqual(self.inscricao.oferta_profissional_id, self.profissional.pk)
+        self.assertGreater(self.inscricao.oferta_expira_em, timezone.now())
+        tarefa = TarefaWhatsApp.objects.get()
+        self.assertEqual(
+            (tarefa.tipo, tarefa.telefone, tarefa.destinatario, tarefa.prioridade),
+            ('envio', '5511977776666', '5511999990000', 0),
+        )
+        self.assertIn(f"Vagou um horário que combina com o que você procurava: {data_e_hora_por_extenso(self.inicio)}.", tarefa.corpo)
+
+    async def test_worker_envia_a_proposta_sem_agrupar_mensagens_recebidas(self):
+        envio = await TarefaWhatsApp.objects.acreate(tipo='envio', telefone='5511977776666', destinatario='5511999990000', corpo='Vagou um horário')
+        recebida = await TarefaWhatsApp.objects.acreate(telefone='5511977776666', destinatario='5511999990000', corpo='SIM')
+        with mock.patch('apps.agenda.fila_whatsapp.responder_paciente_via_whatsapp_async', return_value=True) as enviar:
+            tarefa = await sync_to_async(reivindicar_tarefa)()
+            self.assertEqual(tarefa.pk, envio.pk)
+            await processar_tarefa(tarefa)
+        enviar.assert_called_once_with('5511977776666', 'Vagou um horário')
+        await envio.arefresh_from_db()
+        await recebida.arefresh_from_db()
+        self.assertEqual((envio.status, envio.resultado), ('concluida', 'enviado'))
+        self.assertEqual(recebida.status, 'pendente')
+
+    async def test_sim_responde_a_proposta_e_nao_ao_lembrete(self):
+        lembrete_inicio = self.as_horas(self.amanha + timedelta(days=2), 14)
+        lembrete = await Agendamento.objects.acreate(
+            paciente=self.outro, profissional=self.profissional, titulo='Consulta', status='Agendado',
+            data_hora_inicio=lembrete_inicio, data_hora_fim=lembrete_inicio + timedelta(hours=1),
+        )
+        await ListaEspera.objects.filter(pk=self.inscricao.pk).aupdate(
+            oferta_inicio=self.inicio, oferta_fim=self.inicio + timedelta(hours=1),
+            oferta_profissional=self.profissional, oferta_expira_em=timezone.now() + timedelta(minutes=10),
+        )
+        with mock.patch('apps.agenda.ia_manager.genai.Client'), \
+                mock.patch('apps.agenda.atendimento.responder_paciente_via_whatsapp_async', return_value=True):
+            resultado = await AtendimentoWhatsApp().processar_mensagem('5511977776666', '5511999990000', 'SIM')
+
+        self.assertEqual(resultado['status'], 'agendamento_criado')
+        self.assertTrue(await Agendamento.objects.filter(paciente=self.outro, data_hora_inicio=self.inicio).aexists())
+        await lembrete.arefresh_from_db()
+        self.assertEqual(lembrete.status, 'Agendado')
+        self.assertEqual(await sync_to_async(ofertas_lista_espera)(self.outro), [])
+
+
+    def agendar(self, paciente, inicio):
+        return Agendamento.objects.create(
+            paciente=paciente, profissional=self.profissional, titulo='Consulta',
+            data_hora_inicio=inicio, data_hora_fim=inicio + timedelta(hours=1),
+        )
+
+    def test_inscricoes_compativeis_com_o_horario(self):
+        dia_semana = self.amanha.weekday()
+        outra_conta_dono = Profissional.objects.create_user('outra@teste.com', 'senha', nome_completo='Bia Costa')
+        outra_conta, = Conta.objects.bulk_create([Conta(nome_conta='Outra Clínica', proprietario=outra_conta_dono)])
+        colega = Profissional.objects.create_user('colega@teste.com', 'senha', nome_completo='Caio Lima', conta=self.conta)
+        esperadas = {self.inscricao.pk}
+        for telefone, campos, combina in [
+            ('5511900000001', dict(profissional=self.profissional, dia_semana=dia_semana, periodo='manha'), True),
+            ('5511900000002', dict(dia_semana=dia_semana), True),
+            ('5511900000003', dict(periodo='manha'), True),
+            ('5511900000004', dict(periodo='tarde'), False),
+            ('5511900000005', dict(dia_semana=(dia_semana + 1) % 7), False),
+            ('5511900000006', dict(profissional=colega), False),
+            ('5511900000007', dict(ativo=False), False),
+        ]:
+            paciente = Paciente.objects.create(nome_completo='Paciente', contato_telefone=telefone, conta=self.conta)
+            inscricao = ListaEspera.objects.create(conta=self.conta, paciente=paciente, **campos)
+            if combina:
+                esperadas.add(inscricao.pk)
+        de_outra_conta = Paciente.objects.create(nome_completo='Paciente', contato_telefone='5511900000008', conta=outra_conta)
+        ListaEspera.objects.create(conta=outra_conta, paciente=de_outra_conta)
+
+        agendamento = self.agendar(self.paciente, self.inicio)
+        agendamento.status = 'Cancelado'
+        agendamento.save()
+        [(_, escolhidas)] = inscricoes_para_horarios_liberados([agendamento], quantidade=10)
+        self.assertEqual({inscricao.pk for inscricao in escolhidas}, esperadas)
+
+    @skipUnless(connection.vendor == 'sqlite', "Plano de consulta no formato do SQLite.")
+    def test_busca_usa_o_indice_parcial(self):
+        plano = ListaEspera.objects.filter(_filtro_inscricoes(self.conta.pk, self.profissional.pk, 2, 'manha')).explain()
+        self.assertIn('MULTI-INDEX OR', plano)
+        self.assertEqual(plano.count('USING INDEX lista_espera_ativa_idx'), 8)
+
+    @override_settings(WHATSAPP_USAR_FILA=True)
+    def test_proposta_em_aberto_nao_e_trocada_por_outra(self):
+        terceiro = Paciente.objects.create(nome_completo='Rita Alves', contato_telefone='5511966665555', conta=self.conta)
+        ListaEspera.objects.create(conta=self.conta, paciente=terceiro)
+        primeiro = self.agendar(self.paciente, self.inicio)
+        segundo = self.agendar(self.paciente, self.inicio + timedelta(hours=4))
+        for agendamento in (primeiro, segundo):
+            agendamento.status = 'Cancelado'
+            agendamento.save()
+
+        avisar_lista_espera(primeiro)
+        avisar_lista_espera(segundo)
+        self.assertEqual(TarefaWhatsApp.objects.count(), 2)
+        self.assertEqual(set(ListaEspera.objects.values_list('oferta_inicio', flat=True)), {self.inicio})
+
+        # Vencida a primeira proposta, o segundo horário pode ser oferecido.
+        ListaEspera.objects.update(oferta_expira_em=timezone.now() - timedelta(minutes=1))
+        avisar_lista_espera(segundo)
+        self.assertEqual(TarefaWhatsApp.objects.count(), 4)
+        self.assertEqual(set(ListaEspera.objects.values_list('oferta_inicio', flat=True)), {segundo.data_hora_inicio})
+
+
+class DataPorExtensoTests(SimpleTestCase):
+
+    def test_nomes_em_portugues_sem_depender_do_locale(self):
+        for momento, esperado in [
+            (datetime(2025, 3, 1, 9, 5), "Sábado, 01 de março às 09:05"),
+            (datetime(2025, 10, 20, 14, 30), "Segunda-feira, 20 de outubro às 14:30"),
+        ]:
+            self.assertEqual(data_e_hora_por_extenso(timezone.make_aware(momento)), esperado)
+
+
+def preferencia(dia_semana=None, periodo=None, hora=None, data=None):
+    return PreferenciaHorario(dia_semana=dia_semana, periodo=periodo, hora=hora, data=data)
+
+
+# Quarta-feira: as datas relativas e os dias do mês dos casos abaixo partem daqui.
+HOJE = date(2025, 10, 15)
+
+CASOS_INTERPRETADOR = [
+    # Datas relativas
+    ("hoje", preferencia(2, data='2025-10-15')),
+    ("amanhã", preferencia(3, data='2025-10-16')),
+    ("amanha de manhã", preferencia(3, 'manha', data='2025-10-16')),
+    ("depois de amanhã à tarde", preferencia(4, 'tarde', data='2025-10-17')),
+    ("hoje à noite", preferencia(2, 'noite', data='2025-10-15')),
+    ("amanhã às 10h", preferencia(3, hora='10:00', data='2025-10-16')),
+    ("pode ser amanhã?", preferencia(3, data='2025-10-16')),
+    # Dias da semana
+    ("segunda", preferencia(0)),
+    ("terça-feira", preferencia(1)),
+    ("quarta à tarde", preferencia(2, 'tarde')),
+    ("quinta de manhã", preferencia(3, 'manha')),
+    ("sexta às 10h", preferencia(4, hora='10:00')),
+    ("sábado", preferencia(5)),
+    ("domingo", preferencia(6)),
+    ("seg", preferencia(0)),
+    ("qui às 15:30", preferencia(3, hora='15:30')),
+    ("sexta-feira às 14h", preferencia(4, hora='14:00')),
+    ("na próxima terça", preferencia(1)),
+    ("pode ser na quarta à tarde", preferencia(2, 'tarde')),
+    ("prefiro sexta de manhã", preferencia(4, 'manha')),
+    # Períodos
+    ("de manhã", preferencia(periodo='manha')),
+    ("à tarde", preferencia(periodo='tarde')),
+    ("à noite", preferencia(periodo='noite')),
+    ("de manhãzinha", preferencia(periodo='manha')),
+    ("cedo", preferencia(periodo='manha')),
+    ("no fim da tarde", preferencia(periodo='tarde')),
+    ("depois do almoço", preferencia(periodo='tarde')),
+    ("tardinha", preferencia(periodo='tarde')),
+    ("noitinha", preferencia(periodo='noite')),
+    # Horas: com a hora definida, o período não é repetido
+    ("às 10", preferencia(hora='10:00')),
+    ("às 3", preferencia(hora='15:00')),
+    ("às dez e meia", preferencia(hora='10:30')),
+    ("às 9:30", preferencia(hora='09:30')),
+    ("às 14h30", preferencia(hora='14:30')),
+    ("10h", preferencia(hora='10:00')),
+    ("16 horas", preferencia(hora='16:00')),
+    ("meio dia", preferencia(hora='12:00')),
+    ("meio dia e meia", preferencia(hora='12:30')),
+    ("umas 5 da tarde", preferencia(hora='17:00')),
+    ("por volta das 8 da manhã", preferencia(hora='08:00')),
+    ("às 8 da noite", preferencia(hora='20:00')),
+    ("lá pelas duas", preferencia(hora='14:00')),
+    # Datas
+    ("dia 20", preferencia(0, data='2025-10-20')),
+    ("dia 15", preferencia(2, data='2025-10-15')),
+    ("dia 10", preferencia(0, data='2025-11-10')),
+    ("dia 31", preferencia(4, data='2025-10-31')),
+    ("20/10", preferencia(0, data='2025-10-20')),
+    ("20/10/2025", preferencia(0, data='2025-10-20')),
+    ("5/1", preferencia(0, data='2026-01-05')),
+    ("15 de novembro", preferencia(5, data='2025-11-15')),
+    ("dia 3 de dezembro", preferencia(2, data='2025-12-03')),
+    ("sexta, dia 17", preferencia(4, data='2025-10-17')),
+    # Frases completas com cumprimentos e palavras neutras
+    ("quero marcar uma consulta na sexta à tarde", preferencia(4, 'tarde')),
+    ("bom dia! teria horário amanhã às 9?", preferencia(3, hora='09:00', data='2025-10-16')),
+    ("oi, gostaria de agendar para quinta de manhã, obrigado", preferencia(3, 'manha')),
+    # Datas e horas inválidas
+    ("sexta, dia 18", None),
+    ("dia 32", None),
+    ("31/02", None),
+    ("às 25h", None),
+    # Ambíguas: mais de uma opção do mesmo tipo
+    ("segunda ou terça", None),
+    ("às 10 ou às 11", None),
+    ("de manhã ou à tarde", None),
+    ("amanhã ou depois de amanhã", None),
+    # Negações e outros assuntos ficam com a Gemini
+    ("na quarta, meu filho tem aula de manhã", None),
+    ("não posso na segunda", None),
+    ("segunda não dá", None),
+    ("qualquer dia menos sexta", None),
+    # Sem preferência de horário
+    ("oi", None),
+    ("bom dia", None),
+    ("olá, tudo bem?", None),
+    ("quero agendar", None),
+    ("obrigado", None),
+    ("sim", None),
+    ("a segunda opção", None),
+    ("a primeira", None),
+    ("2", None),
+    # Vazias
+    ("", None),
+    ("   ", None),
+    ("?!", None),
+]
+
+
+class InterpretadorHorariosTests(TestCase):
+
+    def test_casos(self):
+        for mensagem, esperado in CASOS_INTERPRETADOR:
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(interpretar_preferencias(mensagem, hoje=HOJE), esperado)
+
+    def test_palpite_ignora_as_outras_palavras(self):
+        self.assertEqual(
+            interpretar_preferencias("na quarta, meu filho tem aula de manhã", hoje=HOJE, estrito=False),
+            preferencia(2, 'manha'),
+        )
+        self.assertIsNone(interpretar_preferencias("quero agendar", hoje=HOJE, estrito=False))
+
+
+class EscolhaHorarioTests(SimpleTestCase):
+    """ Segunda às 09:00, quinta às 14:00 e quinta às 16:00 da próxima semana. """
+
+    def setUp(self):
+        hoje = timezone.localdate()
+        def proxima(dia_semana, hora):
+            dia = hoje + timedelta(days=7 + dia_semana - hoje.weekday())
+            inicio = timezone.make_aware(datetime.combine(dia, time(hora)))
+            return {'inicio': inicio, 'fim': inicio + timedelta(hours=1), 'profissional_id': 1}
+        self.segunda_9, self.quinta_14, self.quinta_16 = self.horarios = [proxima(0, 9), proxima(3, 14), proxima(3, 16)]
+
+    def test_numero_e_ordinal(self):
+        for mensagem, esperado in [
+            ("1", self.segunda_9), ("opção 2", self.quinta_14), ("número 3", self.quinta_16),
+            ("a primeira", self.segunda_9), ("o último", self.quinta_16), ("2ª opção", self.quinta_14),
+        ]:
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(resolver_escolha(mensagem, self.horarios), (esperado, False))
+
+    def test_dia_e_hora(self):
+        for mensagem, esperado in [
+            ("às 16h", (self.quinta_16, False)),
+            ("quinta às 14h", (self.quinta_14, False)),
+            ("segunda de manhã", (self.segunda_9, False)),
+            ("quinta", (None, True)),
+            ("sábado", (None, False)),
+            ("tanto faz", (None, False)),
+            # "a 3" também é "às 3 (15h)": sem horário às 15h, a Gemini decide.
+            ("pode ser a 3", (None, True)),
+        ]:
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(resolver_escolha(mensagem, self.horarios), esperado)
+
+    def test_segunda_pode_ser_o_dia_ou_a_posicao(self):
+        # Há horário na segunda-feira e ele não é a 2ª opção: a Gemini decide.
+        self.assertEqual(resolver_escolha("a segunda", self.horarios), (None, True))
+        self.assertEqual(resolver_escolha("a segunda opção", self.horarios), (self.quinta_14, False))
+        self.assertEqual(resolver_escolha("a segunda", self.horarios[1:]), (self.quinta_16, False))
+
+    def test_lista_numerada_em_portugues(self):
+        linhas = formatar_horarios_numerados([horario['inicio'] for horario in self.horarios]).split("\n")
+        dia = timezone.localtime(self.segunda_9['inicio']).day
+        self.assertEqual(linhas[0], f"1. Segunda-feira, dia {dia:02d}, às 09:00")
+        self.assertTrue(linhas[2].startswith("3. Quinta-feira, dia ") and linhas[2].endswith(", às 16:00"))
+
+
+class VersaoCalendarioTests(DadosAgendaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        inicio = self.as_horas(self.amanha, 10)
+        self.agendamento = Agendamento.objects.create(
+            paciente=self.paciente, profissional=self.profissional, titulo='Consulta',
+            data_hora_inicio=inicio, data_hora_fim=inicio + timedelta(hours=1),
+        )
+        self.excecao = ExcecaoHorario.objects.create(profissional=self.profissional, data=self.amanha, descricao='Congresso')
+
+    def versao(self):
+        self.profissional.refresh_from_db()
+        return versao_calendario(self.profissional)
+
+    def assertVersaoAvancou(self, alterar):
+        etag, ultima_modificacao = self.versao()
+        alterar()
+        novo_etag, nova_ultima_modificacao = self.versao()
+        self.assertNotEqual(novo_etag, etag)
+        self.assertGreater(nova_ultima_modificacao, ultima_modificacao)
+
+    def test_cancelamento_muda_a_versao(self):
+        def cancelar():
+            self.agendamento.status = 'Cancelado'
+            self.agendamento.save()
+        self.assertVersaoAvancou(cancelar)
+
+    def test_exclusao_de_agendamento_muda_a_versao(self):
+        self.assertVersaoAvancou(self.agendamento.delete)
+
+    def test_edicao_e_exclusao_de_excecao_mudam_a_versao(self):
+        def editar():
+            self.excecao.descricao = 'Férias'
+            self.excecao.save()
+        self.assertVersaoAvancou(editar)
+        self.assertVersaoAvancou(self.excecao.delete)
+
+    def test_feed_responde_304_so_para_a_versao_atual(self):
+        url = f'/api/agenda/{self.profissional.token_calendario}/calendario.ics'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.agendamento.delete()
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+
+class RespostaInvalidaDaGeminiTests(DadosAgendaMixin, TestCase):
+
+    async def test_resposta_fora_do_esquema_oferece_atendente(self):
+        gemini = mock.AsyncMock(return_value='{"intencao": "INEXISTENTE"}')
+        with mock.patch('apps.agenda.ia_manager.genai.Client'), \
+                mock.patch('apps.agenda.ia_manager.identificar_intencao_faq', mock.AsyncMock(return_value=None)), \
+                mock.patch.object(GeminiAIManager, '_generate_content', gemini), \
+                mock.patch('apps.agenda.atendimento.responder_paciente_via_whatsapp_async', return_value=True) as enviar:
+            resultado = await AtendimentoWhatsApp().processar_mensagem(
+                '5511988887777', '5511999990000', 'meu convênio mudou e queria saber como fica'
+            )
+
+        self.assertEqual(resultado['status'], 'encaminhado_humano')
+        self.assertEqual(gemini.await_count, 2)
+        enviar.assert_awaited_once_with('5511988887777', MODELOS_PADRAO['encaminhamento_humano'])
+
+
+class AlternativasDaReservaTests(DadosAgendaMixin, TestCase):
+
+    async def test_alternativas_seguem_a_preferencia_do_paciente(self):
+        with mock.patch('apps.agenda.ia_manager.genai.Client'), \
+                mock.patch.object(GeminiAIManager, '_generate_content', mock.AsyncMock(return_value='Horários')), \
+                mock.patch.object(AtendimentoWhatsApp, '_iniciar_busca_especulativa', mock.AsyncMock(return_value=None)), \
+                mock.patch('apps.agenda.atendimento.responder_paciente_via_whatsapp_async', return_value=True):
+            resultado = await AtendimentoWhatsApp().processar_mensagem('5511988887777', '5511999990000', 'quinta à tarde')
+            self.assertEqual(resultado['status'], 'horarios_enviados')
+
+            # Outro paciente é agendado pela secretaria no primeiro horário oferecido.
+            primeiro = (await cache.aget(f"horarios_oferecidos_{self.paciente.pk}"))[0]
+            outro = await Paciente.objects.acreate(nome_completo='Maria Lima', contato_telefone='5511977776666', conta=self.conta)
+            await Agendamento.objects.acreate(
+                paciente=outro, profissional=self.profissional, titulo='Consulta',
+                data_hora_inicio=primeiro['inicio'], data_hora_fim=primeiro['fim'],
+            )
+
+            resultado = await AtendimentoWhatsApp().processar_mensagem('5511988887777', '5511999990000', '1')
+        self.assertEqual(resultado['status'], 'horario_indisponivel')
+
+        alternativas = await cache.aget(f"horarios_oferecidos_{self.paciente.pk}")
+        self.assertTrue(alternativas)
+        for horario in alternativas:
+            inicio = timezone.localtime(horario['inicio'])
+            self.assertEqual(inicio.weekday(), 3)
+            self.assertGreaterEqual(inicio.hour, 12)
+            self.assertNotEqual(horario['inicio'], primeiro['inicio'])
+
+
+@override_settings(WHATSAPP_USAR_FILA=True)
+class WebhookMessageSidTests(DadosAgendaMixin, TestCase):
+    dados = {'From': 'whatsapp:+5511988887777', 'To': 'whatsapp:+5511999990000', 'Body': 'oi', 'MessageSid': 'SM123'}
+
+    def test_falha_ao_enfileirar_libera_a_repeticao(self):
+        with mock.patch('apps.agenda.views.enfileirar_mensagem', side_effect=RuntimeError('banco indisponível')):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/whatsapp/webhook/', self.dados)
+        self.assertFalse(MensagemRecebidaWhatsApp.objects.exists())
+
+        resposta = self.client.post('/api/whatsapp/webhook/', self.dados).json()
+        self.assertEqual(resposta['status'], 'enfileirado')
+        self.assertEqual(TarefaWhatsApp.objects.count(), 1)
+
+        repeticao = self.client.post('/api/whatsapp/webhook/', self.dados).json()
+        self.assertTrue(repeticao['duplicada'])
+        self.assertEqual(TarefaWhatsApp.objects.count(), 1)
+
+
+def indice_faq_padrao():
+    indice = IndiceFAQ()
+    for categoria in DEFAULT_FAQ_STRUCTURE:
+        for item in categoria['itens']:
+            indice.adicionar_item(ItemFAQ(**item))
+    return indice
+
+
+class IndiceFAQTests(SimpleTestCase):
+
+    def test_pergunta_coberta_encontra_a_intencao(self):
+        indice = indice_faq_padrao()
+        for mensagem, intencao in [
+            ("Vocês aceitam pix?", 'detalhes_pagamento'),
+            ("qual o endereço da clínica?", 'localizacao_contato'),
+            ("aceitam convênio?", 'verificar_convenios'),
+            ("preciso levar exames?", 'preparacao_consulta'),
+        ]:
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(indice.buscar(mensagem)[0], intencao)
+
+    def test_mensagem_pouco_coberta_fica_com_a_gemini(self):
+        indice = indice_faq_padrao()
+        for mensagem in ["meu convênio mudou e queria saber como fica", "quero agendar", "como funciona?", "oi", ""]:
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(indice.buscar(mensagem), (None, 0.0))
+
+    def test_empate_entre_intencoes_nao_decide(self):
+        indice = IndiceFAQ()
+        indice.adicionar_item(ItemFAQ(intencao_chave='valor_consulta', perguntas_exemplo='Qual o valor da consulta?'))
+        indice.adicionar_item(ItemFAQ(intencao_chave='valor_retorno', perguntas_exemplo='Qual o valor do retorno?; Qual o valor da consulta de retorno?'))
+        self.assertIsNone(indice.buscar("valor da consulta")[0])
+
+
+class VersaoIndiceFAQTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        proprietario = Profissional.objects.create_user('faq@teste.com', 'senha', nome_completo='Ana Souza')
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Clínica FAQ', proprietario=proprietario)])
+        cls.categoria = CategoriaFAQ.objects.create(conta=cls.conta, nome='Pagamentos')
+        with cls.captureOnCommitCallbacks(execute=True):
+            ItemFAQ.objects.create(
+                conta=cls.conta, categoria=cls.categoria, intencao_chave='detalhes_pagamento',
+                perguntas_exemplo='Aceitam Pix?; Posso pagar com cartão?', resposta='Aceitamos Pix e cartão.',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def buscar(self, mensagem):
+        return async_to_sync(identificar_intencao_faq)(mensagem, self.conta.pk)
+
+    def criar_item_estacionamento(self):
+        return ItemFAQ.objects.create(
+            conta=self.conta, categoria=self.categoria, intencao_chave='estacionamento',
+            perguntas_exemplo='Tem estacionamento?', resposta='Sim, no subsolo.',
+        )
+
+    def test_item_novo_entra_no_indice_depois_do_commit(self):
+        self.assertIsNone(self.buscar("tem estacionamento?"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_item_estacionamento()
+        self.assertEqual(self.buscar("tem estacionamento?"), 'estacionamento')
+
+    def test_rollback_nao_deixa_item_fantasma(self):
+        indice = async_to_sync(obter_indice_faq)(self.conta.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.criar_item_estacionamento()
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertIs(async_to_sync(obter_indice_faq)(self.conta.pk), indice)
+        self.assertIsNone(self.buscar("tem estacionamento?"))
+
+    def test_alteracao_em_outro_processo_reconstroi_o_indice(self):
+        self.assertEqual(self.buscar("aceitam pix?"), 'detalhes_pagamento')
+        # Outro processo altera o item: aqui só chega a versão nova no Redis.
+        ItemFAQ.objects.filter(conta=self.conta).update(intencao_chave='formas_pagamento')
+        incrementar_versao(f"indice_faq_versao_{self.conta.pk}")
+        self.assertEqual(self.buscar("aceitam pix?"), 'formas_pagamento')
+
+    def test_versao_descartada_do_redis_nao_volta_a_um_valor_antigo(self):
+        chave = f"indice_faq_versao_{self.conta.pk}"
+        versoes = {async_to_sync(ler_versao)(chave), incrementar_versao(chave), incrementar_versao(chave)}
+        self.assertEqual(len(versoes), 3)
+        cache.delete(chave)
+        self.assertGreater(async_to_sync(ler_versao)(chave), max(versoes))
+
+
+class CacheRespostasIATests(SimpleTestCase):
+
+    def test_descarta_o_item_usado_ha_mais_tempo(self):
+        respostas = CacheRespostasIA(tamanho_maximo=2)
+        respostas.guardar('a', 'A', 60)
+        respostas.guardar('b', 'B', 60)
+        respostas.obter('a')
+        respostas.guardar('c', 'C', 60)
+        self.assertEqual(list(respostas.itens), ['a', 'c'])
+        self.assertIsNone(respostas.obter('b'))
+
+    def test_item_vencido_nao_e_devolvido(self):
+        respostas = CacheRespostasIA()
+        with mock.patch('apps.agenda.cache_respostas_ia.time.monotonic', return_value=1000.0):
+            respostas.guardar('faq', 'Aceitamos Pix.', 60)
+        with mock.patch('apps.agenda.cache_respostas_ia.time.monotonic', return_value=1059.0):
+            self.assertEqual(respostas.obter('faq'), 'Aceitamos Pix.')
+        with mock.patch('apps.agenda.cache_respostas_ia.time.monotonic', return_value=1060.0):
+            self.assertIsNone(respostas.obter('faq'))
+        self.assertNotIn('faq', respostas.itens)
+        self.assertEqual(respostas.estatisticas, {'acertos': 1, 'falhas': 1})
+
+
+class RespostasGeminiEmCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user('respostas@teste.com', 'senha', nome_completo='Ana Souza')
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Clínica Respostas', proprietario=cls.profissional)])
+        cls.profissional.conta = cls.conta
+        cls.profissional.save()
+        cls.perfil = PerfilClinica.objects.create(conta=cls.conta)
+
+    def setUp(self):
+        cache.clear()
+        respostas_ia.limpar()
+        patcher = mock.patch('apps.agenda.ia_manager.genai.Client')
+        self.gemini = mock.AsyncMock(return_value=mock.Mock(text='Aceitamos Pix e cartão.'))
+        patcher.start().return_value.aio.models.generate_content = self.gemini
+        self.addCleanup(patcher.stop)
+
+    def perguntar(self, prompt='Responda: aceitam Pix?'):
+        return async_to_sync(GeminiAIManager(self.profissional)._generate_content)(prompt, tipo_cache='faq')
+
+    def test_prompt_repetido_nao_chama_a_gemini(self):
+        self.assertEqual(self.perguntar(), 'Aceitamos Pix e cartão.')
+        self.assertEqual(self.perguntar('Responda:   aceitam Pix? '), 'Aceitamos Pix e cartão.')
+        self.assertEqual(self.gemini.await_count, 1)
+
+    def test_alteracao_do_perfil_invalida_depois_do_commit(self):
+        self.perguntar()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perfil.save()
+        self.perguntar()
+        self.assertEqual(self.gemini.await_count, 2)
+
+    def test_alteracao_desfeita_mantem_as_respostas(self):
+        self.perguntar()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.perfil.save()
+                raise RuntimeError
+        self.perguntar()
+        self.assertEqual(self.gemini.await_count, 1)
+
+
+class ContextoContaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        profissional = Profissional.objects.create_user('contexto@teste.com', 'senha', nome_completo='Ana Souza')
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Clínica Contexto', proprietario=profissional)])
+        profissional.conta = cls.conta
+        profissional.save()
+        PerfilClinica.objects.create(conta=cls.conta)
+        HorarioTrabalho.objects.create(profissional=profissional, dia_da_semana=0, hora_inicio=time(9), hora_fim=time(17))
+
+    def setUp(self):
+        cache.clear()
+
+    def contexto(self):
+        return async_to_sync(obter_contexto_conta)(self.conta.pk)
+
+    def test_retrato_em_cache_nao_consulta_o_banco(self):
+        contexto = self.contexto()
+        self.assertEqual(contexto['horarios_funcionamento'], " Segunda-feira das 09:00 às 17:00;")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contexto()['equipe'], ['Ana Souza'])
+
+    def test_modelo_de_mensagem_entra_no_retrato_depois_do_commit(self):
+        self.contexto()
+        with self.captureOnCommitCallbacks() as callbacks:
+            ModeloMensagem.objects.create(conta=self.conta, chave='pergunta_nome_completo', texto='Qual é o seu nome completo?')
+            # Antes do commit o retrato continua o mesmo para quem o ler.
+            self.assertEqual(self.contexto()['modelos_mensagem'], {})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            self.contexto()['modelos_mensagem'], {'pergunta_nome_completo': ('Qual é o seu nome completo?', False)}
+        )
+
+    def test_alteracao_desfeita_mantem_o_retrato(self):
+        self.contexto()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                ModeloMensagem.objects.create(conta=self.conta, chave='pergunta_nome_completo', texto='Seu nome?')
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contexto()['modelos_mensagem'], {})
+
+
+@override_settings(WHATSAPP_USAR_FILA=True)
+class AtualizacaoStatusEmLoteTests(DadosAgendaMixin, TestCase):
+    url = '/api/agendamentos/atualizar-status-em-lote/'
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.profissional)
+        self.servico = Servico.objects.create(conta=self.conta, nome_servico='Sessão', duracao_padrao=60, valor_padrao='150.00')
+
+    def sessoes(self, dia, horas, paciente=None, **campos):
+        return [
+            Agendamento.objects.create(
+                paciente=paciente or self.paciente, profissional=self.profissional, titulo='Sessão',
+                data_hora_inicio=self.as_horas(dia, hora), data_hora_fim=self.as_horas(dia, hora + 1), **campos
+            )
+            for hora in horas
+        ]
+
+    def test_realizado_cria_transacao_so_de_quem_paga_por_sessao(self):
+        ontem = self.amanha - timedelta(days=2)
+        mensalista = Paciente.objects.create(nome_completo='Rita Alves', dia_cobranca=10, conta=self.conta)
+        cobrar, = self.sessoes(ontem, [8], servico=self.servico)
+        sem_servico, = self.sessoes(ontem, [9])
+        ja_cobrado, = self.sessoes(ontem, [10], servico=self.servico)
+        Transacao.objects.create(
+            profissional=self.profissional, paciente=self.paciente, agendamento=ja_cobrado,
+            servico_prestado=self.servico, valor_cobrado='150.00',
+        )
+        do_mensalista, = self.sessoes(ontem, [11], paciente=mensalista, servico=self.servico)
+
+        resposta = self.cliente.post(self.url, {'status': 'Realizado', 'data_inicio': ontem.isoformat()}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['atualizados'], 4)
+        self.assertEqual(resposta.json()['transacoes_criadas'], 1)
+        self.assertEqual(
+            list(Transacao.objects.order_by('id').values_list('agendamento_id', 'valor_cobrado', 'status')),
+            [(ja_cobrado.pk, Decimal('150.00'), 'pendente'), (cobrar.pk, Decimal('150.00'), 'pendente')],
+        )
+        self.assertEqual(set(Agendamento.objects.values_list('status', flat=True)), {'Realizado'})
+
+        repetida = self.cliente.post(self.url, {'status': 'Realizado', 'ids': [cobrar.pk, sem_servico.pk, do_mensalista.pk]}, format='json')
+        self.assertEqual(repetida.json(), {'atualizados': 0, 'ids': [], 'transacoes_criadas': 0})
+
+    def test_periodo_e_ids_sao_validados(self):
+        for dados in [{'status': 'Cancelado'}, {'status': 'Cancelado', 'data_fim': '2025-10-15'},
+                      {'status': 'Cancelado', 'data_inicio': '2025-10-15', 'data_fim': '2025-10-14'},
+                      {'status': 'Inexistente', 'ids': [1]}]:
+            with self.subTest(dados=dados):
+                self.assertEqual(self.cliente.post(self.url, dados, format='json').status_code, 400)
+
+    def esperando(self, quantidade):
+        pacientes = [
+            Paciente.objects.create(nome_completo=f'Paciente {n}', contato_telefone=f'55119000000{n:02d}', conta=self.conta)
+            for n in range(quantidade)
+        ]
+        for paciente in pacientes:
+            ListaEspera.objects.create(conta=self.conta, paciente=paciente)
+        return pacientes
+
+    def test_cancelar_o_dia_oferece_um_horario_diferente_a_cada_paciente(self):
+        sessoes = self.sessoes(self.amanha, [9, 10, 11])
+        pacientes = self.esperando(4)
+
+        resposta = self.cliente.post(self.url, {'status': 'Cancelado', 'data_inicio': self.amanha.isoformat()}, format='json')
+        self.assertEqual(resposta.json()['atualizados'], 3)
+
+        ofertas = dict(ListaEspera.objects.values_list('paciente_id', 'oferta_inicio'))
+        inicios = [sessao.data_hora_inicio for sessao in sessoes]
+        # Um paciente por horário, na ordem de inscrição; o quarto fica com o primeiro horário.
+        self.assertEqual([ofertas[paciente.pk] for paciente in pacientes], inicios + inicios[:1])
+        self.assertEqual(TarefaWhatsApp.objects.filter(tipo='envio').count(), 4)
+        self.assertEqual(
+            sorted(TarefaWhatsApp.objects.values_list('telefone', flat=True)),
+            sorted(paciente.contato_telefone for paciente in pacientes),
+        )
+
+    def test_consultas_nao_crescem_com_o_numero_de_cancelados(self):
+        self.esperando(10)
+        consultas = []
+        for dia, horas in [(self.amanha, [9, 10]), (self.amanha + timedelta(days=1), [9, 10, 11, 12, 13])]:
+            self.sessoes(dia, horas)
+            with CaptureQueriesContext(connection) as capturadas:
+                self.cliente.post(self.url, {'status': 'Cancelado', 'data_inicio': dia.isoformat()}, format='json')
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+
+
+class PrioridadeMensagemTests(TestCase):
+    """ Respostas curtas só passam na frente quando o remetente tem algo a responder na conta. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'beatriz@teste.com', 'senha', nome_completo='Beatriz Lima', funcao='proprietario'
+        )
+        outro_proprietario = Profissional.objects.create_user(
+            'eduardo@teste.com', 'senha', nome_completo='Eduardo Reis', funcao='proprietario'
+        )
+        cls.conta, cls.outra_conta = Conta.objects.bulk_create([
+            Conta(nome_conta='Clínica Centro', proprietario=cls.profissional, whatsapp_number='5521911110000'),
+            Conta(nome_conta='Clínica Norte', proprietario=outro_proprietario, whatsapp_number='5521922220000'),
+        ])
+        cls.paciente = Paciente.objects.create(nome_completo='Carla Dias', contato_telefone='5521977776666', conta=cls.conta)
+        cls.paciente_outra_conta = Paciente.objects.create(
+            nome_completo='Carla Dias', contato_telefone='5521977776666', conta=cls.outra_conta
+        )
+
+    def prioridade(self, corpo):
+        return async_to_sync(prioridade_da_mensagem)('5521977776666', '5521911110000', corpo)
+
+    def segurar_horario(self, paciente, expira_em):
+        inicio = timezone.now() + timedelta(days=1)
+        ReservaTemporaria.objects.create(
+            profissional=self.profissional, paciente=paciente, data_hora_inicio=inicio,
+            data_hora_fim=inicio + timedelta(hours=1), expira_em=expira_em,
+        )
+
+    def test_resposta_a_campanha_fica_com_prioridade_normal(self):
+        for corpo in ["ok", "sim", "pode ser", "Oi, ok obrigado", "2"]:
+            with self.subTest(corpo=corpo):
+                self.assertEqual(self.prioridade(corpo), PRIORIDADE_NORMAL)
+
+    def test_escolha_entre_horarios_segurados_e_prioritaria(self):
+        self.segurar_horario(self.paciente, timezone.now() + timedelta(minutes=10))
+        for corpo in ["2", "pode ser", "a primeira"]:
+            with self.subTest(corpo=corpo):
+                self.assertEqual(self.prioridade(corpo), PRIORIDADE_ALTA)
+        self.assertEqual(self.prioridade("qual o endereço?"), PRIORIDADE_NORMAL)
+
+    def test_reserva_vencida_ou_de_outra_conta_nao_conta(self):
+        self.segurar_horario(self.paciente, timezone.now() - timedelta(minutes=1))
+        self.segurar_horario(self.paciente_outra_conta, timezone.now() + timedelta(minutes=10))
+        self.assertEqual(self.prioridade("pode ser"), PRIORIDADE_NORMAL)
+
+    def test_resposta_ao_lembrete_e_prioritaria(self):
+        inicio = timezone.now() + timedelta(days=1)
+        Agendamento.objects.create(
+            profissional=self.profissional, paciente=self.paciente, data_hora_inicio=inicio,
+            data_hora_fim=inicio + timedelta(hours=1), lembrete_enviado=True,
+        )
+        self.assertEqual(self.prioridade("sim"), PRIORIDADE_ALTA)
+
+    def test_pedido_de_agendamento_e_prioritario_pelo_texto(self):
+        for corpo in ["quero agendar uma consulta", "tem horário amanhã às 10h?"]:
+            with self.subTest(corpo=corpo):
+                self.assertEqual(self.prioridade(corpo), PRIORIDADE_ALTA)
+
+
+class EscalonamentoContasTests(TestCase):
+    """ Divisão das reivindicações entre contas com pesos e limites diferentes. """
+
+    @classmethod
+    def setUpTestData(cls):
+        proprietarios = [
+            Profissional.objects.create_user(email, 'senha', nome_completo=nome, funcao='proprietario')
+            for email, nome in [('diego@teste.com', 'Diego Rocha'), ('fernanda@teste.com', 'Fernanda Alves')]
+        ]
+        cls.grande, cls.pequena = Conta.objects.bulk_create([
+            Conta(nome_conta='Rede Grande', proprietario=proprietarios[0], whatsapp_number='5531900000001'),
+            Conta(nome_conta='Consultório Pequeno', proprietario=proprietarios[1], whatsapp_number='5531900000002'),
+        ])
+        premium = Plano.objects.create(nome='PREMIUM', preco_mensal=0, peso_fila=3, limite_atendimentos_simultaneos=10)
+        basico = Plano.objects.create(nome='BASICO', preco_mensal=0, peso_fila=1, limite_atendimentos_simultaneos=1)
+        Assinatura.objects.create(conta=cls.grande, plano=premium)
+        Assinatura.objects.create(conta=cls.pequena, plano=basico)
+
+    def enfileirar(self, conta, quantidade, prioridade=PRIORIDADE_NORMAL):
+        inicio = TarefaWhatsApp.objects.count()
+        TarefaWhatsApp.objects.bulk_create([
+            TarefaWhatsApp(telefone=f'55319{inicio + i:08d}', destinatario=conta.whatsapp_number, corpo='oi', prioridade=prioridade)
+            for i in range(quantidade)
+        ])
+
+    def test_rodizio_segue_o_peso_do_plano(self):
+        self.enfileirar(self.grande, 8)
+        self.enfileirar(self.pequena, 8)
+        escalonador = EscalonadorContas()
+        contas = []
+        for _ in range(8):
+            tarefa = reivindicar_tarefa(escalonador)
+            contas.append(tarefa.destinatario)
+            concluir_tarefa(tarefa, resultado='ok')
+        self.assertEqual(contas.count(self.grande.whatsapp_number), 6)
+        self.assertEqual(contas.count(self.pequena.whatsapp_number), 2)
+
+    def test_prioridade_alta_passa_na_frente_das_outras_contas(self):
+        self.enfileirar(self.grande, 5)
+        self.enfileirar(self.pequena, 1, prioridade=PRIORIDADE_ALTA)
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()).destinatario, self.pequena.whatsapp_number)
+
+    def test_limite_e_conferido_na_reivindicacao(self):
+        """ Mesmo com uma ordem desatualizada (outro worker reivindicou depois da contagem), o limite vale. """
+        class OrdemDesatualizada(EscalonadorContas):
+            def ordenar_contas(self, elegiveis):
+                return [self.pequena, self.grande]
+
+        escalonador = OrdemDesatualizada()
+        escalonador.pequena, escalonador.grande = self.pequena.whatsapp_number, self.grande.whatsapp_number
+        self.enfileirar(self.pequena, 2)
+        self.enfileirar(self.grande, 1)
+
+        self.assertEqual(reivindicar_tarefa(escalonador).destinatario, self.pequena.whatsapp_number)
+        self.assertEqual(reivindicar_tarefa(escalonador).destinatario, self.grande.whatsapp_number)
+        self.assertIsNone(reivindicar_tarefa(escalonador))
+        self.assertEqual(
+            TarefaWhatsApp.objects.filter(destinatario=self.pequena.whatsapp_number, status='processando').count(), 1
+        )
+
+
+@mock.patch.dict('os.environ', {
+    'TWILIO_ACCOUNT_SID': 'AC123', 'TWILIO_AUTH_TOKEN': 'token', 'TWILIO_WHATSAPP_NUMBER': '+5511900000000',
+})
+class ClienteTwilioAsyncTests(SimpleTestCase):
+
+    def test_um_cliente_por_event_loop(self):
+        async def enviar_varias():
+            enviados = [await responder_paciente_via_whatsapp_async(f'551198888000{n}', 'Olá') for n in range(3)]
+            await fechar_cliente_twilio_async()
+            return enviados
+
+        with mock.patch('apps.agenda.whatsapp.AsyncTwilioHttpClient') as http_client, \
+                mock.patch('apps.agenda.whatsapp.Client') as client:
+            client.return_value.messages.create_async = mock.AsyncMock(return_value=mock.Mock(sid='SM1'))
+            client.return_value.http_client = http_client.return_value
+            http_client.return_value.close = mock.AsyncMock()
+            self.assertEqual(asyncio.run(enviar_varias()), [True, True, True])
+            self.assertEqual(asyncio.run(enviar_varias()), [True, True, True])
+
+        # Cada asyncio.run é um event loop novo: dois clientes, cada um com três envios e fechado ao final.
+        self.assertEqual(http_client.call_count, 2)
+        self.assertEqual(client.return_value.messages.create_async.await_count, 6)
+        self.assertEqual(http_client.return_value.close.await_count, 2)
+
+
+class CargaAtendimentoWhatsAppTests(TestCase):
+    """
+    Atendimentos simultâneos com a Gemini e a Twilio simuladas por esperas fixas: com o
+    atendimento assíncrono, o tempo total deve cair com a concorrência.
+    """
+    MENSAGENS = 20
+    LATENCIA_GEMINI = 0.05
+    LATENCIA_ENVIO = 0.01
+    # Mensagem que as regras locais não classificam, para que todas passem pela Gemini simulada.
+    MENSAGEM = 'queria tirar uma dúvida'
+    ANALISE = '{"intencao": "SAUDACAO", "dia_semana": null, "periodo": null, "hora": null, "horario_escolhido": null}'
+
+    @classmethod
+    def setUpTestData(cls):
+        proprietario = Profissional.objects.create_user(
+            'gabriel@teste.com', 'senha', nome_completo='Gabriel Nunes', funcao='proprietario'
+        )
+        cls.conta, = Conta.objects.bulk_create([
+            Conta(nome_conta='Clínica Carga', proprietario=proprietario, whatsapp_number='5541933330000')
+        ])
+        PerfilClinica.objects.create(conta=cls.conta)
+        cls.telefones = [f'55419{n:08d}' for n in range(cls.MENSAGENS)]
+        Paciente.objects.bulk_create([
+            Paciente(conta=cls.conta, nome_completo=f'Paciente {n}', contato_telefone=telefone)
+            for n, telefone in enumerate(cls.telefones)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    async def _rodada(self, concorrencia):
+        vagas = asyncio.Semaphore(concorrencia)
+        atendimento = AtendimentoWhatsApp()
+
+        async def atender(telefone):
+            async with vagas:
+                return await atendimento.processar_mensagem(telefone, self.conta.whatsapp_number, self.MENSAGEM)
+
+        inicio = perf_counter()
+        resultados = await asyncio.gather(*(atender(telefone) for telefone in self.telefones))
+        return perf_counter() - inicio, resultados
+
+    async def test_concorrencia_reduz_o_tempo_total(self):
+        async def gemini(*args, **kwargs):
+            await asyncio.sleep(self.LATENCIA_GEMINI)
+            return self.ANALISE
+
+        async def envio(numero, mensagem):
+            await asyncio.sleep(self.LATENCIA_ENVIO)
+            return True
+
+        with mock.patch('apps.agenda.ia_manager.genai.Client'), \
+                mock.patch('apps.agenda.ia_manager.identificar_intencao_faq', mock.AsyncMock(return_value=None)), \
+                mock.patch.object(GeminiAIManager, '_generate_content', side_effect=gemini), \
+                mock.patch('apps.agenda.atendimento.responder_paciente_via_whatsapp_async', side_effect=envio):
+            sequencial, resultados = await self._rodada(1)
+            paralelo, _ = await self._rodada(50)
+
+        self.assertFalse([r for r in resultados if r['status'] == 'erro_geral'])
+        # Em sequência, cada mensagem espera pelo menos a Gemini e o envio simulados.
+        self.assertGreaterEqual(sequencial, self.MENSAGENS * (self.LATENCIA_GEMINI + self.LATENCIA_ENVIO))
+        self.assertLess(paralelo, sequencial / 4)
+
+
+class SerieRecorrenteTests(TestCase):
+    """ Profissional de segunda a sexta, das 09:00 às 17:00, com 15 minutos entre as sessões. """
+    url = '/api/agendamentos/serie/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'helena@teste.com', 'senha', nome_completo='Helena Prado', funcao='proprietario'
+        )
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Espaço Helena', proprietario=cls.profissional)])
+        PerfilClinica.objects.create(conta=cls.conta, intervalo_entre_sessoes=15)
+        cls.profissional.conta = cls.conta
+        cls.profissional.save()
+        cls.paciente = Paciente.objects.create(nome_completo='Igor Martins', contato_telefone='5561944443333', conta=cls.conta)
+        for dia_da_semana in range(5):
+            HorarioTrabalho.objects.create(
+                profissional=cls.profissional, dia_da_semana=dia_da_semana, hora_inicio=time(9), hora_fim=time(17)
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.profissional)
+        hoje = timezone.localdate()
+        self.segunda = hoje + timedelta(days=7 - hoje.weekday())
+
+    def as_horas(self, dia, hora, minuto=0):
+        return timezone.make_aware(datetime.combine(dia, time(hora, minuto)))
+
+    def criar(self, hora, **dados):
+        return self.cliente.post(self.url, {
+            'paciente': self.paciente.pk, 'titulo': 'Terapia', 'frequencia': 'semanal', 'quantidade': 4,
+            'data_hora_inicio': self.as_horas(self.segunda, hora), 'data_hora_fim': self.as_horas(self.segunda, hora + 1),
+            **dados,
+        }, format='json')
+
+    def test_ocorrencias_puladas_e_data_limite(self):
+        inicio = self.as_horas(self.segunda, 10)
+        ocorrencias = gerar_ocorrencias(
+            inicio, inicio + timedelta(hours=1), 'quinzenal',
+            data_limite=self.segunda + timedelta(weeks=8), pular=[self.segunda + timedelta(weeks=4)],
+        )
+        self.assertEqual(
+            [timezone.localtime(o).date() for o, _ in ocorrencias],
+            [self.segunda + timedelta(weeks=n) for n in (0, 2, 6, 8)],
+        )
+        self.assertEqual({timezone.localtime(o).time() for o, _ in ocorrencias}, {time(10)})
+
+    def test_conflito_respeita_o_intervalo_entre_sessoes(self):
+        # Termina 10 minutos antes da terceira ocorrência: menos que os 15 exigidos.
+        terceira = self.segunda + timedelta(weeks=2)
+        Agendamento.objects.create(
+            profissional=self.profissional, paciente=self.paciente, titulo='Avulsa',
+            data_hora_inicio=self.as_horas(terceira, 9), data_hora_fim=self.as_horas(terceira, 9, 50),
+        )
+
+        resposta = self.criar(10)
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(
+            [(c['data_hora_inicio'], c['motivo']) for c in resposta.json()['conflitos']],
+            [(self.as_horas(terceira, 10).isoformat(), "Já existe um agendamento neste horário.")],
+        )
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+        resposta = self.criar(10, ignorar_conflitos=True)
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(len(resposta.json()['agendamentos']), 3)
+        self.assertEqual(Agendamento.objects.filter(serie=resposta.json()['serie']).count(), 3)
+
+    def test_ocorrencia_fora_do_horario_de_trabalho(self):
+        # Das 16:30 às 17:30 passa do fim do expediente, exceto no dia com horário estendido.
+        segunda_semana = self.segunda + timedelta(weeks=1)
+        ExcecaoHorario.objects.create(
+            profissional=self.profissional, data=segunda_semana, dia_inteiro=False,
+            hora_inicio=time(9), hora_fim=time(19), descricao='Plantão estendido',
+        )
+        inicio = self.as_horas(self.segunda, 16, 30)
+        conflitos = detectar_conflitos(
+            self.profissional, gerar_ocorrencias(inicio, inicio + timedelta(hours=1), 'semanal', quantidade=3)
+        )
+        self.assertEqual(conflitos, [
+            (inicio, "Fora do horário de trabalho do profissional."),
+            (inicio + timedelta(weeks=2), "Fora do horário de trabalho do profissional."),
+        ])
+
+        resposta = self.criar(8, quantidade=2)
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(len(resposta.json()['conflitos']), 2)
+
+
+class IntervalosTests(SimpleTestCase):
+
+    def test_mesclar_une_sobrepostos_e_encostados(self):
+        self.assertEqual(
+            mesclar_intervalos([(600, 660), (480, 540), (540, 570), (630, 700), (800, 810), (805, 806)]),
+            [(480, 570), (600, 700), (800, 810)],
+        )
+        self.assertEqual(mesclar_intervalos([]), [])
+
+    def test_subtrair_devolve_os_trechos_livres_da_janela(self):
+        ocupados = mesclar_intervalos([(420, 500), (600, 660), (700, 720), (1100, 1200)])
+        self.assertEqual(subtrair_intervalos((480, 1080), ocupados), [(500, 600), (660, 700), (720, 1080)])
+        self.assertEqual(subtrair_intervalos((480, 1080), [(400, 1200)]), [])
+        self.assertEqual(subtrair_intervalos((480, 1080), []), [(480, 1080)])
+
+
+class MotorDisponibilidadeTests(TestCase):
+    """ Agenda cheia nas próximas semanas: a busca antiga fazia consultas por dia e por hora. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'julia@teste.com', 'senha', nome_completo='Júlia Campos', funcao='proprietario'
+        )
+        conta, = Conta.objects.bulk_create([Conta(nome_conta='Consultório Júlia', proprietario=cls.profissional)])
+        paciente = Paciente.objects.create(nome_completo='Lucas Moreira', conta=conta)
+        HorarioTrabalho.objects.bulk_create([
+            HorarioTrabalho(profissional=cls.profissional, dia_da_semana=dia, hora_inicio=time(8), hora_fim=time(12))
+            for dia in range(7)
+        ])
+        cls.primeiro_dia_livre = timezone.localdate() + timedelta(days=15)
+        Agendamento.objects.bulk_create([
+            Agendamento(
+                profissional=cls.profissional, paciente=paciente, titulo='Sessão',
+                data_hora_inicio=timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=dias), time(hora))),
+                data_hora_fim=timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=dias), time(hora + 1))),
+            )
+            for dias in range(15) for hora in range(8, 12)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_agenda_cheia_com_numero_fixo_de_consultas(self):
+        # Horário de trabalho, exceções, agendamentos e reservas temporárias.
+        with self.assertNumQueries(4):
+            horarios = buscar_horarios_disponiveis(self.profissional, {'periodo': 'manha'})
+        self.assertEqual(
+            [timezone.localtime(h).replace(tzinfo=None) for h in horarios],
+            [datetime.combine(self.primeiro_dia_livre, time(hora)) for hora in (8, 9, 10)],
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(buscar_horarios_disponiveis(self.profissional, {'periodo': 'manha'}), horarios)
+
+
+class BuscaHorariosContaTests(TestCase):
+    """ Três profissionais ativos (dois psicólogos e uma nutricionista) e um psicólogo inativo. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana, cls.bruno, cls.clara, cls.davi = [
+            Profissional.objects.create_user(
+                f'{nome.lower()}@clinica.com', 'senha', nome_completo=nome, especialidade=especialidade, is_active=ativo
+            )
+            for nome, especialidade, ativo in [
+                ('Ana', 'Psicologia', True), ('Bruno', 'psicologia', True), ('Clara', 'Nutrição', True), ('Davi', 'Psicologia', False),
+            ]
+        ]
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Clínica Integrada', proprietario=cls.ana)])
+        Profissional.objects.update(conta=cls.conta)
+        expedientes = {cls.ana: (9, 12), cls.bruno: (9, 12), cls.clara: (14, 18), cls.davi: (8, 12)}
+        HorarioTrabalho.objects.bulk_create([
+            HorarioTrabalho(profissional=profissional, dia_da_semana=dia, hora_inicio=time(inicio), hora_fim=time(fim))
+            for profissional, (inicio, fim) in expedientes.items() for dia in range(7)
+        ])
+        cls.dia = timezone.localdate() + timedelta(days=3)
+        paciente = Paciente.objects.create(nome_completo='Marina Costa', conta=cls.conta)
+        Agendamento.objects.create(
+            profissional=cls.ana, paciente=paciente, titulo='Sessão',
+            data_hora_inicio=cls.as_horas(9), data_hora_fim=cls.as_horas(10),
+        )
+
+    @classmethod
+    def as_horas(cls, hora):
+        return timezone.make_aware(datetime.combine(cls.dia, time(hora)))
+
+    def setUp(self):
+        cache.clear()
+
+    def buscar(self, quantidade, **kwargs):
+        horarios = buscar_horarios_conta(self.conta, quantidade, preferencias={'data': self.dia.isoformat()}, **kwargs)
+        return [(h['inicio'], h['profissional_id']) for h in horarios]
+
+    def test_horarios_de_todos_os_profissionais_em_ordem(self):
+        # Uma consulta para os profissionais e quatro para as agendas, quantos forem os profissionais.
+        with self.assertNumQueries(5):
+            horarios = self.buscar(4)
+        self.assertEqual(horarios, [
+            (self.as_horas(9), self.bruno.pk), (self.as_horas(10), self.ana.pk),
+            (self.as_horas(10), self.bruno.pk), (self.as_horas(11), self.ana.pk),
+        ])
+
+    def test_um_profissional_por_horario(self):
+        self.assertEqual(self.buscar(3, um_por_horario=True), [
+            (self.as_horas(9), self.bruno.pk), (self.as_horas(10), self.ana.pk), (self.as_horas(11), self.ana.pk),
+        ])
+
+    def test_filtro_por_especialidade(self):
+        self.assertEqual(
+            self.buscar(3, especialidade='nutrição'),
+            [(self.as_horas(hora), self.clara.pk) for hora in (14, 15, 16)],
+        )
+        self.assertEqual(self.buscar(3, especialidade='Fisioterapia'), [])
+
+
+class DuracaoEIntervaloTests(SimpleTestCase):
+    """ Encaixe de serviços de durações diferentes, com minutos livres entre as sessões. """
+    dia = date(2030, 3, 4)
+
+    def horarios(self, ocupados=(), **kwargs):
+        agenda = {self.dia: ((8 * 60, 12 * 60), mesclar_intervalos(ocupados), ())}
+        return [timezone.localtime(h).strftime('%H:%M') for h in gerar_horarios(agenda, **kwargs)]
+
+    def test_intervalo_antes_e_depois_dos_agendamentos(self):
+        # Sessão das 10:00 às 11:00: com 10 minutos de folga, o dia fica livre até 09:50 e a partir das 11:10.
+        self.assertEqual(self.horarios([(600, 660)], quantidade=5, duracao=50, intervalo=10), ['08:00', '09:00', '11:10'])
+        self.assertEqual(self.horarios([(600, 660)], quantidade=5, duracao=50), ['08:00', '08:50', '11:00'])
+
+    def test_servico_longo_so_cabe_nos_trechos_livres_suficientes(self):
+        self.assertEqual(self.horarios([(600, 660)], quantidade=3, duracao=90), ['08:00'])
+        self.assertEqual(self.horarios([(540, 600), (660, 690)], quantidade=3, duracao=90), [])
+
+    def test_hora_preferida_respeita_a_duracao_e_o_intervalo(self):
+        preferencias = {'hora': '09:30'}
+        self.assertEqual(self.horarios([(600, 660)], preferencias=preferencias, duracao=30), ['09:30'])
+        self.assertEqual(self.horarios([(600, 660)], preferencias=preferencias, duracao=30, intervalo=10), [])
+        self.assertEqual(self.horarios(preferencias={'hora': '11:30'}, duracao=45), [])
+
+
+class ReservasTemporariasTests(TestCase):
+    """ Um profissional das 09:00 às 12:00 e dois pacientes disputando os mesmos horários. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'otavio@teste.com', 'senha', nome_completo='Otávio Pires', funcao='proprietario'
+        )
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Consultório Otávio', proprietario=cls.profissional)])
+        cls.profissional.conta = cls.conta
+        cls.profissional.save()
+        cls.nina, cls.paulo = [
+            Paciente.objects.create(nome_completo=nome, conta=cls.conta) for nome in ('Nina Ramos', 'Paulo Teixeira')
+        ]
+        HorarioTrabalho.objects.bulk_create([
+            HorarioTrabalho(profissional=cls.profissional, dia_da_semana=dia, hora_inicio=time(9), hora_fim=time(12))
+            for dia in range(7)
+        ])
+        cls.dia = timezone.localdate() + timedelta(days=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def as_horas(self, hora):
+        return timezone.make_aware(datetime.combine(self.dia, time(hora)))
+
+    def livres(self, paciente):
+        horarios = buscar_horarios_conta(self.conta, 3, preferencias={'data': self.dia.isoformat()}, paciente_id=paciente.pk)
+        return [timezone.localtime(h['inicio']).hour for h in horarios]
+
+    def segurar(self, paciente, horas, **kwargs):
+        segurar_horarios(paciente, [
+            {'profissional_id': self.profissional.pk, 'inicio': self.as_horas(hora), 'fim': self.as_horas(hora + 1)}
+            for hora in horas
+        ], **kwargs)
+
+    def test_horarios_segurados_somem_so_para_os_outros(self):
+        self.assertEqual(self.livres(self.paulo), [9, 10, 11])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.segurar(self.nina, [9, 10])
+        self.assertEqual(self.livres(self.paulo), [11])
+        self.assertEqual(self.livres(self.nina), [9, 10, 11])
+
+        # Uma nova oferta substitui as reservas anteriores da paciente.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.segurar(self.nina, [11])
+        self.assertEqual(self.livres(self.paulo), [9, 10])
+
+    def test_reserva_vencida_libera_o_horario_mesmo_com_a_agenda_em_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.segurar(self.nina, [9, 10], segundos=60)
+        self.assertEqual(self.livres(self.paulo), [11])
+        depois = timezone.now() + timedelta(seconds=61)
+        # Só a consulta dos profissionais da conta: a agenda vem do cache, com a reserva ainda nela.
+        with mock.patch('apps.agenda.disponibilidade.django_timezone.now', return_value=depois), self.assertNumQueries(1):
+            self.assertEqual(self.livres(self.paulo), [9, 10, 11])
+
+    def test_horario_segurado_para_outro_paciente_gera_alternativas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.segurar(self.nina, [9])
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = reservar_horario(self.paulo, self.profissional.pk, self.as_horas(9), self.as_horas(10))
+        self.assertFalse(resultado.sucesso)
+        self.assertEqual(resultado.motivo_conflito, "Horário reservado para outro paciente.")
+        self.assertNotIn(self.as_horas(9), [h['inicio'] for h in resultado.alternativas])
+        # As alternativas ficam seguradas para quem as recebeu.
+        self.assertEqual(
+            set(ReservaTemporaria.objects.filter(paciente=self.paulo).values_list('data_hora_inicio', flat=True)),
+            {h['inicio'] for h in resultado.alternativas},
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = reservar_horario(self.nina, self.profissional.pk, self.as_horas(9), self.as_horas(10))
+        self.assertTrue(resultado.sucesso)
+        self.assertFalse(ReservaTemporaria.objects.filter(paciente=self.nina).exists())
+
+
+class FilaWhatsAppTests(TestCase):
+    destinatario = '5571900000000'
+
+    def enfileirar(self, telefone, **campos):
+        return TarefaWhatsApp.objects.create(telefone=telefone, destinatario=self.destinatario, corpo='oi', **campos)
+
+    def test_uma_mensagem_por_telefone_de_cada_vez(self):
+        primeira = self.enfileirar('5571988880001')
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()), primeira)
+        # Chegou depois que a primeira já estava em atendimento, então não foi agrupada a ela.
+        segunda = self.enfileirar('5571988880001')
+        outro_telefone = self.enfileirar('5571988880002')
+
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()), outro_telefone)
+        self.assertIsNone(reivindicar_tarefa(EscalonadorContas()))
+        concluir_tarefa(primeira, resultado='ok')
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()), segunda)
+
+    def test_tarefas_travadas_voltam_para_a_fila(self):
+        travada_ha = timezone.now() - timedelta(seconds=TEMPO_LIMITE_PROCESSAMENTO + 1)
+        devolvida = self.enfileirar('5571988880001', status='processando', tentativas=1, iniciado_em=travada_ha)
+        abandonada = self.enfileirar('5571988880002', status='processando', tentativas=MAX_TENTATIVAS, iniciado_em=travada_ha)
+        em_andamento = self.enfileirar('5571988880003', status='processando', tentativas=1, iniciado_em=timezone.now())
+
+        self.assertEqual(recuperar_tarefas_travadas(), (1, 1))
+        self.assertEqual(
+            dict(TarefaWhatsApp.objects.values_list('id', 'status')),
+            {devolvida.id: 'pendente', abandonada.id: 'erro', em_andamento.id: 'processando'},
+        )
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()).tentativas, 2)
+
+    async def test_falha_no_atendimento_fica_registrada_na_tarefa(self):
+        tarefa = await sync_to_async(self.enfileirar)('5571988880001')
+        with mock.patch.object(AtendimentoWhatsApp, 'processar_mensagem', side_effect=RuntimeError('Gemini fora do ar')):
+            await processar_tarefa(await sync_to_async(reivindicar_tarefa)(EscalonadorContas()))
+        await tarefa.arefresh_from_db()
+        self.assertEqual(tarefa.status, 'erro')
+        self.assertIn('Gemini fora do ar', tarefa.erro)
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, "Requer SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL).")
+class ReivindicacaoConcorrenteTests(TransactionTestCase):
+
+    def test_tarefa_bloqueada_por_outro_worker_e_pulada(self):
+        bloqueada, livre = TarefaWhatsApp.objects.bulk_create([
+            TarefaWhatsApp(telefone=telefone, destinatario='5571900000000', corpo='oi')
+            for telefone in ('5571988880001', '5571988880002')
+        ])
+        bloqueou, liberar = threading.Event(), threading.Event()
+
+        def outro_worker():
+            with transaction.atomic():
+                TarefaWhatsApp.objects.select_for_update().get(pk=bloqueada.pk)
+                bloqueou.set()
+                liberar.wait(5)
+            connections.close_all()
+
+        worker = threading.Thread(target=outro_worker)
+        worker.start()
+        try:
+            bloqueou.wait(5)
+            self.assertEqual(reivindicar_tarefa(EscalonadorContas()), livre)
+        finally:
+            liberar.set()
+            worker.join()
+        self.assertEqual(reivindicar_tarefa(EscalonadorContas()), bloqueada)
+
+
+CASOS_ROTEADOR = [
+    # (mensagem, horários oferecidos, intenção esperada; None quando fica para o FAQ ou para a Gemini)
+    ("oi", 0, 'SAUDACAO'),
+    ("Bom dia, doutora! Tudo bem?", 0, 'SAUDACAO'),
+    ("quero agendar uma consulta", 0, 'AGENDAR'),
+    ("vc tem horário pra sessão?", 0, 'AGENDAR'),
+    ("quanto eu devo?", 0, 'VERIFICAR_PENDENCIAS'),
+    ("tenho algo pra pagar?", 0, 'VERIFICAR_PENDENCIAS'),
+    ("preciso de um atestado", 0, 'solicitar_atestado'),
+    ("pode mandar o recibo da consulta?", 0, 'solicitar_recibo'),
+    ("sim", 1, 'ESCOLHEU_HORARIO'),
+    ("pode ser, por favor", 1, 'ESCOLHEU_HORARIO'),
+    # Confirmações curtas só valem com exatamente um horário oferecido.
+    ("sim", 0, None),
+    ("pode ser", 2, None),
+    # Dia ou período, valores e pedidos misturados seguem adiante.
+    ("quero agendar na sexta à tarde", 0, None),
+    ("quanto custa a consulta?", 0, None),
+    ("preciso do recibo e do atestado", 0, None),
+    ("queria tirar uma dúvida", 0, None),
+    ("", 0, None),
+]
+
+
+class RoteadorIntencoesTests(SimpleTestCase):
+
+    def test_casos(self):
+        for mensagem, oferecidos, esperado in CASOS_ROTEADOR:
+            with self.subTest(mensagem=mensagem, oferecidos=oferecidos):
+                self.assertEqual(identificar_intencao_local(mensagem, oferecidos), esperado)
+
+    def test_mensagem_longa_perde_confianca(self):
+        curta = "quero agendar uma consulta"
+        longa = curta + " porque minha médica disse que eu preciso voltar a fazer acompanhamento com alguém daí"
+        self.assertEqual(identificar_intencao_local(curta), 'AGENDAR')
+        self.assertEqual(classificar_intencao(longa)[0], 'AGENDAR')
+        self.assertLess(classificar_intencao(longa)[1], CONFIANCA_MINIMA)
+        self.assertIsNone(identificar_intencao_local(longa))
+
+    def test_mensagem_roteada_nao_chama_a_gemini(self):
+        zerar_estatisticas_roteador()
+        gemini = mock.AsyncMock()
+        with mock.patch('apps.agenda.ia_manager.genai.Client'), \
+                mock.patch.object(GeminiAIManager, '_generate_content', gemini):
+            ia = GeminiAIManager(Profissional())
+            for mensagem in ["oi", "quero agendar", "quanto devo?"]:
+                analise = async_to_sync(ia.analisar_mensagem)(mensagem, Conta(id=1))
+                self.assertEqual(analise.origem, 'regras')
+        gemini.assert_not_awaited()
+        estatisticas = estatisticas_roteador()
+        self.assertEqual((estatisticas['regras'], estatisticas['gemini'], estatisticas['taxa_local']), (3, 0, 1.0))
+        self.assertEqual(
+            estatisticas['por_intencao'], {'AGENDAR': 1, 'SAUDACAO': 1, 'VERIFICAR_PENDENCIAS': 1}
+        )
+
+
+class ModelosMensagemTests(SimpleTestCase):
+
+    def test_monta_o_texto_padrao_sem_a_gemini(self):
+        texto, reescrever = obter_modelo({}, 'solicitacao_registrada')
+        self.assertFalse(reescrever)
+        self.assertEqual(
+            montar_mensagem(texto, 'solicitacao_registrada', nome='Rui', profissional='Sofia Mendes', tipo_documento='recibo'),
+            "Registrado! Sua solicitação de recibo foi encaminhada para o(a) Dr(a). Sofia Mendes. Avisaremos assim que estiver pronto!",
+        )
+
+    def test_texto_personalizado_da_conta(self):
+        contexto = {'modelos_mensagem': {'pergunta_preferencia': ("Oi {nome}! Prefere manhã ou tarde? {{sem variável}}", True)}}
+        texto, reescrever = obter_modelo(contexto, 'pergunta_preferencia')
+        self.assertTrue(reescrever)
+        self.assertEqual(montar_mensagem(texto, 'pergunta_preferencia', nome=None), "Oi ! Prefere manhã ou tarde? {sem variável}")
+
+    def test_modelos_invalidos(self):
+        for texto, trecho in [
+            ("Olá {paciente}", "Variável {paciente} não disponível"),
+            ("Olá {nome:>10}", "não aceita formatação"),
+            ("Olá {nome", "chaves { } mal formadas"),
+        ]:
+            with self.subTest(texto=texto):
+                with self.assertRaisesMessage(ModeloInvalido, trecho):
+                    compilar_modelo(texto, 'pergunta_preferencia')
+
+    def test_modelo_invalido_da_conta_volta_ao_padrao(self):
+        contexto = {'modelos_mensagem': {'encaminhamento_humano': ("Fale com {nome}", False)}}
+        self.assertEqual(obter_modelo(contexto, 'encaminhamento_humano'), (MODELOS_PADRAO['encaminhamento_humano'], False))
+
+
+class ModeloMensagemApiTests(TestCase):
+    url = '/api/modelos-mensagem/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profissional = Profissional.objects.create_user(
+            'sofia@teste.com', 'senha', nome_completo='Sofia Mendes', funcao='proprietario'
+        )
+        cls.conta, = Conta.objects.bulk_create([Conta(nome_conta='Clínica Sofia', proprietario=cls.profissional)])
+        cls.profissional.conta = cls.conta
+        cls.profissional.save()
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.profissional)
+
+    def test_texto_e_validado_e_unico_por_chave(self):
+        invalido = self.cliente.post(self.url, {'chave': 'pergunta_nome_completo', 'texto': 'Seu nome, {nome}?'}, format='json')
+        self.assertEqual(invalido.status_code, 400)
+        self.assertIn('{profissional}', invalido.json()['texto'][0])
+
+        criado = self.cliente.post(self.url, {'chave': 'pergunta_nome_completo', 'texto': 'Qual o seu nome completo?'}, format='json')
+        self.assertEqual(criado.status_code, 201)
+        repetido = self.cliente.post(self.url, {'chave': 'pergunta_nome_completo', 'texto': 'Nome completo?'}, format='json')
+        self.assertEqual(repetido.status_code, 400)
+
+
+class BuscaEspeculativaTests(SimpleTestCase):
+    """ A busca de horários roda no pool de threads enquanto a mensagem é analisada. """
+    horarios = [{'inicio': datetime(2030, 3, 8, 17, tzinfo=dt_timezone.utc), 'fim': None, 'profissional_id': 1}]
+
+    def iniciar(self, mensagem, situacao='ativa', busca=None):
+        contexto = {'situacao_assinatura': situacao, 'perfil': mock.Mock(servico_padrao=None, intervalo_entre_sessoes=10)}
+
+        def buscar_devagar(conta, **parametros):
+            sleep(0.1)
+            return self.horarios
+
+        async def atender():
+            tempos = TemposAtendimento()
+            especulativa = await AtendimentoWhatsApp()._iniciar_busca_especulativa(Conta(id=1), Paciente(id=7), mensagem, tempos)
+            if especulativa is None:
+                return None, None, tempos
+            async with tempos.medir('análise'):
+                await asyncio.sleep(0.1)
+            try:
+                return especulativa, await especulativa.aproveitar(busca or especulativa.preferencias), tempos
+            finally:
+                especulativa.descartar()
+
+        with mock.patch('apps.agenda.atendimento.obter_contexto_conta', mock.AsyncMock(return_value=contexto)), \
+                mock.patch('apps.agenda.atendimento._buscar_horarios_em_paralelo', side_effect=buscar_devagar) as buscar:
+            resultado = async_to_sync(atender)()
+        return resultado + (buscar,)
+
+    def test_busca_corre_junto_com_a_analise(self):
+        especulativa, horarios, tempos, buscar = self.iniciar("pode ser sexta à tarde?")
+        self.assertEqual(horarios, self.horarios)
+        self.assertEqual(especulativa.preferencias['periodo'], 'tarde')
+        buscar.assert_called_once_with(
+            Conta(id=1), preferencias=especulativa.preferencias, servico=None, intervalo=10, um_por_horario=True, paciente_id=7,
+        )
+        (_, busca_inicio, busca_fim), = [e for e in tempos.etapas if e[0].startswith('busca')]
+        (_, analise_inicio, analise_fim), = [e for e in tempos.etapas if e[0] == 'análise']
+        self.assertLess(busca_inicio, analise_fim)
+        self.assertLess(analise_inicio, busca_fim)
+        # Em sequência, as duas etapas somariam pelo menos 200 ms.
+        self.assertLess(tempos.agora(), 190)
+
+    def test_preferencias_diferentes_descartam_o_resultado(self):
+        _, horarios, _, buscar = self.iniciar("sexta à tarde", busca={'dia_semana': 4, 'periodo': 'manha'})
+        self.assertIsNone(horarios)
+        buscar.assert_called_once()
+
+    def test_sem_preferencia_ou_sem_assinatura_nao_busca(self):
+        for mensagem, situacao in [("quero agendar", 'ativa'), ("sexta à tarde", 'vencida')]:
+            with self.subTest(mensagem=mensagem, situacao=situacao):
+                especulativa, _, _, buscar = self.iniciar(mensagem, situacao)
+                self.assertIsNone(especulativa)
+                buscar.assert_not_called()
+
+    def test_falha_na_busca_nao_interrompe_o_atendimento(self):
+        async def aproveitar():
+            tarefa = asyncio.create_task(sync_to_async(mock.Mock(side_effect=RuntimeError('banco')))())
+            return await BuscaEspeculativa({'periodo': 'tarde'}, tarefa).aproveitar({'periodo': 'tarde'})
+        self.assertIsNone(async_to_sync(aproveitar)())
+
+
+@override_settings(WHATSAPP_JANELA_AGRUPAMENTO=3)
+class AgrupamentoMensagensTests(TestCase):
+    destinatario = '5581900000000'
+    telefone = '5581977770000'
+
+    def enfileirar(self, *corpos, telefone=None):
+        return [
+            async_to_sync(enfileirar_mensagem)(telefone or self.telefone, self.destinatario, corpo) for corpo in corpos
+        ]
+
+    def reivindicar_em(self, segundos):
+        with mock.patch('apps.agenda.fila_whatsapp.timezone.now', return_value=timezone.now() + timedelta(seconds=segundos)):
+            return reivindicar_tarefa(EscalonadorContas())
+
+    def test_mensagens_em_sequencia_viram_um_atendimento(self):
+        primeira, segunda, terceira = self.enfileirar("oi", "queria marcar", "para quinta")
+        outro_telefone, = self.enfileirar("bom dia", telefone='5581977771111')
+
+        # Dentro da janela, o telefone ainda pode mandar mais mensagens.
+        self.assertIsNone(self.reivindicar_em(1))
+        tarefa = self.reivindicar_em(4)
+        self.assertEqual(tarefa, primeira)
+        self.assertEqual(corpo_da_tarefa(tarefa), "oi\nqueria marcar\npara quinta")
+        self.assertEqual(
+            list(TarefaWhatsApp.objects.filter(agrupada_em=tarefa).order_by('id').values_list('id', 'status')),
+            [(segunda.id, 'agrupada'), (terceira.id, 'agrupada')],
+        )
+        self.assertEqual(self.reivindicar_em(4), outro_telefone)
+
+    def test_quem_escreve_sem_parar_nao_espera_mais_que_o_limite(self):
+        primeira, _ = self.enfileirar("oi", "tudo bem?")
+        TarefaWhatsApp.objects.filter(pk=primeira.pk).update(
+            criado_em=timezone.now() - timedelta(seconds=ESPERA_MAXIMA_AGRUPAMENTO + 1)
+        )
+        # A última mensagem ainda está dentro da janela, mas a primeira já esperou o máximo.
+        self.assertEqual(self.reivindicar_em(0), primeira)
+        self.assertEqual(TarefaWhatsApp.objects.filter(status='agrupada').count(), 1)
+
+    async def test_atendimento_recebe_o_texto_das_mensagens_agrupadas(self):
+        await sync_to_async(self.enfileirar)("oi", "queria marcar")
+        tarefa = await sync_to_async(self.reivindicar_em)(4)
+        with mock.patch.object(AtendimentoWhatsApp, 'processar_mensagem', return_value={'status': 'ok'}) as atender:
+            await processar_tarefa(tarefa)
+        atender.assert_awaited_once_with(self.telefone, self.destinatario, "oi\nqueria marcar")
+        await tarefa.arefresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.resultado), ('concluida', 'ok'))
+
+
+class HistoricoConversaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        proprietario = Profissional.objects.create_user(
+            'tiago@teste.com', 'senha', nome_completo='Tiago Freitas', funcao='proprietario'
+        )
+        conta, = Conta.objects.bulk_create([Conta(nome_conta='Consultório Tiago', proprietario=proprietario)])
+        cls.paciente = Paciente.objects.create(nome_completo='Vera Lopes', conta=conta)
+
+    def conversa(self, *textos):
+        inicio = timezone.now() - timedelta(minutes=len(textos))
+        MensagemConversa.objects.bulk_create([
+            MensagemConversa(
+                paciente=self.paciente, autor='paciente' if n % 2 == 0 else 'assistente', texto=texto,
+                criado_em=inicio + timedelta(minutes=n),
+            )
+            for n, texto in enumerate(textos)
+        ])
+
+    def historico(self, **limites):
+        return [m.texto for m in async_to_sync(obter_historico)(self.paciente.pk, **limites)]
+
+    def test_atendimento_grava_mensagem_e_respostas_juntas_no_final(self):
+        anotar_resposta("fora de um atendimento")
+
+        async def atender():
+            async with registrar_conversa(self.paciente.pk, "oi"):
+                anotar_resposta("Olá! Como posso ajudar?")
+                anotar_resposta("Temos horários amanhã.")
+                self.assertFalse(await MensagemConversa.objects.aexists())
+
+        async_to_sync(atender)()
+        self.assertEqual(
+            list(MensagemConversa.objects.order_by('criado_em', 'id').values_list('autor', 'texto')),
+            [('paciente', 'oi'), ('assistente', 'Olá! Como posso ajudar?'), ('assistente', 'Temos horários amanhã.')],
+        )
+
+    def test_so_os_ultimos_turnos_em_ordem_cronologica(self):
+        self.conversa(*[f"mensagem {n}" for n in range(30)])
+        with self.assertNumQueries(1):
+            historico = self.historico(limite_turnos=4)
+        self.assertEqual(historico, ["mensagem 26", "mensagem 27", "mensagem 28", "mensagem 29"])
+        self.assertEqual(len(self.historico()), LIMITE_TURNOS)
+
+    def test_orcamento_de_tokens_corta_as_mais_antigas(self):
+        self.conversa("a" * 400, "b" * 40, "c" * 40)
+        # 10 + 10 tokens cabem em 25; a mensagem de 100 tokens, mais antiga, fica de fora.
+        self.assertEqual(self.historico(orcamento_tokens=25), ["b" * 40, "c" * 40])
+        self.assertEqual(self.historico(orcamento_tokens=5), [])
+        self.assertEqual(
+            formatar_historico(async_to_sync(obter_historico)(self.paciente.pk, orcamento_tokens=10)), "Paciente: " + "c" * 40
+        )
+
+    def test_limpeza_respeita_a_retencao(self):
+        self.conversa("recente")
+        MensagemConversa.objects.create(
+            paciente=self.paciente, autor='paciente', texto='antiga', criado_em=timezone.now() - RETENCAO_CONVERSA - timedelta(days=1)
+        )
+        self.assertEqual(limpar_conversas_antigas(), 1)
+        self.assertEqual(self.historico(), ["recente"])
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AgendamentoViewSet, ConfirmarAgendamentoView, HorarioTrabalhoViewSet, ExcecaoHorarioViewSet
+from .views import AgendamentoViewSet, ConfirmarAgendamentoView, HorarioTrabalhoViewSet, ExcecaoHorarioViewSet, DisponibilidadeView, CalendarioICSView, ListaEsperaViewSet, ModeloMensagemViewSet, FilaWhatsAppView
 
 # Cria um roteador para a app de agenda.
 router = DefaultRouter()
@@ -8,9 +8,14 @@ router = DefaultRouter()
 router.register(r'agendamentos', AgendamentoViewSet, basename='agendamento')
 router.register(r'horarios-trabalho', HorarioTrabalhoViewSet, basename='horario-trabalho')
 router.register(r'excecoes-horario', ExcecaoHorarioViewSet, basename='excecao-horario')
+router.register(r'lista-espera', ListaEsperaViewSet, basename='lista-espera')
+router.register(r'modelos-mensagem', ModeloMensagemViewSet, basename='modelo-mensagem')
 
 # As URLs da API para esta app são agora determinadas automaticamente pelo roteador.
 urlpatterns = [
     path('agendamentos/confirmar/<uuid:token>/', ConfirmarAgendamentoView.as_view(), name='confirmar-agendamento'),
+    path('disponibilidade/', DisponibilidadeView.as_view(), name='disponibilidade'),
+    path('whatsapp/fila/', FilaWhatsAppView.as_view(), name='fila-whatsapp'),
+    path('agenda/<uuid:token>/calendario.ics', CalendarioICSView.as_view(), name='calendario-ics'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,37 @@
+"""
+Contadores de versão guardados no cache compartilhado (Redis).
+
+Cada processo compara a versão que leu com a versão dos dados que montou na memória
+e, se forem diferentes, descarta o que tinha. O incremento é atômico no Redis
+(INCR), então duas alterações simultâneas em processos diferentes geram versões
+diferentes.
+
+Se a chave sumir do Redis (reinício, falta de memória), ela recomeça a partir do
+relógio em microssegundos, e não de 1, para não coincidir com uma versão antiga
+que algum processo ainda tenha na memória.
+"""
+import time
+from django.core.cache import cache
+
+
+def _versao_inicial():
+    return time.time_ns() // 1000
+
+
+async def ler_versao(chave):
+    versao = await cache.aget(chave)
+    if versao is None:
+        await cache.aadd(chave, _versao_inicial(), None)
+        versao = await cache.aget(chave)
+    return versao
+
+
+def incrementar_versao(chave):
+    cache.add(chave, _versao_inicial(), None)
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        # A chave foi descartada entre o add e o incr.
+        versao = _versao_inicial()
+        cache.set(chave, versao, None)
+        return versao
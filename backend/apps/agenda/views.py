@@ -1,69 +1,41 @@
 # backend/apps/agenda/views.py
 
-import os
-import traceback
-from google import genai
-from django.http import HttpResponse
+import json
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils import timezone
-from datetime import timedelta, datetime
-from django.core.cache import cache
 from rest_framework import permissions, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum
-import re
+from django.db import transaction
+
+from apps.users.models import Profissional, PerfilClinica
+from .disponibilidade import buscar_horarios_conta, invalidar_agenda, dias_do_intervalo
+from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, ListaEspera, ModeloMensagem
+from .serializers import (
+    AgendamentoSerializer, AgendamentoSerieSerializer, AtualizacaoStatusLoteSerializer,
+    HorarioTrabalhoSerializer, ExcecaoHorarioSerializer, ListaEsperaSerializer, ModeloMensagemSerializer
+)
+from .modelos_mensagem import MODELOS_PADRAO, VARIAVEIS
+from .recorrencia import gerar_ocorrencias, criar_serie
+from .calendario import versao_calendario, gerar_linhas_ics
+from .lista_espera import avisar_lista_espera
+from .atendimento import AtendimentoWhatsApp
+from .fila_whatsapp import enfileirar_mensagem
+from .escalonador_whatsapp import profundidade_por_conta
+from .mensagens_recebidas import registrar_mensagem_recebida, concluir_mensagem_recebida, resposta_original
+# Reexportada: os comandos de lembrete e follow-up importam a função daqui.
+from .whatsapp import responder_paciente_via_whatsapp
+from apps.financas.models import Transacao, Servico
 
-from apps.users.models import Paciente, Conta, Assinatura
-from .ia_manager import GeminiAIManager
-from .models import Agendamento, HorarioTrabalho, ExcecaoHorario, FeedbackNPS
-from .serializers import AgendamentoSerializer, HorarioTrabalhoSerializer, ExcecaoHorarioSerializer
-from apps.financas.models import Transacao
-
-# --- MODO DE SIMULAÇÃO ---
 from django.conf import settings
 
-def responder_paciente_via_whatsapp(numero_destinatario, mensagem):
-    if settings.DEBUG:
-        print("\n" + "*"*10 + " MODO SIMULAÇÃO (DEBUG) " + "*"*10)
-        print(f"--> Destinatário: {numero_destinatario}")
-        print(f"--> Mensagem que seria enviada:\n{mensagem}")
-        print("*"*42 + "\n")
-        return True
-
-    account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-    auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
-    twilio_number = os.environ.get('TWILIO_WHATSAPP_NUMBER')
-
-    if not all([account_sid, auth_token, twilio_number]):
-        print("!!! ERRO CRÍTICO: Credenciais da Twilio não configuradas no .env !!!")
-        return False
-
-    try:
-        client = Client(account_sid, auth_token)
-        numero_limpo = ''.join(filter(str.isdigit, numero_destinatario))
-        
-        if len(numero_limpo) == 11:
-            numero_formatado = f'whatsapp:+55{numero_limpo}'
-        else:
-            numero_formatado = f'whatsapp:+{numero_limpo}'
-
-        message = client.messages.create(
-            from_=f'whatsapp:{twilio_number}',
-            body=mensagem,
-            to=numero_formatado
-        )
-        print(f"--> Mensagem enviada com sucesso para {numero_destinatario} (SID: {message.sid})")
-        return True
-    except TwilioRestException as e:
-        print(f"!!! ERRO AO ENVIAR WHATSAPP via Twilio: {e}")
-        return False
-    except Exception as e:
-        print(f"!!! ERRO INESPERADO ao enviar WhatsApp: {e}")
-        return False
-
 class AgendamentoViewSet(viewsets.ModelViewSet):
     serializer_class = AgendamentoSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -78,10 +50,99 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(profissional=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='serie')
+    def criar_serie(self, request):
+        """
+        Cria uma série de agendamentos recorrentes (semanal ou quinzenal) de uma só vez.
+        Se alguma ocorrência conflitar, nada é criado, a menos que 'ignorar_conflitos' seja enviado.
+        """
+        serializer = AgendamentoSerieSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
+
+        ocorrencias = gerar_ocorrencias(
+            dados['data_hora_inicio'], dados['data_hora_fim'], dados['frequencia'],
+            data_limite=dados.get('data_limite'), quantidade=dados.get('quantidade'), pular=dados['pular']
+        )
+        perfil = PerfilClinica.objects.filter(conta=request.user.conta).first()
+        agendamentos, conflitos = criar_serie(
+            request.user, ocorrencias, ignorar_conflitos=dados['ignorar_conflitos'],
+            intervalo=perfil.intervalo_entre_sessoes if perfil else 0,
+            paciente=dados['paciente'], servico=dados.get('servico'), titulo=dados['titulo'],
+            notas_agendamento=dados.get('notas_agendamento'), status=dados['status']
+        )
+        conflitos_formatados = [{"data_hora_inicio": inicio, "motivo": motivo} for inicio, motivo in conflitos]
+
+        if not agendamentos:
+            return Response(
+                {"error": "Nenhum agendamento da série pôde ser criado.", "conflitos": conflitos_formatados},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(
+            {
+                "serie": agendamentos[0].serie,
+                "agendamentos": AgendamentoSerializer(agendamentos, many=True).data,
+                "conflitos": conflitos_formatados,
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'], url_path='atualizar-status-em-lote')
+    def atualizar_status_em_lote(self, request):
+        """
+        Aplica o mesmo status a vários agendamentos de uma vez (ex: fechar o dia como 'Realizado'
+        ou cancelar um período), com as mesmas regras de perform_update: ao marcar 'Realizado',
+        cria a transação de quem não tem dia de cobrança, se houver serviço e ainda não houver transação.
+        """
+        serializer = AtualizacaoStatusLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
+        novo_status = dados['status']
+
+        agendamentos = self.get_queryset().exclude(status=novo_status)
+        if dados.get('ids'):
+            agendamentos = agendamentos.filter(id__in=dados['ids'])
+        if dados.get('data_inicio'):
+            agendamentos = agendamentos.filter(data_hora_inicio__date__range=(dados['data_inicio'], dados['data_fim']))
+
+        with transaction.atomic():
+            afetados = list(agendamentos.select_for_update(of=('self',)).values_list(
+                'id', 'profissional_id', 'paciente_id', 'servico_id', 'data_hora_inicio', 'data_hora_fim',
+                'paciente__dia_cobranca', 'servico__valor_padrao'
+            ))
+            ids = [afetado[0] for afetado in afetados]
+            Agendamento.objects.filter(id__in=ids).update(status=novo_status, atualizado_em=timezone.now())
+
+            transacoes = []
+            if novo_status == 'Realizado':
+                ja_cobrados = set(Transacao.objects.filter(agendamento_id__in=ids).values_list('agendamento_id', flat=True))
+                transacoes = Transacao.objects.bulk_create([
+                    Transacao(
+                        profissional_id=profissional_id, paciente_id=paciente_id, agendamento_id=agendamento_id,
+                        servico_prestado_id=servico_id, valor_cobrado=valor_padrao, status='pendente'
+                    )
+                    for agendamento_id, profissional_id, paciente_id, servico_id, _, _, dia_cobranca, valor_padrao in afetados
+                    if dia_cobranca is None and servico_id and agendamento_id not in ja_cobrados
+                ])
+
+            # update() não dispara os sinais, então o cache de disponibilidade é invalidado aqui.
+            dias_por_profissional = {}
+            for _, profissional_id, _, _, inicio, fim, _, _ in afetados:
+                dias_por_profissional.setdefault(profissional_id, set()).update(dias_do_intervalo(inicio, fim))
+            for profissional_id, dias in dias_por_profissional.items():
+                invalidar_agenda(profissional_id, dias)
+
+        if novo_status == 'Cancelado':
+            avisar_lista_espera(*Agendamento.objects.filter(id__in=ids).select_related('profissional'))
+
+        return Response({"atualizados": len(ids), "ids": ids, "transacoes_criadas": len(transacoes)})
+
     def perform_update(self, serializer):
         old_status = serializer.instance.status
         instance = serializer.save()
         new_status = instance.status
+        if new_status == 'Cancelado' and old_status != 'Cancelado':
+            avisar_lista_espera(instance)
         if new_status == 'Realizado' and old_status != 'Realizado':
             if instance.paciente.dia_cobranca is None:
                 if instance.servico and not Transacao.objects.filter(agendamento=instance).exists():
@@ -113,208 +174,145 @@ class ConfirmarAgendamentoView(APIView):
         """
         return HttpResponse(html_response)
 
-class WhatsAppWebhookView(APIView):
-    permission_classes = [permissions.AllowAny]
-
-    def post(self, request, *args, **kwargs):
+class CalendarioICSView(View):
+    """
+    Feed iCalendar somente leitura da agenda de um profissional, acessado pelo token secreto.
+    Responde 304 quando o cliente já tem a versão atual (If-None-Match / If-Modified-Since).
+    """
+    def get(self, request, token, *args, **kwargs):
+        profissional = get_object_or_404(Profissional, token_calendario=token, is_active=True)
+        etag, ultima_modificacao = versao_calendario(profissional)
+        etag = quote_etag(etag)
+        ultima_modificacao_ts = ultima_modificacao.timestamp() if ultima_modificacao else None
+
+        resposta_condicional = get_conditional_response(request, etag=etag, last_modified=ultima_modificacao_ts)
+        if resposta_condicional is not None:
+            return resposta_condicional
+
+        response = StreamingHttpResponse(gerar_linhas_ics(profissional), content_type='text/calendar; charset=utf-8')
+        response['ETag'] = etag
+        if ultima_modificacao_ts:
+            response['Last-Modified'] = http_date(ultima_modificacao_ts)
+        response['Content-Disposition'] = 'inline; filename="agenda.ics"'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+@method_decorator(csrf_exempt, name='dispatch')
+class WhatsAppWebhookView(View):
+    """
+    Webhook da Twilio. É uma view assíncrona: sob ASGI, as mensagens em atendimento
+    não ocupam uma thread cada enquanto esperam a Gemini e a Twilio.
+    Repetições do mesmo MessageSid recebem a resposta original sem novo atendimento.
+    """
+    async def post(self, request, *args, **kwargs):
         print("\n" + "="*20 + " WEBHOOK INICIADO " + "="*20)
+        # A Twilio envia form-urlencoded; JSON é aceito para testes e integrações.
+        dados = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+        remetente_full = dados.get('From', '')
+        destinatario_full = dados.get('To', '')
+        corpo_mensagem_original = dados.get('Body', '').strip()
+
+        remetente_num = ''.join(filter(str.isdigit, remetente_full))
+        destinatario_num = ''.join(filter(str.isdigit, destinatario_full))
+
+        print(f"Recebido de: {remetente_num}, Para: {destinatario_num}, Mensagem: '{corpo_mensagem_original}'")
+
+        if not remetente_num or not corpo_mensagem_original:
+            return JsonResponse({"status": "dados_insuficientes"}, status=400)
+
+        registro = None
+        message_sid = dados.get('MessageSid', '')
+        if message_sid:
+            registro, nova = await registrar_mensagem_recebida(message_sid)
+            if not nova:
+                print(f"--> Repetição da mensagem {message_sid} ignorada (status original: {registro.status}).")
+                return JsonResponse(resposta_original(registro))
+
+        if settings.WHATSAPP_USAR_FILA:
+            # Responde ao Twilio na hora; a conversa é processada pelo comando processar_fila_whatsapp.
+            try:
+                tarefa = await enfileirar_mensagem(remetente_num, destinatario_num, corpo_mensagem_original)
+            except Exception:
+                # Sem o registro, a repetição da Twilio tenta de novo em vez de ser ignorada.
+                if registro:
+                    await concluir_mensagem_recebida(registro, 'erro_geral')
+                raise
+            if registro:
+                await concluir_mensagem_recebida(registro, "enfileirado", tarefa)
+            return JsonResponse({"status": "enfileirado", "tarefa": tarefa.id})
+
+        # processar_mensagem não levanta exceções: um erro volta como 'erro_geral' e apaga o registro.
+        resultado = await AtendimentoWhatsApp().processar_mensagem(remetente_num, destinatario_num, corpo_mensagem_original)
+        if registro:
+            await concluir_mensagem_recebida(registro, resultado['status'])
+        return JsonResponse(resultado, status=500 if resultado['status'] == 'erro_geral' else 200)
+
+class FilaWhatsAppView(APIView):
+    """
+    Mensagens da conta na fila do WhatsApp: pendentes e em atendimento.
+    Para a equipe do sistema (is_staff), ?todas=1 mostra a fila de todas as contas.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_staff and request.query_params.get('todas'):
+            return Response(profundidade_por_conta())
+        destinatario = request.user.conta.whatsapp_number
+        if not destinatario:
+            return Response({"pendentes": 0, "processando": 0})
+        return Response(profundidade_por_conta(destinatario).get(destinatario, {"pendentes": 0, "processando": 0}))
+
+class DisponibilidadeView(APIView):
+    """
+    Retorna os próximos horários livres entre todos os profissionais ativos da conta.
+    Aceita os filtros 'especialidade', 'servico' (ID), 'dia_semana', 'periodo' e 'hora'.
+    A duração vem do serviço e 'intervalo' (minutos entre sessões) usa o perfil da clínica por padrão.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        conta = request.user.conta
+        params = request.query_params
         try:
-            remetente_full = request.data.get('From', '')
-            destinatario_full = request.data.get('To', '')
-            corpo_mensagem_original = request.data.get('Body', '').strip()
-            
-            remetente_num = ''.join(filter(str.isdigit, remetente_full))
-            destinatario_num = ''.join(filter(str.isdigit, destinatario_full))
-
-            print(f"Recebido de: {remetente_num}, Para: {destinatario_num}, Mensagem: '{corpo_mensagem_original}'")
-
-            if not remetente_num or not corpo_mensagem_original:
-                return Response({"status": "dados_insuficientes"}, status=400)
-
-            conta = Conta.objects.get(whatsapp_number=destinatario_num)
-            
-            paciente, is_new_contact = Paciente.objects.get_or_create(
-                conta=conta, 
-                contato_telefone__contains=remetente_num,
-                defaults={'cadastrado_por': conta.proprietario, 'nome_completo': 'Novo Contato'}
+            quantidade = min(int(params.get('quantidade', 3)), 50)
+            dias = min(int(params.get('dias', 30)), 60)
+            dia_semana = int(params['dia_semana']) if params.get('dia_semana') else None
+            intervalo = int(params['intervalo']) if params.get('intervalo') else None
+        except ValueError:
+            return Response(
+                {"error": "Os campos 'quantidade', 'dias', 'dia_semana' e 'intervalo' devem ser números inteiros."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            ai_manager = GeminiAIManager(profissional=conta.proprietario)
-
-            if paciente and paciente.conversation_state and paciente.conversation_state.startswith('AWAITING_NPS_'):
-                return self.handle_nps_response(paciente, corpo_mensagem_original)
-
-            if paciente:
-                agendamento_pendente = Agendamento.objects.filter(
-                    paciente=paciente, status__in=['Agendado'], 
-                    data_hora_inicio__gte=timezone.now()
-                ).order_by('data_hora_inicio').first()
-                if agendamento_pendente and corpo_mensagem_original.upper() in ['SIM', 'NÃO', 'REAGENDAR']:
-                    return self.handle_lembrete_response(agendamento_pendente, corpo_mensagem_original.upper(), ai_manager)
-
-            if paciente and paciente.onboarding_step:
-                return self.handle_onboarding(paciente, corpo_mensagem_original, ai_manager)
-            
-            intencao = ai_manager.identificar_intencao_geral(corpo_mensagem_original, conta)
-            print(f"--> Intenção da IA Identificada: {intencao}")
-            
-            return self.handle_paciente_existente(paciente, corpo_mensagem_original, intencao, ai_manager)
-
-        except Conta.DoesNotExist:
-            print(f"--> Erro Crítico: Nenhum profissional/conta associado ao número de destino {destinatario_num}")
-            return Response({"status": "conta_nao_encontrada"})
-        except Exception as e:
-            traceback.print_exc()
-            return Response({"status": "erro_geral", "mensagem": str(e)}, status=500)
-
-    def handle_nps_response(self, paciente, corpo_mensagem):
-        # (Seu código original aqui, sem alterações)
-        try:
-            nota = int(re.search(r'\d+', corpo_mensagem).group())
-            if 0 <= nota <= 10:
-                agendamento_id = paciente.conversation_state.split('_')[-1]
-                agendamento = Agendamento.objects.get(id=agendamento_id)
-                FeedbackNPS.objects.create(paciente=paciente, profissional=agendamento.profissional, agendamento=agendamento, nota=nota)
-                paciente.conversation_state = None
-                paciente.save()
-                resposta_ia = "Muito obrigado pelo seu feedback!"
-                responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-                return Response({"status": "nps_recorded"})
-        except (ValueError, AttributeError, Agendamento.DoesNotExist):
-            resposta_ia = "Não entendi sua resposta. Por favor, responda apenas com um número de 0 a 10."
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "nps_invalid_response"})
-        return Response({"status": "nps_error"})
-
-    def handle_lembrete_response(self, agendamento, resposta, ai_manager):
-        # (Seu código original aqui, sem alterações)
-        if resposta == 'SIM':
-            agendamento.status = 'Confirmado'
-            agendamento.save()
-            responder_paciente_via_whatsapp(agendamento.paciente.contato_telefone, "Obrigado por confirmar! Sua consulta está garantida.")
-            return Response({"status": "confirmado"})
-        if resposta in ['NÃO', 'REAGENDAR']:
-            agendamento.status = 'Cancelado'
-            agendamento.save()
-            return self.handle_paciente_existente(agendamento.paciente, "gostaria de agendar", "AGENDAR", ai_manager)
-        return Response({"status": "lembrete_error"})
-
-    def handle_onboarding(self, paciente, corpo_mensagem, ai_manager):
-        if paciente.onboarding_step == 'AWAITING_NAME':
-            # MELHORIA: Remove "Meu nome é" se o paciente incluir na resposta
-            nome_limpo = re.sub(r'^(meu nome é|me chamo)\s*', '', corpo_mensagem, flags=re.IGNORECASE).strip()
-            paciente.nome_completo = nome_limpo
-            paciente.onboarding_step = 'AWAITING_DETAILS'
-            paciente.save()
-            resposta_ia = ai_manager.gerar_pergunta_onboarding(paciente.nome_completo.split(' ')[0])
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "onboarding_asked_details"})
-
-        elif paciente.onboarding_step == 'AWAITING_DETAILS':
-            dados = ai_manager.extrair_dados_onboarding(corpo_mensagem)
-            if dados.get('cpf'):
-                paciente.cpf = dados['cpf']
-            if dados.get('data_nascimento'):
-                try:
-                    data_nasc = datetime.strptime(dados['data_nascimento'], '%d/%m/%Y').strftime('%Y-%m-%d')
-                    paciente.data_nascimento = data_nasc
-                except ValueError:
-                    pass
-            paciente.onboarding_step = None
-            paciente.save()
-            resposta_ia = "Obrigado! Suas informações foram salvas com sucesso. Se precisar de mais alguma coisa, é só chamar!"
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "onboarding_complete"})
-        return Response({"status": "onboarding_unknown_step"})
-
-    def handle_paciente_existente(self, paciente, corpo_mensagem_original, intent, ai_manager):
-        print(f"--> Ação: Lidando com paciente: {paciente.nome_completo or 'Novo Contato'} | Intenção: {intent}")
-        conta = paciente.conta
-        
-        try:
-            assinatura = conta.assinatura
-            if not assinatura.ativa or assinatura.plano.limite_mensagens_ia == 0:
-                return Response({"status": "plano_incompativel"})
-        except Assinatura.DoesNotExist:
-            return Response({"status": "sem_assinatura"})
-
-        cache_key = f"horarios_oferecidos_{paciente.id}"
-        horarios_oferecidos_cache = cache.get(cache_key)
-
-        if intent == "ESCOLHEU_HORARIO":
-            horario_escolhido_utc = None
-            if horarios_oferecidos_cache:
-                horario_escolhido_utc = ai_manager.extrair_horario_escolhido(corpo_mensagem_original, horarios_oferecidos_cache)
-            
-            if horario_escolhido_utc:
-                Agendamento.objects.create(paciente=paciente, profissional=conta.proprietario, titulo="Consulta agendada pela IA", data_hora_inicio=horario_escolhido_utc, data_hora_fim=horario_escolhido_utc + timedelta(hours=1), status='Confirmado')
-                
-                if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
-                    paciente.onboarding_step = 'AWAITING_NAME'
-                    paciente.save()
-                    resposta_ia = ai_manager.gerar_pergunta_nome_completo()
-                else:
-                    data_local_formatada = timezone.localtime(horario_escolhido_utc).strftime('%A, %d de %B às %H:%M').capitalize()
-                    resposta_ia = f"Perfeito, {paciente.nome_completo.split(' ')[0]}! Seu agendamento para {data_local_formatada} está confirmado. Até lá!"
-                
-                responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-                cache.delete(cache_key)
-                return Response({"status": "agendamento_criado"})
-            else:
-                # MELHORIA: Se não escolheu um horário válido, trata como uma nova preferência
-                intent = "AGENDAR_COM_PREFERENCIA"
-
-        if intent == "AGENDAR_COM_PREFERENCIA":
-            preferencias = ai_manager.extrair_preferencias(corpo_mensagem_original)
-            horarios = ai_manager.encontrar_horarios_disponiveis(preferencias)
-            cache.set(cache_key, horarios, 600)
-            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "você"
-            resposta_ia = ai_manager.gerar_resposta_com_horarios(nome_para_resposta, horarios)
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "horarios_enviados"})
-
-        elif intent == "AGENDAR":
-            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "você"
-            resposta_ia = ai_manager.gerar_pergunta_preferencia(nome_para_resposta)
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "aguardando_preferencia"})
-        
-        elif intent == "SAUDACAO":
-            nome_para_resposta = paciente.nome_completo.split(' ')[0] if paciente.nome_completo and "Novo Contato" not in paciente.nome_completo else "tudo bem?"
-            resposta_ia = f"Olá, {nome_para_resposta}! Sou a assistente virtual do(a) {conta.nome_conta}. Como posso te ajudar hoje?"
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "saudacao_respondida"})
-
-        elif intent == "VERIFICAR_PENDENCIAS":
-            if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
-                 resposta_ia = "Para verificar informações financeiras, primeiro preciso que você se identifique. Por favor, me informe seu nome completo."
-                 paciente.onboarding_step = 'AWAITING_NAME'
-                 paciente.save()
-            else:
-                resposta_ia = ai_manager.buscar_e_responder_pendencias(paciente)
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "pendencias_verificadas"})
-
-        elif intent in ['solicitar_receita', 'solicitar_atestado', 'solicitar_recibo']:
-            if not paciente.nome_completo or "Novo Contato" in paciente.nome_completo:
-                resposta_ia = "Para solicitar documentos, primeiro preciso que você se identifique. Por favor, me informe seu nome completo."
-                paciente.onboarding_step = 'AWAITING_NAME'
-                paciente.save()
-            else:
-                resposta_ia = ai_manager.registrar_solicitacao_paciente(intent, conta, paciente)
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "solicitacao_registrada"})
-
-        elif intent == "DESCONHECIDO":
-            resposta_ia = "Não tenho certeza de como responder a isso. Deseja que eu encaminhe sua mensagem para um de nossos atendentes?"
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "encaminhado_humano"})
-
-        else: # FAQ
-            resposta_ia = ai_manager.buscar_e_gerar_resposta_faq(intent, conta)
-            responder_paciente_via_whatsapp(paciente.contato_telefone, resposta_ia)
-            return Response({"status": "faq_respondido"})
-            
+        servico = None
+        if params.get('servico'):
+            servico = Servico.objects.filter(pk=params['servico'], conta=conta).first()
+            if not servico:
+                return Response({"error": "Serviço não encontrado nesta conta."}, status=status.HTTP_404_NOT_FOUND)
+
+        if intervalo is None:
+            perfil = PerfilClinica.objects.filter(conta=conta).first()
+            intervalo = perfil.intervalo_entre_sessoes if perfil else 0
+
+        preferencias = {'dia_semana': dia_semana, 'periodo': params.get('periodo'), 'hora': params.get('hora')}
+        horarios = buscar_horarios_conta(
+            conta, quantidade=quantidade, preferencias=preferencias,
+            especialidade=params.get('especialidade'), servico=servico, dias=dias, intervalo=intervalo
+        )
+        nomes = dict(Profissional.objects.filter(
+            id__in={h['profissional_id'] for h in horarios}
+        ).values_list('id', 'nome_completo'))
+
+        return Response([
+            {
+                'profissional_id': h['profissional_id'],
+                'profissional_nome': nomes.get(h['profissional_id']),
+                'inicio': h['inicio'],
+                'fim': h['fim'],
+            }
+            for h in horarios
+        ])
+
 class HorarioTrabalhoViewSet(viewsets.ModelViewSet):
     # (Seu código original aqui, sem alterações)
     serializer_class = HorarioTrabalhoSerializer
@@ -331,4 +329,36 @@ class ExcecaoHorarioViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return ExcecaoHorario.objects.filter(profissional=self.request.user, data__gte=timezone.localdate())
     def perform_create(self, serializer):
-        serializer.save(profissional=self.request.user)
\ No newline at end of file
+        serializer.save(profissional=self.request.user)
+class ListaEsperaViewSet(viewsets.ModelViewSet):
+    """
+    Lista de espera da conta. Por padrão mostra só as inscrições ativas; use ?todas=1 para ver todas.
+    """
+    serializer_class = ListaEsperaSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    def get_queryset(self):
+        queryset = ListaEspera.objects.filter(conta=self.request.user.conta).select_related('paciente', 'profissional')
+        if not self.request.query_params.get('todas'):
+            queryset = queryset.filter(ativo=True)
+        return queryset
+    def perform_create(self, serializer):
+        serializer.save(conta=self.request.user.conta)
+
+class ModeloMensagemViewSet(viewsets.ModelViewSet):
+    """
+    Textos personalizados das mensagens fixas do WhatsApp. Excluir um modelo volta ao texto padrão.
+    """
+    serializer_class = ModeloMensagemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    def get_queryset(self):
+        return ModeloMensagem.objects.filter(conta=self.request.user.conta)
+    def perform_create(self, serializer):
+        serializer.save(conta=self.request.user.conta)
+
+    @action(detail=False, methods=['get'])
+    def padroes(self, request):
+        """ Texto padrão e variáveis disponíveis de cada mensagem. """
+        return Response([
+            {'chave': chave, 'descricao': descricao, 'texto': MODELOS_PADRAO[chave], 'variaveis': sorted(VARIAVEIS[chave])}
+            for chave, descricao in ModeloMensagem.CHAVE_CHOICES
+        ])
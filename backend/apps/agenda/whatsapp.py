@@ -0,0 +1,121 @@
+"""
+Envio de mensagens de WhatsApp pela Twilio.
+
+`responder_paciente_via_whatsapp` é usada pelos comandos e pelas views síncronas;
+`responder_paciente_via_whatsapp_async` pelo atendimento assíncrono do webhook,
+com o cliente HTTP assíncrono da Twilio para não bloquear o event loop. As mensagens
+enviadas durante um atendimento entram no histórico da conversa (historico_conversa).
+
+O cliente assíncrono (e a sua sessão aiohttp, presa ao event loop em que foi criada) é um
+só por event loop: o worker reaproveita as conexões com a Twilio entre as mensagens e o
+fecha com `fechar_cliente_twilio_async` ao encerrar.
+"""
+import asyncio
+import os
+import weakref
+from django.conf import settings
+from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+from .historico_conversa import anotar_resposta
+
+
+def _simular_envio(numero_destinatario, mensagem):
+    print("\n" + "*"*10 + " MODO SIMULAÇÃO (DEBUG) " + "*"*10)
+    print(f"--> Destinatário: {numero_destinatario}")
+    print(f"--> Mensagem que seria enviada:\n{mensagem}")
+    print("*"*42 + "\n")
+
+
+def _credenciais_twilio():
+    credenciais = (
+        os.environ.get('TWILIO_ACCOUNT_SID'),
+        os.environ.get('TWILIO_AUTH_TOKEN'),
+        os.environ.get('TWILIO_WHATSAPP_NUMBER'),
+    )
+    if not all(credenciais):
+        print("!!! ERRO CRÍTICO: Credenciais da Twilio não configuradas no .env !!!")
+        return None
+    return credenciais
+
+
+def _numero_whatsapp(numero_destinatario):
+    numero_limpo = ''.join(filter(str.isdigit, numero_destinatario))
+    if len(numero_limpo) == 11:
+        return f'whatsapp:+55{numero_limpo}'
+    return f'whatsapp:+{numero_limpo}'
+
+
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def _cliente_twilio_async(account_sid, auth_token):
+    loop = asyncio.get_running_loop()
+    client = _clientes_async.get(loop)
+    if client is None:
+        client = Client(account_sid, auth_token, http_client=AsyncTwilioHttpClient())
+        _clientes_async[loop] = client
+    return client
+
+
+async def fechar_cliente_twilio_async():
+    """ Fecha a sessão HTTP do cliente assíncrono do event loop atual, se houver. """
+    client = _clientes_async.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.http_client.close()
+
+
+def responder_paciente_via_whatsapp(numero_destinatario, mensagem):
+    if settings.DEBUG:
+        _simular_envio(numero_destinatario, mensagem)
+        return True
+
+    credenciais = _credenciais_twilio()
+    if not credenciais:
+        return False
+    account_sid, auth_token, twilio_number = credenciais
+
+    try:
+        client = Client(account_sid, auth_token)
+        message = client.messages.create(
+            from_=f'whatsapp:{twilio_number}',
+            body=mensagem,
+            to=_numero_whatsapp(numero_destinatario)
+        )
+        print(f"--> Mensagem enviada com sucesso para {numero_destinatario} (SID: {message.sid})")
+        return True
+    except TwilioRestException as e:
+        print(f"!!! ERRO AO ENVIAR WHATSAPP via Twilio: {e}")
+        return False
+    except Exception as e:
+        print(f"!!! ERRO INESPERADO ao enviar WhatsApp: {e}")
+        return False
+
+
+async def responder_paciente_via_whatsapp_async(numero_destinatario, mensagem):
+    anotar_resposta(mensagem)
+    if settings.DEBUG:
+        _simular_envio(numero_destinatario, mensagem)
+        return True
+
+    credenciais = _credenciais_twilio()
+    if not credenciais:
+        return False
+    account_sid, auth_token, twilio_number = credenciais
+
+    try:
+        client = _cliente_twilio_async(account_sid, auth_token)
+        message = await client.messages.create_async(
+            from_=f'whatsapp:{twilio_number}',
+            body=mensagem,
+            to=_numero_whatsapp(numero_destinatario)
+        )
+        print(f"--> Mensagem enviada com sucesso para {numero_destinatario} (SID: {message.sid})")
+        return True
+    except TwilioRestException as e:
+        print(f"!!! ERRO AO ENVIAR WHATSAPP via Twilio: {e}")
+        return False
+    except Exception as e:
+        print(f"!!! ERRO INESPERADO ao enviar WhatsApp: {e}")
+        return False
@@ -12,7 +12,7 @@ class PerfilClinicaAdmin(admin.ModelAdmin):
 
 @admin.register(Plano)
 class PlanoAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'preco_mensal', 'limite_usuarios', 'limite_mensagens_ia')
+    list_display = ('nome', 'preco_mensal', 'limite_usuarios', 'limite_mensagens_ia', 'peso_fila', 'limite_atendimentos_simultaneos')
 
 @admin.register(Assinatura)
 class AssinaturaAdmin(admin.ModelAdmin):
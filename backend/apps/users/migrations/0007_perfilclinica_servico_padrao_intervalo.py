@@ -0,0 +1,25 @@
+# Generated by Django 5.0.7 on 2026-10-18 06:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financas', '0002_remove_servico_profissional'),
+        ('users', '0006_paciente_onboarding_step'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilclinica',
+            name='intervalo_entre_sessoes',
+            field=models.PositiveIntegerField(default=0, help_text='Minutos livres mantidos entre uma sessão e outra.'),
+        ),
+        migrations.AddField(
+            model_name='perfilclinica',
+            name='servico_padrao',
+            field=models.ForeignKey(blank=True, help_text='Serviço usado pela secretária IA nos agendamentos via WhatsApp. Define a duração de cada horário.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='financas.servico'),
+        ),
+    ]
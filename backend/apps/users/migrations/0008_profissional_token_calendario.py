@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:02
+
+import uuid
+from django.db import migrations, models
+
+
+def gerar_tokens(apps, schema_editor):
+    Profissional = apps.get_model('users', 'Profissional')
+    for profissional in Profissional.objects.only('id'):
+        profissional.token_calendario = uuid.uuid4()
+        profissional.save(update_fields=['token_calendario'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_perfilclinica_servico_padrao_intervalo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profissional',
+            name='token_calendario',
+            field=models.UUIDField(editable=False, help_text='Token secreto do link da agenda no formato iCalendar (ICS).', null=True),
+        ),
+        migrations.RunPython(gerar_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='profissional',
+            name='token_calendario',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Token secreto do link da agenda no formato iCalendar (ICS).', unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_profissional_token_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plano',
+            name='limite_atendimentos_simultaneos',
+            field=models.PositiveSmallIntegerField(default=5, help_text='Máximo de mensagens da conta em atendimento ao mesmo tempo.'),
+        ),
+        migrations.AddField(
+            model_name='plano',
+            name='peso_fila',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Peso da conta no rodízio da fila do WhatsApp.'),
+        ),
+    ]
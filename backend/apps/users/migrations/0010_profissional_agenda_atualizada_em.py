@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_plano_fila_whatsapp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profissional',
+            name='agenda_atualizada_em',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Última exclusão (ou troca de profissional) de agendamento ou exceção; entra na versão do feed ICS.', null=True),
+        ),
+    ]
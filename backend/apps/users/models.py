@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from .managers import CustomUserManager
@@ -36,6 +37,18 @@ class PerfilClinica(models.Model):
     site_url = models.URLField(blank=True, null=True)
     instagram_handle = models.CharField(max_length=100, blank=True, null=True, help_text="Apenas o nome de usuário, sem o '@'.")
     logotipo = models.ImageField(upload_to=logo_directory_path, null=True, blank=True)
+    servico_padrao = models.ForeignKey(
+        'financas.Servico',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Serviço usado pela secretária IA nos agendamentos via WhatsApp. Define a duração de cada horário."
+    )
+    intervalo_entre_sessoes = models.PositiveIntegerField(
+        default=0,
+        help_text="Minutos livres mantidos entre uma sessão e outra."
+    )
     
     def __str__(self):
         return f"Perfil de {self.conta.nome_conta}"
@@ -61,6 +74,18 @@ class Profissional(AbstractUser):
     registro_profissional = models.CharField('registro profissional (CRP, CREFITO, etc.)', max_length=50, blank=True, null=True)
     contato_telefone = models.CharField('telefone', max_length=20, blank=True, null=True)
     conta = models.ForeignKey(Conta, on_delete=models.CASCADE, related_name='profissionais', null=True, blank=True)
+    token_calendario = models.UUIDField(
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+        help_text="Token secreto do link da agenda no formato iCalendar (ICS)."
+    )
+    agenda_atualizada_em = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Última exclusão (ou troca de profissional) de agendamento ou exceção; entra na versão do feed ICS."
+    )
     groups = models.ManyToManyField(
         'auth.Group',
         related_name='profissional_set',
@@ -120,6 +145,11 @@ class Plano(models.Model):
     limite_usuarios = models.PositiveIntegerField(default=1)
     limite_mensagens_ia = models.PositiveIntegerField(default=0)
     preco_mensal = models.DecimalField(max_digits=10, decimal_places=2)
+    # Divisão dos workers do WhatsApp entre as contas (ver agenda/escalonador_whatsapp.py).
+    peso_fila = models.PositiveSmallIntegerField(default=1, help_text="Peso da conta no rodízio da fila do WhatsApp.")
+    limite_atendimentos_simultaneos = models.PositiveSmallIntegerField(
+        default=5, help_text="Máximo de mensagens da conta em atendimento ao mesmo tempo."
+    )
 
     def __str__(self):
         return self.get_nome_display()
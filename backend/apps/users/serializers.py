@@ -15,7 +15,12 @@ class AssinaturaSerializer(serializers.ModelSerializer):
 class PerfilClinicaSerializer(serializers.ModelSerializer):
     class Meta:
         model = PerfilClinica
-        fields = ['bio', 'endereco_completo', 'site_url', 'instagram_handle', 'logotipo']
+        fields = ['bio', 'endereco_completo', 'site_url', 'instagram_handle', 'logotipo', 'servico_padrao', 'intervalo_entre_sessoes']
+
+    def validate_servico_padrao(self, servico):
+        if servico and servico.conta != self.context['request'].user.conta:
+            raise serializers.ValidationError("Este serviço não pertence à sua clínica/conta.")
+        return servico
 
 class ContaSerializer(serializers.ModelSerializer):
     assinatura = AssinaturaSerializer(read_only=True)
@@ -3,6 +3,7 @@ from .models import Profissional, Paciente, CategoriaFAQ, ItemFAQ, PerfilClinica
 from .serializers import ProfissionalSerializer, PacienteSerializer, CategoriaFAQSerializer, ItemFAQSerializer, PerfilClinicaSerializer, PacienteSerializerSimple
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Sum
@@ -109,7 +110,12 @@ class ProfissionalLogadoView(APIView):
 
     def get(self, request):
         serializer = ProfissionalSerializer(request.user)
-        return Response(serializer.data)
+        data = serializer.data
+        # O link da agenda ICS só é exposto ao próprio profissional.
+        data['url_calendario'] = request.build_absolute_uri(
+            reverse('calendario-ics', args=[request.user.token_calendario])
+        )
+        return Response(data)
 
 class CategoriaFAQViewSet(viewsets.ModelViewSet):
     """
@@ -93,6 +93,17 @@ DATABASES = {
     }
 }
 
+# Cache compartilhado entre o servidor web e o worker da fila do WhatsApp (processos
+# diferentes): a agenda em cache, o retrato das contas e as versões do FAQ e das respostas
+# da IA são invalidados pelos sinais no processo que fez a alteração e precisam valer para
+# todos. Fica no Redis (serviço 'redis' do docker-compose), em memória, sem consultas ao banco.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://redis:6379/0'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,4 +159,11 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Com a fila ativa, o webhook do WhatsApp só registra a mensagem e responde na hora;
+# o processamento fica com o comando `python manage.py processar_fila_whatsapp`.
+WHATSAPP_USAR_FILA = os.environ.get('WHATSAPP_USAR_FILA', 'True') == 'True'
+# Segundos sem nova mensagem do mesmo telefone antes de a fila atender; mensagens em sequência
+# ("oi" / "tudo bem?" / "queria marcar") são atendidas juntas, numa única resposta.
+WHATSAPP_JANELA_AGRUPAMENTO = float(os.environ.get('WHATSAPP_JANELA_AGRUPAMENTO', '3'))